@@ -1,16 +1,28 @@
 # RePDFBuilding.py
 import fitz
 import os
+import threading
 from collections import defaultdict
 from datetime import datetime
+from xml.sax.saxutils import quoteattr, escape
 
-def highlight_refined_texts(output):
+# overlay highlights: hex colour, and the opacity the viewer should draw them with
+HIGHLIGHT_COLOR = "#FFFF00"
+HIGHLIGHT_OPACITY = 0.4
+
+# colour scheme of the annotated copies, part of the annotated-copy cache key
+ANNOTATION_SCHEME = "highlight:default"
+
+def highlight_refined_texts(output, cache=None):
     """
     Create annotated copies of PDFs with highlights for the selected sections.
     - For each document in output['extracted_sections'], we create a copy of the original PDF
       (uploads/annotated_<timestamp>_<origfile>) and add highlight annotations per rect.
     - We DO NOT modify the original PDF.
     - Returns a mapping: { "original_filename.pdf": "annotated_<ts>_original_filename.pdf", ... }
+    - With cache (an AnnotatedPdfCache) copies are named annotated_<key>_<origfile> instead,
+      and a copy with the same source bytes, rects and colours is returned without
+      opening the PDF.
     """
     print("[RePDFBuilding] Starting highlight -> annotated-copy process")
     files = defaultdict(list)
@@ -29,6 +41,15 @@ def highlight_refined_texts(output):
             print(f"[RePDFBuilding] Skipping missing file: {src_path}")
             continue
 
+        key = None
+        if cache is not None:
+            key = cache.key(src_path, [r for sec in sections for r in _section_rects(sec)], ANNOTATION_SCHEME)
+            cached = cache.get(key)
+            if cached is not None:
+                annotated_map[fname] = cached
+                print(f"[RePDFBuilding] Reusing annotated copy: {cached}")
+                continue
+
         try:
             src_doc = fitz.open(src_path)
         except Exception as e:
@@ -89,12 +110,19 @@ def highlight_refined_texts(output):
                 print(f"[RePDFBuilding] No rects for section '{sec.get('section_title')}' in {fname}; skipping.")
 
         if modified:
-            ts = datetime.utcnow().strftime("%Y%m%d%H%M%S%f")
-            annotated_name = f"annotated_{ts}_{fname}"
+            if key is not None:
+                annotated_name = cache.filename(key, "annotated", fname)
+            else:
+                ts = datetime.utcnow().strftime("%Y%m%d%H%M%S%f")
+                annotated_name = f"annotated_{ts}_{fname}"
             annotated_path = os.path.join("uploads", annotated_name)
+            tmp_path = f"{annotated_path}.{os.getpid()}.{threading.get_ident()}.tmp"
             try:
-                # save annotated copy (do not overwrite original)
-                new_doc.save(annotated_path)
+                # save annotated copy (do not overwrite original); readers never see a partial file
+                new_doc.save(tmp_path)
+                os.replace(tmp_path, annotated_path)
+                if key is not None:
+                    cache.put(key, annotated_name)
                 annotated_map[fname] = annotated_name
                 print(f"[RePDFBuilding] Saved annotated copy: {annotated_path}")
             except Exception as e:
@@ -107,3 +135,91 @@ def highlight_refined_texts(output):
 
     print("[RePDFBuilding] Finished highlighting. Annotated map:", annotated_map)
     return annotated_map
+
+
+def _section_rects(sec):
+    """(page number, bbox) for each highlight rect of a section, as highlight_refined_texts reads them."""
+    page_hint = sec.get('page_number', None)
+    for r in sec.get('rects', []) or []:
+        if isinstance(r, dict) and 'page' in r and 'bbox' in r:
+            bbox = r['bbox']
+            if isinstance(bbox, (list, tuple)) and len(bbox) == 4:
+                yield int(r['page']), bbox
+        elif isinstance(r, (list, tuple)) and len(r) == 4 and page_hint:
+            yield int(page_hint), r
+
+
+def _fmt(v):
+    return f"{v:.2f}".rstrip('0').rstrip('.')
+
+
+def highlight_overlays(output, fmt="json", color=HIGHLIGHT_COLOR, opacity=HIGHLIGHT_OPACITY):
+    """
+    Highlight geometry for the viewer to draw over the original PDFs, instead of saving an
+    annotated copy of every document on every query.
+    - The source PDF is only opened to read page geometry; nothing is written.
+    - Rects are converted to PDF user space (origin bottom-left, as XFDF and viewer
+      annotation APIs expect) with quad points upper-left, upper-right, lower-left,
+      lower-right.
+    - fmt "json": { filename: {"coordinates": "pdf", "color", "opacity",
+      "pages": {page: [width, height]}, "highlights": [{"page", "rect", "quad_points",
+      "section_title", "importance_rank"}]} }; fmt "xfdf": { filename: XFDF string }.
+    """
+    files = defaultdict(list)
+    for sec in output.get("extracted_sections", []):
+        if sec.get('document'):
+            files[sec['document']].append(sec)
+
+    overlays = {}
+    for fname, sections in files.items():
+        src_path = os.path.join("uploads", fname)
+        if not os.path.exists(src_path):
+            print(f"[RePDFBuilding] Skipping missing file: {src_path}")
+            continue
+        try:
+            src_doc = fitz.open(src_path)
+        except Exception as e:
+            print(f"[RePDFBuilding] Failed to open {src_path}: {e}")
+            continue
+
+        pages, highlights = {}, []
+        with src_doc:
+            for sec in sections:
+                for pnum, bbox in _section_rects(sec):
+                    if pnum < 1 or pnum > len(src_doc):
+                        continue
+                    page = src_doc[pnum - 1]
+                    rect = (fitz.Rect(*map(float, bbox)) * ~page.transformation_matrix).normalize()
+                    pages[pnum] = [round(page.mediabox.width, 2), round(page.mediabox.height, 2)]
+                    highlights.append({
+                        "page": pnum,
+                        "rect": [round(v, 2) for v in (rect.x0, rect.y0, rect.x1, rect.y1)],
+                        "quad_points": [round(v, 2) for v in (rect.x0, rect.y1, rect.x1, rect.y1,
+                                                              rect.x0, rect.y0, rect.x1, rect.y0)],
+                        "section_title": sec.get('section_title'),
+                        "importance_rank": sec.get('importance_rank'),
+                    })
+        if not highlights:
+            continue
+        if fmt == "xfdf":
+            overlays[fname] = _xfdf(fname, highlights, color, opacity)
+        else:
+            overlays[fname] = {"coordinates": "pdf", "color": color, "opacity": opacity,
+                               "pages": pages, "highlights": highlights}
+    return overlays
+
+
+def _xfdf(fname, highlights, color, opacity):
+    annots = []
+    for i, h in enumerate(highlights):
+        title = h.get('section_title') or ""
+        annots.append(
+            f'<highlight page="{h["page"] - 1}" rect="{",".join(map(_fmt, h["rect"]))}" '
+            f'coords="{",".join(map(_fmt, h["quad_points"]))}" color="{color}" opacity="{opacity}" '
+            f'name="hl-{i}" title={quoteattr(title)}><contents>{escape(title)}</contents></highlight>'
+        )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<xfdf xmlns="http://ns.adobe.com/xfdf/" xml:space="preserve">'
+        f'<f href={quoteattr(fname)}/><annots>{"".join(annots)}</annots></xfdf>'
+    )
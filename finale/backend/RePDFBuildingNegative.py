@@ -1,16 +1,27 @@
 # RePDFBuilding.py
 import fitz
 import os
+import threading
 from collections import defaultdict
 from datetime import datetime
+from RePDFBuilding import _section_rects
 
-def highlight_refined_texts_negative(output):
+# colour scheme of the annotated copies, part of the annotated-copy cache key
+ANNOTATION_SCHEME = "highlight:1,0.6,0.6"
+
+# overlay colour of contradicting sections (the light red of the annotated copies)
+NEGATIVE_HIGHLIGHT_COLOR = "#FF9999"
+
+def highlight_refined_texts_negative(output, cache=None):
     """
     Create annotated copies of PDFs with highlights for the selected sections.
     - For each document in output['extracted_sections'], we create a copy of the original PDF
       (uploads/annotated_<timestamp>_<origfile>) and add highlight annotations per rect.
     - We DO NOT modify the original PDF.
-    - Returns a mapping: { "original_filename.pdf": "annotated_<ts>_original_filename.pdf", ... }
+    - Returns a mapping: { "original_filename.pdf": "annotatedNeg_<ts>_original_filename.pdf", ... }
+    - With cache (an AnnotatedPdfCache) copies are named annotatedNeg_<key>_<origfile> instead,
+      and a copy with the same source bytes, rects and colours is returned without
+      opening the PDF.
     """
     print("[RePDFBuilding] Starting highlight -> annotated-copy process")
     files = defaultdict(list)
@@ -29,6 +40,15 @@ def highlight_refined_texts_negative(output):
             print(f"[RePDFBuilding] Skipping missing file: {src_path}")
             continue
 
+        key = None
+        if cache is not None:
+            key = cache.key(src_path, [r for sec in sections for r in _section_rects(sec)], ANNOTATION_SCHEME)
+            cached = cache.get(key)
+            if cached is not None:
+                annotated_map[fname] = cached
+                print(f"[RePDFBuilding] Reusing annotated copy: {cached}")
+                continue
+
         try:
             src_doc = fitz.open(src_path)
         except Exception as e:
@@ -90,12 +110,19 @@ def highlight_refined_texts_negative(output):
                 print(f"[RePDFBuilding] No rects for section '{sec.get('section_title')}' in {fname}; skipping.")
 
         if modified:
-            ts = datetime.utcnow().strftime("%Y%m%d%H%M%S%f")
-            annotated_name = f"annotatedNeg_{ts}_{fname}"
+            if key is not None:
+                annotated_name = cache.filename(key, "annotatedNeg", fname)
+            else:
+                ts = datetime.utcnow().strftime("%Y%m%d%H%M%S%f")
+                annotated_name = f"annotatedNeg_{ts}_{fname}"
             annotated_path = os.path.join("uploads", annotated_name)
+            tmp_path = f"{annotated_path}.{os.getpid()}.{threading.get_ident()}.tmp"
             try:
-                # save annotated copy (do not overwrite original)
-                new_doc.save(annotated_path)
+                # save annotated copy (do not overwrite original); readers never see a partial file
+                new_doc.save(tmp_path)
+                os.replace(tmp_path, annotated_path)
+                if key is not None:
+                    cache.put(key, annotated_name)
                 annotated_map[fname] = annotated_name
                 print(f"[RePDFBuilding] Saved annotated copy: {annotated_path}")
             except Exception as e:
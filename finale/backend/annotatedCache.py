@@ -0,0 +1,175 @@
+# annotatedCache.py
+# Reuse of annotated PDF copies: the same highlights on the same source bytes map to the
+# same file in uploads/, so repeated queries skip PyMuPDF.
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from ingestCache import file_sha256
+
+logger = logging.getLogger(__name__)
+
+KEY_HEX = 24
+# annotated_<key>_<source>.pdf / annotatedNeg_<key>_<source>.pdf (timestamped copies have
+# 20 digits where the key is, so they are never mistaken for cache entries)
+CACHED_NAME_RE = re.compile(rf"^(annotated|annotatedNeg)_([0-9a-f]{{{KEY_HEX}}})_(.+)$")
+# <name>.<pid>.<thread id>.tmp: a copy being saved (see RePDFBuilding)
+TMP_NAME_RE = re.compile(r"\.(\d+)\.\d+\.tmp$")
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True      # exists, owned by someone else
+    return True
+
+
+class AnnotatedPdfCache:
+    """
+    Annotated copies in `directory` keyed by (source SHA-256, sorted rect set, colour scheme).
+    - key(src_path, rects, scheme) hashes the three; source hashes are remembered per
+      (path, size, mtime) so a hit reads no PDF bytes after the first query.
+    - The key is part of the file name (<prefix>_<key>_<source>), so the cache survives
+      restarts: entries are rebuilt from the directory, least recently used first by mtime
+      (a hit touches the file).
+    - Files are evicted least recently used first once their total size passes max_bytes,
+      but never within grace_seconds of being handed out (get/put): clients fetch the
+      returned name from /uploads afterwards, so the cache may run over max_bytes until
+      the grace period ends.
+    - Startup deletes .tmp files left by saves that never finished (their process is gone
+      or they are older than grace_seconds).
+    """
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024, grace_seconds=600):
+        self.directory = directory
+        self.max_bytes = int(max_bytes)
+        self.grace_seconds = max(0.0, float(grace_seconds))
+        self._entries = OrderedDict()    # key -> (filename, size, last handed out)
+        self._bytes = 0
+        self._source_hashes = {}         # path -> (size, mtime_ns, sha256)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "deferred_evictions": 0, "stale_tmp_removed": 0}
+        self._scan()
+
+    def _scan(self):
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        found = []
+        now = time.time()
+        for name in names:
+            m = CACHED_NAME_RE.match(name)
+            if m is None:
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            tmp = TMP_NAME_RE.search(name)
+            if tmp is not None:
+                if _pid_alive(int(tmp.group(1))) and now - st.st_mtime < self.grace_seconds:
+                    continue     # another process is still saving it
+                try:
+                    os.remove(path)
+                    self._stats["stale_tmp_removed"] += 1
+                except OSError as e:
+                    logger.warning(f"Failed to remove stale annotated copy {name}: {e}")
+                continue
+            found.append((st.st_mtime, m.group(2), name, st.st_size))
+        for mtime, key, name, size in sorted(found):
+            self._entries[key] = (name, size, mtime)
+            self._bytes += size
+        with self._lock:
+            self._evict()
+
+    def _source_sha(self, src_path):
+        st = os.stat(src_path)
+        with self._lock:
+            known = self._source_hashes.get(src_path)
+        if known is not None and known[:2] == (st.st_size, st.st_mtime_ns):
+            return known[2]
+        sha = file_sha256(src_path)
+        with self._lock:
+            self._source_hashes[src_path] = (st.st_size, st.st_mtime_ns, sha)
+        return sha
+
+    def key(self, src_path, rects, scheme):
+        """Cache key of highlighting rects [(page, (x0, y0, x1, y1))] on src_path in scheme."""
+        rect_set = sorted({(int(p), tuple(round(float(v), 2) for v in bbox)) for p, bbox in rects})
+        payload = json.dumps([self._source_sha(src_path), rect_set, scheme], separators=(',', ':'))
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:KEY_HEX]
+
+    @staticmethod
+    def filename(key, prefix, source_name):
+        return f"{prefix}_{key}_{source_name}"
+
+    def get(self, key):
+        """Filename of the cached copy for key, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not os.path.exists(os.path.join(self.directory, entry[0])):
+                del self._entries[key]
+                self._bytes -= entry[1]
+                entry = None
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries[key] = (entry[0], entry[1], time.time())
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+        try:
+            os.utime(os.path.join(self.directory, entry[0]))
+        except OSError:
+            pass
+        return entry[0]
+
+    def put(self, key, filename):
+        """Record a copy just written to directory/filename and evict past max_bytes."""
+        try:
+            size = os.path.getsize(os.path.join(self.directory, filename))
+        except OSError:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (filename, size, time.time())
+            self._bytes += size
+            self._evict()
+
+    def _evict(self):
+        # the newest entry stays even if it alone exceeds max_bytes: it is about to be served
+        now = time.time()
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            if now - next(iter(self._entries.values()))[2] < self.grace_seconds:
+                # least recently used is still within its grace period, so is everything else
+                self._stats["deferred_evictions"] += 1
+                break
+            _, (name, size, _) = self._entries.popitem(last=False)
+            self._bytes -= size
+            self._stats["evictions"] += 1
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError as e:
+                logger.warning(f"Failed to evict annotated copy {name}: {e}")
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+            s["files"] = len(self._entries)
+            s["bytes"] = self._bytes
+            s["max_bytes"] = self.max_bytes
+            s["grace_seconds"] = self.grace_seconds
+        lookups = s["hits"] + s["misses"]
+        s["hit_rate"] = round(s["hits"] / lookups, 4) if lookups else 0.0
+        return s
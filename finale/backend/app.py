@@ -1,57 +1,187 @@
 # app.py
 # Replace your current app.py with this file. (Only backend changes.)
-from flask import Flask, request, jsonify, send_from_directory
+from startupProfile import profile, lazy_import, in_spawned_worker, FAST_START
+from flask import Flask, request, jsonify, send_from_directory, Response
 from flask_cors import CORS
 import os
-from generate_audio import generate_audio
-from pydub import AudioSegment
 from werkzeug.utils import secure_filename
 import logging
 from pathlib import Path
 import fitz  # PyMuPDF
 import pandas as pd
-import joblib
 import re
-from sklearn.preprocessing import MinMaxScaler
 import time
+import math
+import queue
+import json
+import zipfile
+import threading
+import warnings
 from datetime import datetime
 import numpy as np
-from RePDFBuilding import highlight_refined_texts
-from sentence_transformers import SentenceTransformer, util
-from llmProvider import LLMClient
-from litellm import completion
+from RePDFBuilding import highlight_refined_texts, highlight_overlays, HIGHLIGHT_COLOR
 import traceback
 from werkzeug.utils import secure_filename
-from gtts import gTTS
 import os, time, traceback
 # from nltk.corpus import wordnet
 # from nltk.tokenize import word_tokenize
 # import nltk
 import urllib.parse
 from datetime import datetime
-import azure.cognitiveservices.speech as speechsdk
 import random
 import xml.sax.saxutils as saxutils
-from RePDFBuildingNegative import highlight_refined_texts_negative
+from RePDFBuildingNegative import highlight_refined_texts_negative, NEGATIVE_HIGHLIGHT_COLOR
+from ingestCache import IngestCache, file_sha256, make_version_tag
+from pdfParser import analyze_pdf_sections, iter_pdf_pages, analyze_many, LineStore
+from featureEngine import preprocess_features, rows_to_frame, heading_feature_matrix, HEADING_FEATURES, RunningFeatures
+from ingestJobs import IngestJobQueue
+from forestInference import load_classifier
+from warmup import Warmup
+from documentStore import DocumentStore, embed_text
+from sectionEncoder import encode_texts, ForwardLock
+from inferenceBroker import InferenceBroker
+from sectionIndex import SectionIndex
+from embeddingCache import EmbeddingCache
+from lexicalIndex import LexicalIndex
+from sectionGraph import SectionGraph
+from nearDuplicates import DuplicateIndex
+from embedderBackend import build_embedder
+from annotatedCache import AnnotatedPdfCache
+# heavy dependencies, per subsystem; imported now, or on first use with FAST_START=1
+sentence_transformers = lazy_import("sentence_transformers", "embedder")
+st_util = lazy_import("sentence_transformers.util", "embedder")
+llm_provider = lazy_import("llmProvider", "llm")
+litellm = lazy_import("litellm", "llm")
+gtts = lazy_import("gtts", "tts")
+pydub = lazy_import("pydub", "tts")
+speechsdk = lazy_import("azure.cognitiveservices.speech", "tts")
+tts_providers = lazy_import("generate_audio", "tts")
 # nltk.download('punkt')
 # nltk.download('punkt_tab')
 # nltk.download('wordnet')
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
-# Initialize LLM client
-llm=LLMClient()
+# LLM client, created on first use (or at import unless FAST_START)
+llm = None
+_llm_lock = threading.Lock()
+
+def get_llm():
+    global llm
+    if llm is None:
+        with _llm_lock:
+            if llm is None:
+                with profile.measure("client", "LLMClient", "llm"):
+                    llm = llm_provider.LLMClient()
+    return llm
+
+if not FAST_START and not in_spawned_worker():
+    get_llm()
 app = Flask(__name__)
 CORS(app)
 
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'pdf'}
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", str(500 * 1024 * 1024)))  # per /upload/batch request
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "100"))
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
+MODEL_PATH = "heading_classifier_with_font_count_norm_textNorm_5.pkl"
+# classifier batches above this many rows (e.g. /upload/batch) use sklearn instead of the
+# compiled forest, which is slower per row on large batches (0 = always compiled)
+CLASSIFIER_SKLEARN_ABOVE_ROWS = int(os.getenv("CLASSIFIER_SKLEARN_ABOVE_ROWS", "1500"))
+# Bump whenever analyze_pdf_sections / section assembly changes what /upload returns,
+# so cached ingest results from the old parser are invalidated.
+PARSER_VERSION = "1"
+INGEST_CACHE_DIR = os.getenv("INGEST_CACHE_DIR", "ingest_cache")
+INGEST_CACHE_ENABLED = os.getenv("INGEST_CACHE", "1") != "0"
+# cache directories of other parser/classifier versions are deleted at startup once no
+# entry was written to them for this many days (0 = never delete them)
+INGEST_CACHE_PRUNE_DAYS = float(os.getenv("INGEST_CACHE_PRUNE_DAYS", "7"))
+# /upload?async=1: background workers and the number of jobs allowed to wait before 429
+INGEST_JOB_WORKERS = int(os.getenv("INGEST_JOB_WORKERS", "2"))
+INGEST_JOB_QUEUE_DEPTH = int(os.getenv("INGEST_JOB_QUEUE_DEPTH", "16"))
+INGEST_JOB_RETENTION_SECONDS = int(os.getenv("INGEST_JOB_RETENTION_SECONDS", "3600"))
+# warm-up before /readyz reports ready; WARMUP=0 skips it (models then load on first use)
+WARMUP_ENABLED = os.getenv("WARMUP", "1") != "0"
+WARMUP_ROWS = int(os.getenv("WARMUP_ROWS", "256"))
+# sections are embedded once at upload and kept here for the query endpoints
+EMBEDDER_MODEL_ID = 'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2'
+# torch | torch-int8 | onnx (see embedderBackend.py); stored and cached vectors are kept
+# per backend, so switching re-embeds rather than mixing vectors from different backends
+EMBEDDER_BACKEND = os.getenv("EMBEDDER_BACKEND", "torch")
+DOC_STORE_DIR = os.getenv("DOC_STORE_DIR", "document_store")
+DOC_STORE_MAX_LOADED = int(os.getenv("DOC_STORE_MAX_LOADED", "256"))
+# query-time encodes from concurrent requests are batched together (see inferenceBroker.py);
+# only sets of at most INFER_BROKER_MAX_TEXTS texts go through the broker, larger ones
+# (client-sent section sets) are encoded on the request thread so they never queue in
+# front of single queries
+INFER_BROKER_ENABLED = os.getenv("INFER_BROKER", "1") != "0"
+INFER_BATCH_MAX = int(os.getenv("INFER_BATCH_MAX", "32"))
+INFER_BATCH_WAIT_MS = float(os.getenv("INFER_BATCH_WAIT_MS", "5"))
+INFER_BROKER_MAX_TEXTS = int(os.getenv("INFER_BROKER_MAX_TEXTS", "8"))
+# text -> vector cache for request-time encodes (memory LRU + two memory-mapped disk
+# generations of EMBED_CACHE_MAX_DISK_MB / 2 each; the older is dropped on rotation)
+EMBED_CACHE_ENABLED = os.getenv("EMBED_CACHE", "1") != "0"
+EMBED_CACHE_DIR = os.getenv("EMBED_CACHE_DIR", "embedding_cache")
+EMBED_CACHE_MAX_ITEMS = int(os.getenv("EMBED_CACHE_MAX_ITEMS", "20000"))
+EMBED_CACHE_MAX_DISK_MB = int(os.getenv("EMBED_CACHE_MAX_DISK_MB", "1024"))
+# pdf_query / role_query retrieval: "dense" scores every section with embeddings;
+# "hybrid" takes the HYBRID_CANDIDATES best BM25 sections and reranks only those
+# (per request: {"retrieval": "hybrid"})
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "dense")
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "200"))
+# corpus-wide /search: IVF lists probed per query, and how many hits are handed to MMR
+SEARCH_NPROBE = int(os.getenv("SEARCH_NPROBE", "16"))
+# in-memory copy of the corpus vectors (int8 | float16 | float32); the shortlist of
+# SEARCH_RESCORE x k first-pass hits is re-scored with the exact float32 vectors
+SEARCH_INDEX_CODEC = os.getenv("SEARCH_INDEX_CODEC", "int8")
+SEARCH_RESCORE = int(os.getenv("SEARCH_RESCORE", "4"))
+SEARCH_CANDIDATES = int(os.getenv("SEARCH_CANDIDATES", "100"))
+# near-duplicate sections (MinHash estimate of word-shingle Jaccard >= DEDUP_THRESHOLD)
+# are grouped at upload; queries score one section per group and list the copies under
+# it (per request: {"dedup": false}). Vectors are stored exact: only copies with the very
+# same text share their canonical's vector.
+DEDUP_SECTIONS = os.getenv("DEDUP_SECTIONS", "1") != "0"
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.85"))
+# query highlights: "pdf" saves an annotated copy of every document per query, "overlay"
+# returns JSON geometry per document for a client to draw, "xfdf" the same as XFDF.
+# Overlay modes write nothing; POST /annotated_pdf builds a copy for download. The bundled
+# QueryDocumentViewer only opens annotated_files, so "pdf" is the default and overlay
+# modes are opt-in for clients that draw the geometry themselves.
+# (per request: {"highlight": "overlay" | "xfdf" | "pdf"})
+HIGHLIGHT_MODE = os.getenv("HIGHLIGHT_MODE", "pdf")
+# annotated copies ("pdf" mode and /annotated_pdf) are reused when the source bytes,
+# highlight rects and colours match; least recently used copies are deleted past
+# ANNOTATED_CACHE_MAX_MB of uploads/ (ANNOTATED_CACHE=0: a fresh copy every time), but
+# not within ANNOTATED_CACHE_GRACE_S of being returned, while the client may still fetch it
+ANNOTATED_CACHE = os.getenv("ANNOTATED_CACHE", "1") != "0"
+ANNOTATED_CACHE_MAX_MB = float(os.getenv("ANNOTATED_CACHE_MAX_MB", "512"))
+ANNOTATED_CACHE_GRACE_S = float(os.getenv("ANNOTATED_CACHE_GRACE_S", "600"))
+# neighbours kept per section in the kNN graph behind /sections/<id>/similar
+SECTION_GRAPH_K = int(os.getenv("SECTION_GRAPH_K", "10"))
+# pdf_query "Negative" view: at most CONTRA_TOP_K sections with negative query similarity;
+# CONTRA_DIVERSITY (an MMR lambda, unset = off) spreads them over a pool of
+# CONTRA_POOL_FACTOR x k candidates (per request: contra_top_k / contra_diversity)
+CONTRA_TOP_K = int(os.getenv("CONTRA_TOP_K", "5"))
+CONTRA_DIVERSITY = float(os.environ["CONTRA_DIVERSITY"]) if os.getenv("CONTRA_DIVERSITY") else None
+CONTRA_POOL_FACTOR = int(os.getenv("CONTRA_POOL_FACTOR", "4"))
+# per-request contra_top_k is clamped to this
+CONTRA_MAX_TOP_K = int(os.getenv("CONTRA_MAX_TOP_K", "50"))
+
 model = None
 embedder = None
+ingest_cache = None
+document_store = None
+inference_broker = None
+section_index = None
+embedding_cache = None
+lexical_index = None
+section_graph = None
+duplicate_index = None
+annotated_cache = None
 #-------------------------
 # generate contradictory
 #-------------------------
@@ -75,282 +205,215 @@ embedder = None
 #-------------------------
 # load model
 #-------------------------
-def load_model():
-    global model, embedder
-    model_path = "heading_classifier_with_font_count_norm_textNorm_5.pkl"
+# Each model loads once: at startup via load_model(), or on first use through
+# get_classifier()/get_embedder() when FAST_START skips the startup load.
+_model_locks = {"classifier": threading.Lock(), "embedder": threading.Lock()}
+_models_attempted = set()
+
+def load_heading_classifier():
+    global model, ingest_cache
+    model_path = MODEL_PATH
     if Path(model_path).exists():
-        model = joblib.load(model_path)
-        logger.info("Heading classifier model loaded successfully")
+        with profile.measure("model", model_path, "classifier"):
+            model = load_classifier(model_path, sklearn_above_rows=CLASSIFIER_SKLEARN_ABOVE_ROWS)
+        logger.info(f"Heading classifier model loaded successfully ({type(model).__name__})")
+        if INGEST_CACHE_ENABLED:
+            version_tag = make_version_tag(PARSER_VERSION, file_sha256(model_path))
+            ingest_cache = IngestCache(INGEST_CACHE_DIR, version_tag,
+                                       prune_after_seconds=INGEST_CACHE_PRUNE_DAYS * 86400 or None)
+            logger.info(f"Ingest cache enabled at {INGEST_CACHE_DIR}/{version_tag}")
     else:
         logger.warning(f"Model file {model_path} not found!")
 
+# every forward pass of the shared embedder holds this, one batch at a time (see sectionEncoder.py)
+embedder_lock = ForwardLock()
+
+def encode_sections(texts):
+    """Normalised float32 embeddings, one row per text (length-bucketed batches)."""
+    return encode_texts(embedder, texts, normalize=True, lock=embedder_lock)
+
+def _encode_uncached(texts):
+    if inference_broker is not None and len(texts) <= INFER_BROKER_MAX_TEXTS:
+        return inference_broker.encode(texts)
+    return encode_sections(texts)
+
+def embed_texts(texts):
+    """Request-time encodes: embedding cache first, then the micro-batcher (query-sized sets) or a direct encode."""
+    if embedding_cache is None:
+        return _encode_uncached(texts)
+    vectors, missing = embedding_cache.get_many(texts)
+    if missing:
+        missing_texts = [texts[i] for i in missing]
+        encoded = _encode_uncached(missing_texts)
+        vectors[missing] = encoded
+        embedding_cache.put_many(missing_texts, encoded)
+    return vectors
+
+def embed_query(text):
+    return embed_texts([text])[0]
+
+def _document_vectors(doc_id):
+    doc = document_store.get(doc_id)
+    return doc.vectors if doc is not None else None
+
+def _lexical_text(section):
+    # headings carry many of the keywords (clause numbers, product names)
+    return f"{section.get('heading') or ''} {section.get('text') or ''}"
+
+def _document_lexical_texts(doc_id):
+    doc = document_store.get(doc_id)
+    return [_lexical_text(s) for s in doc.sections] if doc is not None else None
+
+def load_embedder():
+    global embedder, document_store, inference_broker, section_index, embedding_cache, lexical_index, section_graph
+    global duplicate_index
     try:
         cached_path = Path("./cached_model")
-        if cached_path.exists():
-            embedder = SentenceTransformer(str(cached_path))
-            logger.info("SentenceTransformer loaded from ./cached_model")
-        else:
-            logger.info("Cached model not found. Downloading...")
-            embedder = SentenceTransformer('sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2')
-            embedder.save(str(cached_path))
-            logger.info("Model downloaded and saved to ./cached_model")
+        with profile.measure("model", "SentenceTransformer", "embedder"):
+            if cached_path.exists():
+                embedder = sentence_transformers.SentenceTransformer(str(cached_path))
+                logger.info("SentenceTransformer loaded from ./cached_model")
+            else:
+                logger.info("Cached model not found. Downloading...")
+                embedder = sentence_transformers.SentenceTransformer(EMBEDDER_MODEL_ID)
+                embedder.save(str(cached_path))
+                logger.info("Model downloaded and saved to ./cached_model")
+        with profile.measure("model", f"embedder backend {EMBEDDER_BACKEND}", "embedder"):
+            embedder, backend = build_embedder(embedder, EMBEDDER_BACKEND, str(cached_path))
+        logger.info(f"Embedder backend: {backend}")
     except Exception as e:
         logger.exception(f"Failed to load SentenceTransformer: {e}")
         embedder = None
+        return
+    model_id = EMBEDDER_MODEL_ID if backend == "torch" else f"{EMBEDDER_MODEL_ID}#{backend}"
+    model_tag = make_version_tag(model_id, "normalized")
+    document_store = DocumentStore(
+        DOC_STORE_DIR, model_tag,
+        encode=encode_sections, max_loaded=DOC_STORE_MAX_LOADED
+    )
+    with profile.measure("model", "SectionIndex", "embedder"):
+        section_index = SectionIndex(
+            os.path.join(DOC_STORE_DIR, "index", model_tag), load_vectors=document_store.vectors,
+            nprobe=SEARCH_NPROBE, codec=SEARCH_INDEX_CODEC, rescore=SEARCH_RESCORE
+        )
+        # documents stored under another model are re-embedded here, before serving
+        section_index.sync(document_store.doc_ids(), load_vectors=_document_vectors)
+    with profile.measure("model", "LexicalIndex", "embedder"):
+        lexical_index = LexicalIndex()
+        lexical_index.sync(document_store.doc_ids(), _document_lexical_texts)
+    if DEDUP_SECTIONS:
+        with profile.measure("model", "DuplicateIndex", "embedder"):
+            duplicate_index = DuplicateIndex(threshold=DEDUP_THRESHOLD)
+            # in upload order, so every restart forms the same groups as the uploads did
+            duplicate_index.sync(document_store.doc_ids(by_created=True), _document_lexical_texts)
+    with profile.measure("model", "SectionGraph", "embedder"):
+        section_graph = SectionGraph(
+            os.path.join(DOC_STORE_DIR, "graph", model_tag), load_vectors=document_store.vectors,
+            k=SECTION_GRAPH_K, candidates=section_index.candidates
+        )
+        section_graph.sync(document_store.doc_ids(), load_vectors=_document_vectors)
+    if EMBED_CACHE_ENABLED:
+        embedding_cache = EmbeddingCache(
+            EMBED_CACHE_DIR, model_id, normalize=True,
+            dim=embedder.get_sentence_embedding_dimension(), max_items=EMBED_CACHE_MAX_ITEMS,
+            max_disk_bytes=EMBED_CACHE_MAX_DISK_MB * 1024 * 1024
+        )
+    if INFER_BROKER_ENABLED:
+        inference_broker = InferenceBroker(encode_sections, max_batch=INFER_BATCH_MAX, max_wait_ms=INFER_BATCH_WAIT_MS)
 
+_MODEL_LOADERS = {"classifier": load_heading_classifier, "embedder": load_embedder}
 
-# -------------------------
-# PDF text utilities
-# -------------------------
-def is_bullet_point(text):
-    text = text.strip()
-    bullet_patterns = [
-        r'^[•·▪▫▬►‣⁃]\s*', r'^\*\s+', r'^-\s+', r'^—\s+', r'^–\s+',
-        r'^\+\s+', r'^>\s+', r'^»\s+', r'^○\s+', r'^□\s+', r'^▪\s+', r'^▫\s+'
-    ]
-    for pattern in bullet_patterns:
-        if re.match(pattern, text):
-            return True
-    if re.match(r'^\d+[\.\)]\s*$', text) or re.match(r'^[a-zA-Z][\.\)]\s*$', text):
-        return True
-    if len(text) <= 3 and re.match(r'^[^\w\s]+$', text):
-        return True
-    return False
-
-def should_ignore_text(text):
-    text = text.strip()
-    if len(text) < 2:
-        return True
-    if is_bullet_point(text):
-        return True
-    if re.match(r'^\d+$', text) or re.match(r'^[a-zA-Z]$', text):
-        return True
-    artifacts = ['©', '®', '™', '...', '…']
-    if text in artifacts:
-        return True
-    return False
-
-def clean_text(text):
-    text = text.strip()
-    bullet_patterns = [
-        r'^[•·▪▫▬►‣⁃]\s*', r'^\*\s+', r'^-\s+', r'^—\s+', r'^–\s+',
-        r'^\+\s+', r'^>\s+', r'^»\s+', r'^○\s+', r'^□\s+', r'^▪\s+', r'^▫\s+'
-    ]
-    for pattern in bullet_patterns:
-        text = re.sub(pattern, '', text)
-    return text.strip()
-
+def load_model():
+    for name in _MODEL_LOADERS:
+        _ensure_model(name)
+
+def _ensure_model(name):
+    if name not in _models_attempted:
+        with _model_locks[name]:
+            if name not in _models_attempted:
+                _MODEL_LOADERS[name]()
+                _models_attempted.add(name)
+
+def get_classifier():
+    _ensure_model("classifier")
+    return model
+
+def get_embedder():
+    _ensure_model("embedder")
+    return embedder
+
+_annotated_cache_lock = threading.Lock()
+
+def get_annotated_cache():
+    """The annotated-copy cache over uploads/ (scanned on first use), or None when disabled."""
+    global annotated_cache
+    if ANNOTATED_CACHE and annotated_cache is None:
+        with _annotated_cache_lock:
+            if annotated_cache is None:
+                annotated_cache = AnnotatedPdfCache(app.config['UPLOAD_FOLDER'],
+                                                    max_bytes=ANNOTATED_CACHE_MAX_MB * 1024 * 1024,
+                                                    grace_seconds=ANNOTATED_CACHE_GRACE_S)
+    return annotated_cache
 
 # -------------------------
-# analyze_pdf_sections (produces both df for classifier AND lines_list mapping)
+# warm-up (classifier + embedder) and readiness
 # -------------------------
-def extract_features(text, pdf_path, page_num, font_size, is_bold, is_italic, position_y, y_gap, start_line=None, end_line=None):
-    text_length = len(text)
-    upper_count = sum(1 for c in text if c.isupper())
-    total_alpha = sum(1 for c in text if c.isalpha())
-    capitalization_ratio = upper_count / total_alpha if total_alpha > 0 else 0
-    starts_with_numbering = bool(re.match(r'^\d+(\.\d+)*(\.|\))\s', text))
-    dot_match = re.match(r'^(\d+\.)+(\d+)', text)
-    num_dots_in_prefix = dot_match.group(1).count('.') if dot_match else 0
-
-    row = {
-        'PDF Path': str(pdf_path),
-        'Page Number': page_num,
-        'Section Text': text,
-        'Font Size': font_size,
-        'Is Bold': is_bold,
-        'Is Italic': is_italic,
-        'Text Length': text_length,
-        'Capitalization Ratio': capitalization_ratio,
-        'Starts with Numbering': starts_with_numbering,
-        'Position Y': position_y,
-        'Prefix Dot Count': num_dots_in_prefix,
-        'Y Gap': y_gap
-    }
-    # attach start/end line indexes for later mapping to rects
-    if start_line is not None:
-        row['Start Line'] = int(start_line)
-    if end_line is not None:
-        row['End Line'] = int(end_line)
-    return row
-
-def analyze_pdf_sections(pdf_path):
-    """
-    Parse the PDF and return:
-      - df: DataFrame of grouped rows (for classifier). Each row contains Start Line and End Line.
-      - lines_list: list of per-physical-line dicts: { line_index, page, text, bbox }
-    """
-    grouped_rows = []   # will become rows for df (paragraph/group-level)
-    lines_list = []     # one entry per physical text line found in order
-    try:
-        doc = fitz.open(pdf_path)
-        line_counter = 0
-
-        for page_idx in range(doc.page_count):
-            page = doc.load_page(page_idx)
-            blocks = page.get_text("dict").get('blocks', [])
-
-            # For grouping we track a current group (list of text lines' indices and texts)
-            current_group_line_indices = []
-            current_group_texts = []
-            # representative style properties for current group (first line's style)
-            current_font_size = None
-            current_bold = None
-            current_italic = None
-            prev_line_y = None
-            prev_y_gap = None
-
-            for block in blocks:
-                if block.get('type') != 0:
-                    continue
-                for line in block.get('lines', []):
-                    spans = [s for s in line.get('spans', []) if s.get('text','').strip()]
-                    if not spans:
-                        continue
-
-                    line_text = " ".join(span['text'].strip() for span in spans)
-                    if should_ignore_text(line_text):
-                        continue
-                    cleaned = clean_text(line_text)
-                    if not cleaned:
-                        continue
-
-                    # compute bbox for the physical line (union of spans)
-                    x0 = min(s['bbox'][0] for s in spans)
-                    y0 = min(s['bbox'][1] for s in spans)
-                    x1 = max(s['bbox'][2] for s in spans)
-                    y1 = max(s['bbox'][3] for s in spans)
-                    bbox = [x0, y0, x1, y1]
-
-                    # style info from first span of the line
-                    first_span = spans[0]
-                    font_size = first_span.get('size', 0)
-                    font_flags = first_span.get('flags', 0)
-                    is_bold = (font_flags & 16) > 0
-                    is_italic = (font_flags & 2) > 0
-                    y_pos = first_span['bbox'][1]
-
-                    # always append a physical line entry
-                    lines_list.append({
-                        'line_index': line_counter,
-                        'page': page_idx + 1,
-                        'text': cleaned,
-                        'bbox': bbox,
-                    })
-                    this_line_index = line_counter
-                    line_counter += 1
-
-                    # compute y gap relative to previous line (for features)
-                    if prev_line_y is None:
-                        y_gap = None
-                    else:
-                        y_gap = abs(y_pos - prev_line_y)
-                    prev_line_y = y_pos
-
-                    # decide whether to continue the current group or start a new group
-                    if current_font_size is None:
-                        # first line in group
-                        current_group_line_indices = [this_line_index]
-                        current_group_texts = [cleaned]
-                        current_font_size = font_size
-                        current_bold = is_bold
-                        current_italic = is_italic
-                        prev_y_gap = y_gap
-                    else:
-                        same_style = (abs(current_font_size - font_size) < 0.5 and is_bold == current_bold and is_italic == current_italic)
-                        if same_style:
-                            # continue group
-                            current_group_line_indices.append(this_line_index)
-                            current_group_texts.append(cleaned)
-                        else:
-                            # finalize previous group into one grouped row
-                            full_text = " ".join(current_group_texts)
-                            if not should_ignore_text(full_text) and len(full_text.strip()) > 2:
-                                start_line = current_group_line_indices[0]
-                                end_line = current_group_line_indices[-1]
-                                feat = extract_features(full_text, pdf_path, page_idx + 1,
-                                                        current_font_size, current_bold, current_italic,
-                                                        prev_line_y, prev_y_gap, start_line=start_line, end_line=end_line)
-                                grouped_rows.append(feat)
-                            # start new group with this line
-                            current_group_line_indices = [this_line_index]
-                            current_group_texts = [cleaned]
-                            current_font_size = font_size
-                            current_bold = is_bold
-                            current_italic = is_italic
-                            prev_y_gap = y_gap
-
-            # finalize group's leftover at end of page
-            if current_group_texts:
-                full_text = " ".join(current_group_texts)
-                if not should_ignore_text(full_text) and len(full_text.strip()) > 2:
-                    start_line = current_group_line_indices[0]
-                    end_line = current_group_line_indices[-1]
-                    feat = extract_features(full_text, pdf_path, page_idx + 1,
-                                            current_font_size, current_bold, current_italic,
-                                            prev_line_y, prev_y_gap, start_line=start_line, end_line=end_line)
-                    grouped_rows.append(feat)
-                # reset for next page
-                current_group_line_indices = []
-                current_group_texts = []
-                current_font_size = None
-                current_bold = None
-                current_italic = None
-                prev_y_gap = None
-
-        doc.close()
-    except Exception as e:
-        logger.exception(f"Error processing {pdf_path}: {e}")
-
-    df = pd.DataFrame(grouped_rows)
-    return df, lines_list
+WARMUP_QUERY = "Plan a 4-day trip for a group of 10 college friends"
+WARMUP_SECTION = (
+    "Getting around: the region is well served by regional trains and buses. "
+    "Day passes cover unlimited travel within a zone, and most museums offer reduced "
+    "entry for students and groups booked in advance."
+)
+
+def _warm_classifier():
+    if get_classifier() is None:
+        raise RuntimeError("Heading classifier not loaded")
+    # features are min-max scaled, so uniform rows reach realistic leaves
+    X = np.random.default_rng(0).random((WARMUP_ROWS, len(HEADING_FEATURES)), dtype=np.float32)
+    t = time.perf_counter()
+    predict_labels(X)
+    first = time.perf_counter() - t
+    t = time.perf_counter()
+    predict_labels(X)
+    timings = {"rows": WARMUP_ROWS, "first_predict_seconds": round(first, 4),
+               "predict_seconds": round(time.perf_counter() - t, 4)}
+    large = getattr(model, 'sklearn_above_rows', 0)
+    if large:
+        # loads the sklearn estimator now rather than on the first large batch
+        t = time.perf_counter()
+        predict_labels(np.random.default_rng(1).random((large + 1, len(HEADING_FEATURES)), dtype=np.float32))
+        timings["large_batch_first_predict_seconds"] = round(time.perf_counter() - t, 4)
+    return timings
+
+def _warm_embedder():
+    if get_embedder() is None:
+        raise RuntimeError("Embedder not loaded")
+    # the query endpoints encode one text at a time: time the first call (tokenizer and
+    # graph warm-up) against steady-state calls for a query and a section
+    t = time.perf_counter()
+    with embedder_lock:
+        embedder.encode(WARMUP_QUERY, normalize_embeddings=True, show_progress_bar=False)
+    first = time.perf_counter() - t
+    t = time.perf_counter()
+    with embedder_lock:
+        embedder.encode(WARMUP_QUERY, normalize_embeddings=True, show_progress_bar=False)
+    query = time.perf_counter() - t
+    t = time.perf_counter()
+    with embedder_lock:
+        embedder.encode(WARMUP_SECTION, normalize_embeddings=True, show_progress_bar=False)
+    return {"first_encode_seconds": round(first, 4), "query_encode_seconds": round(query, 4),
+            "section_encode_seconds": round(time.perf_counter() - t, 4)}
+
+warmup = Warmup([
+    ("classifier", "classifier", _warm_classifier),
+    ("embedder", "embedder", _warm_embedder),
+])
 
 
 # -------------------------
-# unchanged helpers: preprocess_features, build_json_from_predictions, mmr
-# (copy your existing implementations; unchanged)
+# unchanged helpers: build_json_from_predictions, mmr
+# (feature preprocessing lives in featureEngine.py)
 # -------------------------
-def preprocess_features(df):
-    if df.empty:
-        return df
-
-    df['Is Bold'] = df['Is Bold'].astype(int)
-    df['Is Italic'] = df['Is Italic'].astype(int)
-    df['Starts with Numbering'] = df['Starts with Numbering'].astype(int)
-
-    font_sizes = sorted(df['Font Size'].unique(), reverse=True)
-    font_size_rank_map = {size: rank + 1 for rank, size in enumerate(font_sizes)}
-    df['Font Size Rank'] = df['Font Size'].map(font_size_rank_map)
-
-    df['Font Size Normalised'] = df['Font Size']
-    columns_to_normalize = ['Font Size Normalised', 'Text Length', 'Capitalization Ratio', 'Position Y']
-    if len(df) > 0:
-        scaler = MinMaxScaler()
-        df[columns_to_normalize] = scaler.fit_transform(df[columns_to_normalize])
-
-    if not df['Font Size'].empty:
-        body_font_size = df['Font Size'].mode()[0]
-        df['Font Ratio'] = df['Font Size'] / body_font_size
-    else:
-        df['Font Ratio'] = 1.0
-
-    df['Font Size Count'] = df['Font Size'].map(df['Font Size'].value_counts())
-    df['Is Unique Font Size'] = (df['Font Size Count'] == 1).astype(int)
-
-    df['Y Gap'] = df['Y Gap'].fillna(2)
-    df['Y Gap'] = pd.to_numeric(df['Y Gap'], errors='coerce').fillna(2)
-
-    def scale_column_per_pdf(group):
-        if len(group) > 1 and group.std() > 0:
-            scaler = MinMaxScaler()
-            return scaler.fit_transform(group.values.reshape(-1, 1)).flatten()
-        else:
-            return [0] * len(group)
-
-    df['Y Gap Scaled'] = df.groupby('PDF Path')['Y Gap'].transform(scale_column_per_pdf)
-    df['Font Size Count'] = df.groupby('PDF Path')['Font Size Count'].transform(scale_column_per_pdf)
-    return df
-
 def build_json_from_predictions(df):
     outline = []
     title_rows = df[df['Label'] == 'Title']
@@ -376,39 +439,95 @@ def build_json_from_predictions(df):
 # -------------------------
 # mmr function: implements MMR algorithm for section selection
 # -------------------------
-def mmr(query_emb, sections, lambda_param, top_k, isContra=0):
+def query_similarities(query_emb, embeddings):
+    """cos(query, section) for every row of embeddings, as float64; computed once per
+    request and shared by the positive (mmr) and contradictory (contra_select) views."""
+    return st_util.cos_sim(query_emb, embeddings)[0].numpy().astype(np.float64)
+
+def _mmr_select(relevance, embeddings, lambda_param, top_k):
+    # incremental MMR: each candidate's max similarity to the picks so far is kept in one
+    # vector and raised with a single similarity column per pick, instead of building the
+    # full n x n matrix (O(n*k) work and memory). Scores use the same float64 arithmetic
+    # and first-max tie-break as the pairwise loop, so the selection is unchanged.
+    n_pick = min(top_k, len(relevance))
+    max_sim = np.full(len(relevance), -np.inf)
+    available = np.ones(len(relevance), dtype=bool)
+    selected = []
+    while len(selected) < n_pick:
+        if not selected:
+            scores = relevance
+        else:
+            scores = lambda_param * relevance - (1 - lambda_param) * max_sim
+        idx = int(np.argmax(np.where(available, scores, -np.inf)))
+        selected.append(idx)
+        available[idx] = False
+        if len(selected) < n_pick:
+            column = st_util.cos_sim(embeddings, embeddings[idx:idx + 1])[:, 0].numpy()
+            np.maximum(max_sim, column.astype(np.float64), out=max_sim)
+    return selected
+
+def mmr(query_emb, sections, lambda_param, top_k, embeddings=None, sim_q=None):
     if not sections:
         return [], []
 
-    selected, remaining = [], list(range(len(sections)))
-    sim_q = [util.cos_sim(query_emb, s['embedding']).item() for s in sections]
-    sim_doc = [
-                [util.cos_sim(sections[i]['embedding'], sections[j]['embedding']).item() for j in range(len(sections))]
-                for i in range(len(sections))
-            ]
-
-    if isContra:  # only return indices with similarity < 0
-        contra_indices = [i for i, score in enumerate(sim_q) if score < 0]
-        return contra_indices, sim_q
-
-    # normal mmr
-    while len(selected) < top_k and remaining:
-        if not selected:
-            idx = int(np.argmax([sim_q[i] for i in remaining]))
-            idx = remaining[idx]
-            selected.append(idx)
-            remaining.remove(idx)
-        else:
-            mmr_scores = []
-            for idx in remaining:
-                max_sim = max(sim_doc[idx][j] for j in selected) if selected else 0
-                score = lambda_param * sim_q[idx] - (1 - lambda_param) * max_sim
-                mmr_scores.append(score)
-            chosen_rel_index = int(np.argmax(mmr_scores))
-            idx = remaining[chosen_rel_index]
-            selected.append(idx)
-            remaining.remove(idx)
-    return selected, sim_q
+    # embeddings: (n_sections, dim) matrix of the sections' vectors, stacked if not given
+    if embeddings is None:
+        embeddings = np.stack([s['embedding'] for s in sections])
+    # sim_q: query similarities already computed by the caller (query_similarities)
+    if sim_q is None:
+        sim_q = query_similarities(query_emb, embeddings)
+    return _mmr_select(sim_q, embeddings, lambda_param, top_k), sim_q.tolist()
+
+def _positive_int(value, name):
+    """value as an int >= 1; bools, fractional floats and non-numbers raise ValueError/TypeError."""
+    if isinstance(value, bool):
+        raise TypeError(f"{name} must be an integer, got {value}")
+    if isinstance(value, float) and not value.is_integer():
+        raise ValueError(f"{name} must be an integer, got {value}")
+    value = int(value)
+    if value < 1:
+        raise ValueError(f"{name} must be at least 1, got {value}")
+    return value
+
+def _contra_params(data):
+    """
+    (contra_top_k, contra_diversity) of a request, defaulting to CONTRA_TOP_K and
+    CONTRA_DIVERSITY. top_k is clamped to [0, CONTRA_MAX_TOP_K] and diversity (an MMR
+    lambda, None = off) to [0, 1]; values that are not numbers raise ValueError/TypeError.
+    """
+    top_k = data.get('contra_top_k', CONTRA_TOP_K)
+    diversity = data.get('contra_diversity', CONTRA_DIVERSITY)
+    if isinstance(top_k, bool) or isinstance(diversity, bool):
+        raise TypeError("booleans are not numbers here")
+    if isinstance(top_k, float) and not top_k.is_integer():
+        raise ValueError(f"contra_top_k must be an integer, got {top_k}")
+    top_k = min(max(int(top_k), 0), CONTRA_MAX_TOP_K)
+    if diversity is not None:
+        diversity = float(diversity)
+        if not math.isfinite(diversity):
+            raise ValueError(f"contra_diversity must be finite, got {diversity}")
+        diversity = min(max(diversity, 0.0), 1.0)
+    return top_k, diversity
+
+def contra_select(sim_q, top_k, embeddings=None, diversity=None):
+    """
+    Up to top_k sections with negative query similarity, most contradictory first.
+    - The k lowest scores are found with np.argpartition (O(n)) and only those k sorted.
+    - diversity (an MMR lambda) instead runs MMR on -sim_q over the CONTRA_POOL_FACTOR * k
+      lowest-scoring sections, so near-identical contradictions are not all returned.
+    """
+    negative = np.flatnonzero(sim_q < 0)
+    k = min(int(top_k), len(negative))
+    if k <= 0:
+        return []
+    pool = k if diversity is None or embeddings is None else min(len(negative), k * CONTRA_POOL_FACTOR)
+    if pool < len(negative):
+        negative = negative[np.argpartition(sim_q[negative], pool - 1)[:pool]]
+    if pool == k:
+        return negative[np.lexsort((negative, sim_q[negative]))].tolist()
+    negative.sort()
+    picked = _mmr_select(-sim_q[negative], embeddings[negative], diversity, k)
+    return negative[picked].tolist()
 
 #--------------------------------------- #
 #     only to upload file                #
@@ -439,6 +558,236 @@ def upload_only_file():
     except Exception as e:
         logger.error(f"Error uploading file: {e}")
         return jsonify({"error": "Error uploading file"}), 500
+
+# -------------------------
+# section assembly + full ingest pipeline (shared by /upload and the cache)
+# -------------------------
+def predict_labels(X):
+    """Classifier labels for a float32 feature matrix (columns in HEADING_FEATURES order)."""
+    with warnings.catch_warnings():
+        # sklearn fallback only: the pickle was fitted on a DataFrame, a bare matrix is intended
+        warnings.filterwarnings("ignore", message="X does not have valid feature names")
+        return model.predict(X)
+
+SECTION_LABELS = ['Title', 'H1', 'H2']
+
+def build_sections(df, lines):
+    """
+    Build sections using Title/H1/H2 rows as section starts. Every grouped row up to the
+    next heading is body; the rows' Start/End Line ranges give the physical lines (and
+    so the per-page rects) of the whole section. Single pass: section ids are the
+    cumulative sum of the heading mask, rows before the first heading get -1.
+    """
+    if df.empty:
+        return []
+    is_heading = df['Label'].isin(SECTION_LABELS).to_numpy()
+    head_rows = np.flatnonzero(is_heading)
+    if not len(head_rows):
+        return []
+
+    section_ids = np.cumsum(is_heading) - 1
+    in_section = section_ids >= 0
+    texts = df['Section Text'].tolist()
+    start_lines = df['Start Line'].to_numpy(dtype=np.int64)
+    end_lines = df['End Line'].to_numpy(dtype=np.int64)
+    page_numbers = df['Page Number'].tolist()
+    # section k spans grouped rows head_rows[k] .. row_stops[k] - 1
+    row_stops = np.append(head_rows[1:], len(df)).tolist()
+
+    rects_per_section = lines.section_rects(
+        start_lines[in_section], end_lines[in_section], section_ids[in_section], len(head_rows)
+    )
+
+    n_lines = len(lines)
+    sections = []
+    for k, (h, stop) in enumerate(zip(head_rows.tolist(), row_stops)):
+        heading = texts[h]
+        # heading-only sections keep just the heading text
+        full_text = " ".join(texts[h:stop])
+        start_line = int(start_lines[h])
+        # last body row's End Line, or the heading's own when there is no body
+        end_line = int(end_lines[stop - 1])
+        start_page = lines.page(start_line) if 0 <= start_line < n_lines else None
+        end_page = lines.page(end_line) if 0 <= end_line < n_lines else None
+
+        sections.append({
+            "heading": heading,
+            "text": full_text,
+            "page": start_page if start_page is not None else int(page_numbers[h]),
+            "start_line": start_line,
+            "start_page": start_page,
+            "end_line": end_line,
+            "end_page": end_page,
+            "rects": rects_per_section[k]
+        })
+    return sections
+
+def process_pdf(filepath, progress=None):
+    """
+    Run the full ingest pipeline on a saved PDF and return (outline, sections).
+    Raises ValueError with a client-facing message when the PDF yields nothing usable.
+    progress(**fields), if given, receives per-stage counters (used by async jobs).
+    """
+    report = progress or (lambda **fields: None)
+    report(stage="parsing", pages_parsed=0)
+
+    # analyze: get grouped df (for classifier) and the LineStore (per-line pages/bboxes)
+    df, lines = analyze_pdf_sections(
+        filepath,
+        progress=lambda done, total: report(pages_parsed=done, pages_total=total)
+    )
+    if (df is None or df.empty) and not lines:
+        raise ValueError("No extractable text")
+    return classify_and_build(df, lines, report)
+
+def classify_and_build(df, lines, report=None):
+    """Classifier + outline + section assembly for an already parsed document."""
+    report = report or (lambda **fields: None)
+    df = preprocess_features(df)
+    if df.empty:
+        raise ValueError("Preprocessing failed")
+
+    report(stage="classifying", rows_total=len(df), rows_classified=0)
+    df['Label'] = predict_labels(heading_feature_matrix(df))
+    report(stage="building_sections", rows_classified=len(df))
+
+    structured_json = build_json_from_predictions(df)
+    sections = build_sections(df, lines)
+    return structured_json, sections
+
+def classify_and_build_many(parsed):
+    """
+    Batched variant of classify_and_build for [(df, lines), ...]. Features are
+    normalised per document (preprocess_features runs on each PDF on its own, as for a
+    single upload), then every document's rows go through one model.predict call.
+    Returns one (outline, sections) tuple or ValueError per document, in input order.
+    """
+    prepared = []
+    for df, lines in parsed:
+        if (df is None or df.empty) and not lines:
+            prepared.append(ValueError("No extractable text"))
+            continue
+        df = preprocess_features(df)
+        if df.empty:
+            prepared.append(ValueError("Preprocessing failed"))
+            continue
+        prepared.append((df, lines))
+
+    frames = [item[0] for item in prepared if not isinstance(item, ValueError)]
+    if frames:
+        labels = predict_labels(np.concatenate([heading_feature_matrix(f) for f in frames]))
+
+    results = []
+    offset = 0
+    for item in prepared:
+        if isinstance(item, ValueError):
+            results.append(item)
+            continue
+        df, lines = item
+        df['Label'] = labels[offset:offset + len(df)]
+        offset += len(df)
+        results.append((build_json_from_predictions(df), build_sections(df, lines)))
+    return results
+
+def register_document(filename, filepath, content_sha, sections):
+    """
+    Embed the sections into the document store so queries can refer to the document by
+    id. Returns the document id, or None when there is no embedder (the upload itself
+    still succeeds; queries then fall back to the sections the client sends).
+    """
+    if get_embedder() is None or document_store is None:
+        return None
+    try:
+        content_sha = content_sha or file_sha256(filepath)
+        reuse = None
+        if duplicate_index is not None:
+            canonical = duplicate_index.add(filename, [_lexical_text(s) for s in sections])
+            reuse = _reuse_vectors(filename, sections, canonical)
+        doc = document_store.put(filename, filename, content_sha, sections, reuse=reuse)
+        if section_index is not None:
+            section_index.add(doc.doc_id, doc.vectors)
+        if lexical_index is not None:
+            lexical_index.add(doc.doc_id, [_lexical_text(s) for s in doc.sections])
+        if section_graph is not None:
+            # linked by the graph's worker: uploads do not wait for it
+            section_graph.submit(doc.doc_id)
+        return filename
+    except Exception as e:
+        logger.exception(f"Failed to register {filename} in the document store: {e}")
+        if duplicate_index is not None:
+            duplicate_index.remove(filename)
+        return None
+
+def _reuse_vectors(doc_id, sections, canonical):
+    """
+    DocumentStore.put reuse list: a copy whose canonical section has the very same text
+    takes its vector. Near (not exact) copies are encoded, so stored vectors stay exact
+    and near-duplicates are grouped only when a query is scored (_collapse_duplicates).
+    """
+    texts = [embed_text(s) for s in sections]
+    reuse = []
+    for i, (canonical_doc, j) in enumerate(canonical):
+        if canonical_doc == doc_id:
+            reuse.append(j if j != i and texts[j] == texts[i] else None)
+            continue
+        other = document_store.get(canonical_doc)
+        same = (other is not None and j < len(other.sections) and j < len(other.vectors)
+                and embed_text(other.sections[j]) == texts[i])
+        reuse.append(other.vectors[j] if same else None)
+    return reuse
+
+def ingest_saved_pdf(filepath, filename, progress=None):
+    """
+    Turn an uploaded PDF into the /upload response payload, going through the ingest cache.
+    On ValueError the saved file is removed and the message is meant for the client.
+    """
+    # same bytes uploaded before (under any name) -> reuse the stored outline/sections
+    content_sha = file_sha256(filepath) if ingest_cache is not None else None
+    cached = ingest_cache.get(content_sha) if ingest_cache is not None else None
+    if cached is not None:
+        logger.info(f"Ingest cache hit for {filename} ({content_sha[:12]})")
+        structured_json, sections = cached['outline'], cached['sections']
+    else:
+        try:
+            structured_json, sections = process_pdf(filepath, progress=progress)
+        except ValueError:
+            os.remove(filepath)
+            raise
+        if ingest_cache is not None:
+            ingest_cache.put(content_sha, {"outline": structured_json, "sections": sections})
+
+    if progress is not None:
+        progress(stage="embedding")
+    document_id = register_document(filename, filepath, content_sha, sections)
+
+    return {
+        "success": True,
+        "filename": filename,
+        "document_id": document_id,
+        "outline": structured_json,
+        "sections": sections,
+        "cached": cached is not None,
+        "message": f"Successfully processed PDF and found {len(structured_json['outline'])} headings and {len(sections)} sections"
+    }
+
+def _run_ingest_job(job_id, filepath, filename):
+    return ingest_saved_pdf(
+        filepath, filename,
+        progress=lambda **fields: ingest_jobs.update_progress(job_id, **fields)
+    )
+
+ingest_jobs = IngestJobQueue(
+    _run_ingest_job,
+    workers=INGEST_JOB_WORKERS,
+    max_depth=INGEST_JOB_QUEUE_DEPTH,
+    retention_seconds=INGEST_JOB_RETENTION_SECONDS
+)
+
+def _ingest_queue_full_response():
+    response = jsonify({"error": "Ingest queue is full, retry later"})
+    response.headers['Retry-After'] = '5'
+    return response, 429
+
 #--------------------------------------- #
 # upload endpoint: builds sections using df rows' Start/End line indices
 #--------------------------------------- #
@@ -458,6 +807,10 @@ def upload_pdf():
         if request.content_length and request.content_length > MAX_FILE_SIZE:
             return jsonify({"error": "File too large. Maximum size is 50MB"}), 400
 
+        async_mode = (request.args.get('async') or request.form.get('async') or '').lower() in ('1', 'true', 'yes')
+        if async_mode and ingest_jobs.full():
+            return _ingest_queue_full_response()
+
         filename = secure_filename(file.filename)
         timestamp = str(int(time.time()))
         filename = f"{timestamp}_{filename}"
@@ -465,140 +818,660 @@ def upload_pdf():
         file.save(filepath)
         logger.info(f"Uploaded file: {filename}")
 
-        if model is None:
+        if get_classifier() is None:
             os.remove(filepath)
             return jsonify({"error": "Model not loaded"}), 500
 
-        # analyze: get grouped df (for classifier) and lines_list (per-line bboxes)
-        df, lines_list = analyze_pdf_sections(filepath)
-        if (df is None or df.empty) and not lines_list:
-            os.remove(filepath)
-            return jsonify({"error": "No extractable text"}), 400
+        if async_mode:
+            try:
+                job_id = ingest_jobs.submit(filepath, filename)
+            except queue.Full:
+                # lost the race for the last slot after saving
+                os.remove(filepath)
+                return _ingest_queue_full_response()
+            return jsonify({
+                "success": True,
+                "job_id": job_id,
+                "filename": filename,
+                "status_url": f"/jobs/{job_id}"
+            }), 202
+
+        try:
+            response_payload = ingest_saved_pdf(filepath, filename)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
-        df = preprocess_features(df)
-        if df.empty:
-            os.remove(filepath)
-            return jsonify({"error": "Preprocessing failed"}), 400
-
-        features = [
-            'Font Ratio', 'Font Size Rank', 'Text Length', 'Capitalization Ratio',
-            'Position Y', 'Is Bold', 'Is Italic',
-            'Starts with Numbering', 'Font Size Count', 'Is Unique Font Size'
-        ]
-        df['Label'] = model.predict(df[features])
-
-        structured_json = build_json_from_predictions(df)
-
-        # Build sections mapping using Title/H1/H2 as section starts (but use Start/End Line indices
-        # from grouped df rows to collect all physical lines for the full section body)
-        sections = []
-        final_df = df.reset_index(drop=True)
-        section_labels = ['Title', 'H1', 'H2']
-        for i, row in final_df.iterrows():
-            if row['Label'] in section_labels:
-                heading = row['Section Text']
-                # collect grouped rows texts until next heading
-                body_rows = []
-                body_start_line = None
-                body_end_line = None
-                for j in range(i + 1, len(final_df)):
-                    next_row = final_df.iloc[j]
-                    if next_row['Label'] in section_labels:
-                        break
-                    body_rows.append(next_row['Section Text'])
-                    # get start/end line indices if present
-                    sline = next_row.get('Start Line', None)
-                    eline = next_row.get('End Line', None)
-                    if sline is not None:
-                        if body_start_line is None:
-                            body_start_line = int(sline)
-                        body_end_line = int(eline) if eline is not None else body_end_line
-
-                # If there were no body grouped rows, include nothing (heading-only)
-                # But always include heading text.
-                full_text = heading + (" " + " ".join(body_rows) if body_rows else "")
-
-                # Compute page numbers:
-                start_line = int(row.get('Start Line', -1)) if 'Start Line' in row else -1
-                end_line = body_end_line if body_end_line is not None else (int(row.get('End Line', -1)) if 'End Line' in row else start_line)
-                start_page = None
-                end_page = None
-                if start_line >= 0 and start_line < len(lines_list):
-                    start_page = lines_list[start_line]['page']
-                if end_line is not None and end_line >= 0 and end_line < len(lines_list):
-                    end_page = lines_list[end_line]['page']
-
-                # Gather all physical line indices for this section:
-                collected_line_indices = []
-                # include heading group lines:
-                if start_line is not None and start_line >= 0:
-                    # find the grouped row for the heading (it had Start/End Line)
-                    heading_sline = int(row.get('Start Line', start_line))
-                    heading_eline = int(row.get('End Line', start_line))
-                    collected_line_indices.extend(list(range(heading_sline, heading_eline + 1)))
-                # include body grouped lines by collecting the Start/End ranges for each body grouped row
-                if body_rows:
-                    for j in range(i + 1, i + 1 + len(body_rows)):
-                        br = final_df.iloc[j]
-                        bs = br.get('Start Line', None)
-                        be = br.get('End Line', None)
-                        if bs is not None and be is not None:
-                            collected_line_indices.extend(list(range(int(bs), int(be) + 1)))
-
-                # make per-page union bounding boxes from collected_line_indices
-                page_to_box = {}
-                for li in collected_line_indices:
-                    if li is None or li < 0 or li >= len(lines_list):
-                        continue
-                    rec = lines_list[li]
-                    p = rec['page']
-                    bbox = rec['bbox']
-                    if p not in page_to_box:
-                        page_to_box[p] = {
-                            'x0': bbox[0],
-                            'y0': bbox[1],
-                            'x1': bbox[2],
-                            'y1': bbox[3]
-                        }
-                    else:
-                        pb = page_to_box[p]
-                        pb['x0'] = min(pb['x0'], bbox[0])
-                        pb['y0'] = min(pb['y0'], bbox[1])
-                        pb['x1'] = max(pb['x1'], bbox[2])
-                        pb['y1'] = max(pb['y1'], bbox[3])
-
-                rects = []
-                for p, box in page_to_box.items():
-                    rects.append({
-                        "page": int(p),
-                        "bbox": [float(box['x0']), float(box['y0']), float(box['x1']), float(box['y1'])]
-                    })
-
-                sections.append({
-                    "heading": heading,
-                    "text": full_text,
-                    "page": start_page if start_page is not None else int(row.get('Page Number', 1)),
-                    "start_line": start_line,
-                    "start_page": start_page,
-                    "end_line": end_line,
-                    "end_page": end_page,
-                    "rects": rects
-                })
+        return jsonify(response_payload)
+
+    except Exception as e:
+        logger.exception(f"Error processing upload: {str(e)}")
+        return jsonify({"error": "Internal server error", "details": str(e)}), 500
+
+#--------------------------------------- #
+# async ingest job status                #
+#--------------------------------------- #
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job id"}), 404
+    return jsonify(job)
+
+#--------------------------------------- #
+# health / readiness probes              #
+#--------------------------------------- #
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    # liveness only: the process is up and serving requests
+    return jsonify({"status": "ok", "uptime_seconds": round(profile.elapsed(), 3)})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    status = warmup.status()
+    if not WARMUP_ENABLED:
+        # nothing to wait for; models load on first use
+        status["ready"] = True
+    return jsonify(status), (200 if status["ready"] else 503)
+
+#--------------------------------------- #
+# startup cost report                    #
+#--------------------------------------- #
+@app.route('/startup_report', methods=['GET'])
+def startup_report():
+    report = profile.report()
+    report["warmup"] = warmup.status()
+    report["loaded"] = {
+        "classifier": model is not None,
+        "classifier_backend": type(model).__name__ if model is not None else None,
+        "embedder": embedder is not None,
+        "llm": llm is not None,
+        "modules": {m._module_name: m.loaded for m in (
+            sentence_transformers, st_util, llm_provider, litellm, gtts, pydub, speechsdk, tts_providers)},
+    }
+    return jsonify(report)
+
+#--------------------------------------- #
+# corpus-wide search                     #
+#--------------------------------------- #
+@app.route('/search', methods=['POST'])
+def search():
+    """
+    Search every uploaded document at once: the section index supplies the nearest
+    SEARCH_CANDIDATES sections and MMR picks top_k diverse ones among them.
+    """
+    try:
+        data = request.get_json(force=True)
+        if data is None:
+            return jsonify({"error": "Invalid JSON"}), 400
+        query_text = data.get('query') or data.get('selectedText')
+        if not query_text:
+            return jsonify({"error": "query is required"}), 400
+        try:
+            top_k = _positive_int(data.get('top_k', 5), "top_k")
+            n_candidates = max(top_k, _positive_int(data.get('candidates', SEARCH_CANDIDATES), "candidates"))
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": "top_k and candidates must be integers >= 1", "details": str(e)}), 400
+
+        if get_embedder() is None or section_index is None:
+            return jsonify({"error": "Embedder not loaded on server"}), 500
+
+        query_embedding = embed_query(query_text)
+        hits, hit_vectors = section_index.search(query_embedding, k=n_candidates, with_vectors=True)
+        section_data, kept = [], []
+        for row, (doc_id, section, score) in enumerate(hits):
+            stored = document_store.get(doc_id)
+            if stored is None or section >= len(stored.sections):
+                continue
+            entry = _stored_section_entry(stored, section)
+            entry['document_id'] = doc_id
+            section_data.append(entry)
+            kept.append(row)
+        if not section_data:
+            return jsonify({"error": "No indexed sections found"}), 404
+
+        embeddings = hit_vectors[kept]
+        section_data, embeddings, collapsed = _collapse_duplicates(data, section_data, embeddings)
+        selected_indices, sim_scores = mmr(query_embedding, section_data, lambda_param=0.72,
+                                           top_k=min(top_k, len(section_data)), embeddings=embeddings)
+
+        output = {
+            "metadata": {
+                "query": query_text,
+                "candidates": len(section_data),
+                "duplicates_collapsed": collapsed,
+                "processing_timestamp": datetime.now().isoformat()
+            },
+            "extracted_sections": [],
+            "subsection_analysis": []
+        }
+        for rank, idx in enumerate(selected_indices, start=1):
+            sec = section_data[idx]
+            output['extracted_sections'].append({
+                "document": sec['Document'],
+                "document_id": sec['document_id'],
+                "section_title": sec['heading'],
+                "importance_rank": rank,
+                "similarity": round(float(sim_scores[idx]), 4),
+                "page_number": sec['Page'],
+                "rects": sec['rects'],
+                "start_line": sec['start_line'],
+                "end_line": sec['end_line'],
+                "start_page": sec['start_page'],
+                "end_page": sec['end_page']
+            })
+            if sec.get('duplicates'):
+                output['extracted_sections'][-1]['duplicates'] = _duplicate_refs(sec)
+            output['subsection_analysis'].append({
+                "document": sec['Document'],
+                "document_id": sec['document_id'],
+                "refined_text": sec['text'],
+                "page_number": sec['Page']
+            })
+        return jsonify(output)
+
+    except Exception as e:
+        logger.exception("Error in search")
+        return jsonify({"error": "Internal server error", "details": str(e)}), 500
+
+@app.route('/sections/<section_id>/similar', methods=['GET'])
+def similar_sections(section_id):
+    """
+    Sections most like one stored section (section_id = "<document_id>:<section number>"),
+    read from the precomputed kNN graph. ?top_k= (default 5, at most SECTION_GRAPH_K).
+    """
+    doc_id, _, section = section_id.rpartition(':')
+    try:
+        section = int(section)
+        top_k = _positive_int(request.args.get('top_k', 5), "top_k")
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": "section_id must be <document_id>:<section number> and top_k an integer >= 1",
+                        "details": str(e)}), 400
+    if get_embedder() is None or section_graph is None:
+        return jsonify({"error": "Embedder not loaded on server"}), 500
+
+    neighbors = section_graph.similar(doc_id, section, k=top_k)
+    if neighbors is None and section_graph.pending(doc_id):
+        return jsonify({"error": "Document is still being linked; retry shortly"}), 503
+    stored = document_store.get(doc_id) if neighbors is not None else None
+    if stored is None or section >= len(stored.sections):
+        return jsonify({"error": "Unknown section id"}), 404
+
+    def section_json(doc, i):
+        sec = _stored_section_entry(doc, i)
+        return {
+            "section_id": f"{doc.doc_id}:{i}",
+            "document": sec['Document'],
+            "document_id": doc.doc_id,
+            "section_title": sec['heading'],
+            "refined_text": sec['text'],
+            "page_number": sec['Page'],
+            "rects": sec['rects'],
+            "start_line": sec['start_line'],
+            "end_line": sec['end_line'],
+            "start_page": sec['start_page'],
+            "end_page": sec['end_page']
+        }
+
+    similar = []
+    for other_id, other_section, score in neighbors:
+        other = document_store.get(other_id)
+        if other is None or other_section >= len(other.sections):
+            continue
+        item = section_json(other, other_section)
+        item['similarity'] = round(float(score), 4)
+        similar.append(item)
+    return jsonify({"section": section_json(stored, section), "similar": similar})
+
+@app.route('/documents/<doc_id>', methods=['DELETE'])
+def delete_document(doc_id):
+    """Drop a document from /search and from the document-id query paths."""
+    if get_embedder() is None or document_store is None:
+        return jsonify({"error": "Embedder not loaded on server"}), 500
+    removed = section_index.remove(doc_id) if section_index is not None else False
+    if lexical_index is not None:
+        removed = lexical_index.remove(doc_id) or removed
+    if section_graph is not None:
+        removed = section_graph.remove(doc_id) or removed
+    if duplicate_index is not None:
+        removed = duplicate_index.remove(doc_id) or removed
+    removed = document_store.delete(doc_id) or removed
+    if not removed:
+        return jsonify({"error": "Unknown document id"}), 404
+    return jsonify({"deleted": doc_id})
+
+#--------------------------------------- #
+# inference batching stats               #
+#--------------------------------------- #
+@app.route('/inference_stats', methods=['GET'])
+def inference_stats():
+    return jsonify({
+        "broker": inference_broker.stats() if inference_broker is not None else None,
+        "document_store": document_store.stats() if document_store is not None else None,
+        "section_index": section_index.stats() if section_index is not None else None,
+        "embedding_cache": embedding_cache.stats() if embedding_cache is not None else None,
+        "lexical_index": lexical_index.stats() if lexical_index is not None else None,
+        "section_graph": section_graph.stats() if section_graph is not None else None,
+        "duplicate_index": duplicate_index.stats() if duplicate_index is not None else None,
+        "annotated_cache": annotated_cache.stats() if annotated_cache is not None else None,
+        "ingest_jobs": ingest_jobs.stats(),
+    })
+
+#--------------------------------------- #
+# streaming upload: per-page headings     #
+#--------------------------------------- #
+def _stream_event(kind, payload, sse):
+    if sse:
+        return f"event: {kind}\ndata: {json.dumps(payload)}\n\n"
+    return json.dumps({"type": kind, **payload}) + "\n"
+
+def _provisional_page_headings(features, page_rows):
+    """
+    Classify one page's rows as soon as it is parsed. Document-level normalisation
+    (font rank, min-max, body font size) only sees the pages parsed so far (features, a
+    RunningFeatures), so these labels are provisional; the final message carries the
+    authoritative outline.
+    """
+    labels = predict_labels(features.add(page_rows))
+    return [
+        {"level": label, "text": row['Section Text'], "page": int(row['Page Number'])}
+        for label, row in zip(labels, page_rows)
+        if label != 'None'
+    ]
 
-        response_payload = {
+def _stream_ingest(filepath, filename, sse):
+    try:
+        content_sha = file_sha256(filepath) if ingest_cache is not None else None
+        cached = ingest_cache.get(content_sha) if ingest_cache is not None else None
+        if cached is not None:
+            structured_json, sections = cached['outline'], cached['sections']
+            by_page = {}
+            for item in structured_json['outline']:
+                by_page.setdefault(item['page'], []).append(item)
+            for page in sorted(by_page):
+                yield _stream_event("page", {"page": page, "headings": by_page[page]}, sse)
+        else:
+            all_rows, page_stores, features = [], [], RunningFeatures()
+            for page, page_count, rows, page_lines in iter_pdf_pages(filepath):
+                all_rows.extend(rows)
+                page_stores.append(page_lines)
+                headings = _provisional_page_headings(features, rows) if rows else []
+                yield _stream_event("page", {"page": page, "pages_total": page_count, "headings": headings}, sse)
+
+            lines = LineStore.concat(page_stores)
+            if not all_rows and not lines:
+                os.remove(filepath)
+                yield _stream_event("error", {"error": "No extractable text"}, sse)
+                return
+            try:
+                structured_json, sections = classify_and_build(rows_to_frame(all_rows), lines)
+            except ValueError as e:
+                os.remove(filepath)
+                yield _stream_event("error", {"error": str(e)}, sse)
+                return
+            if ingest_cache is not None:
+                ingest_cache.put(content_sha, {"outline": structured_json, "sections": sections})
+
+        document_id = register_document(filename, filepath, content_sha, sections)
+        yield _stream_event("done", {
             "success": True,
             "filename": filename,
+            "document_id": document_id,
             "outline": structured_json,
             "sections": sections,
+            "cached": cached is not None,
             "message": f"Successfully processed PDF and found {len(structured_json['outline'])} headings and {len(sections)} sections"
-        }
+        }, sse)
+    except Exception as e:
+        logger.exception(f"Error streaming upload: {str(e)}")
+        yield _stream_event("error", {"error": "Internal server error", "details": str(e)}, sse)
 
-        return jsonify(response_payload)
+@app.route('/upload/stream', methods=['POST'])
+def upload_pdf_stream():
+    """
+    Same input as /upload, but the response is a stream: one "page" message per parsed
+    page with its (provisional) headings, then a "done" message holding the full /upload
+    payload. NDJSON by default; Server-Sent Events when the client accepts text/event-stream
+    or passes ?format=sse.
+    """
+    try:
+        if 'file' not in request.files:
+            return jsonify({"error": "No file provided"}), 400
+
+        file = request.files['file']
+        if file.filename == '':
+            return jsonify({"error": "No file selected"}), 400
+
+        if file and '.' in file.filename and file.filename.rsplit('.', 1)[1].lower() not in ALLOWED_EXTENSIONS:
+            return jsonify({"error": "Invalid file type. Only PDF files are allowed"}), 400
+
+        if request.content_length and request.content_length > MAX_FILE_SIZE:
+            return jsonify({"error": "File too large. Maximum size is 50MB"}), 400
+
+        filename = secure_filename(file.filename)
+        timestamp = str(int(time.time()))
+        filename = f"{timestamp}_{filename}"
+        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        file.save(filepath)
+        logger.info(f"Uploaded file (stream): {filename}")
+
+        if get_classifier() is None:
+            os.remove(filepath)
+            return jsonify({"error": "Model not loaded"}), 500
+
+        sse = request.args.get('format') == 'sse' or 'text/event-stream' in request.headers.get('Accept', '')
+        mimetype = 'text/event-stream' if sse else 'application/x-ndjson'
+        response = Response(_stream_ingest(filepath, filename, sse), mimetype=mimetype)
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'  # keep nginx from buffering the stream
+        return response
 
     except Exception as e:
-        logger.exception(f"Error processing upload: {str(e)}")
+        logger.exception(f"Error processing streaming upload: {str(e)}")
         return jsonify({"error": "Internal server error", "details": str(e)}), 500
 
+#--------------------------------------- #
+# batch upload: many PDFs or one ZIP      #
+#--------------------------------------- #
+def _unique_upload_name(name, taken):
+    stem, ext = os.path.splitext(name)
+    candidate, n = name, 1
+    while candidate in taken:
+        n += 1
+        candidate = f"{stem}_{n}{ext}"
+    taken.add(candidate)
+    return candidate
+
+def _collect_batch_files(timestamp):
+    """
+    Save every PDF in the request (repeated 'files' fields and/or a ZIP under 'archive')
+    into the upload folder. Returns ([(original_name, filename, filepath)], [errors]).
+    """
+    saved, errors, taken = [], [], set()
+
+    def save_bytes(original_name, data):
+        if len(saved) >= BATCH_MAX_FILES:
+            errors.append({"success": False, "original_name": original_name,
+                           "error": f"Batch limit of {BATCH_MAX_FILES} files reached"})
+            return
+        if len(data) > MAX_FILE_SIZE:
+            errors.append({"success": False, "original_name": original_name,
+                           "error": "File too large. Maximum size is 50MB"})
+            return
+        base = secure_filename(os.path.basename(original_name))
+        if not base:
+            errors.append({"success": False, "original_name": original_name, "error": "Invalid file name"})
+            return
+        filename = f"{timestamp}_{_unique_upload_name(base, taken)}"
+        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        with open(filepath, 'wb') as f:
+            f.write(data)
+        saved.append((original_name, filename, filepath))
+
+    for file in request.files.getlist('files'):
+        if not file.filename:
+            continue
+        if '.' not in file.filename or file.filename.rsplit('.', 1)[1].lower() not in ALLOWED_EXTENSIONS:
+            errors.append({"success": False, "original_name": file.filename,
+                           "error": "Invalid file type. Only PDF files are allowed"})
+            continue
+        save_bytes(file.filename, file.read())
+
+    archive = request.files.get('archive')
+    if archive and archive.filename:
+        try:
+            with zipfile.ZipFile(archive.stream) as zf:
+                members = [
+                    info for info in zf.infolist()
+                    if not info.is_dir()
+                    and info.filename.lower().endswith('.pdf')
+                    and not os.path.basename(info.filename).startswith('._')  # macOS resource forks
+                ]
+                # declared sizes are checked before inflating anything (zip bombs)
+                if sum(info.file_size for info in members) > MAX_BATCH_SIZE:
+                    errors.append({"success": False, "original_name": archive.filename,
+                                   "error": "Archive too large once extracted"})
+                    members = []
+                for info in members:
+                    if info.file_size > MAX_FILE_SIZE:
+                        errors.append({"success": False, "original_name": info.filename,
+                                       "error": "File too large. Maximum size is 50MB"})
+                        continue
+                    save_bytes(info.filename, zf.read(info))
+        except zipfile.BadZipFile:
+            errors.append({"success": False, "original_name": archive.filename, "error": "Invalid ZIP archive"})
+
+    return saved, errors
+
+@app.route('/upload/batch', methods=['POST'])
+def upload_pdf_batch():
+    """
+    Ingest many PDFs in one request. Documents are parsed in parallel (one per pool
+    worker), classified with a single batched model.predict, and returned as one
+    /upload-style payload per document under "documents".
+    """
+    try:
+        if request.content_length and request.content_length > MAX_BATCH_SIZE:
+            return jsonify({"error": "Batch too large"}), 400
+
+        if get_classifier() is None:
+            return jsonify({"error": "Model not loaded"}), 500
+
+        timestamp = str(int(time.time()))
+        saved, errors = _collect_batch_files(timestamp)
+        if not saved and not errors:
+            return jsonify({"error": "No files provided"}), 400
+        logger.info(f"Batch upload: {len(saved)} files saved, {len(errors)} rejected")
+
+        results = [None] * len(saved)
+        pending = []  # indices into saved that miss the ingest cache
+        shas = [None] * len(saved)
+        for i, (_, filename, filepath) in enumerate(saved):
+            if ingest_cache is not None:
+                shas[i] = file_sha256(filepath)
+                cached = ingest_cache.get(shas[i])
+                if cached is not None:
+                    results[i] = (cached['outline'], cached['sections'], True)
+                    continue
+            pending.append(i)
+
+        if pending:
+            parsed = analyze_many([saved[i][2] for i in pending])
+            for i, built in zip(pending, classify_and_build_many(parsed)):
+                if isinstance(built, ValueError):
+                    results[i] = built
+                    continue
+                results[i] = (built[0], built[1], False)
+                if ingest_cache is not None:
+                    ingest_cache.put(shas[i], {"outline": built[0], "sections": built[1]})
+
+        documents = []
+        for i, ((original_name, filename, filepath), result) in enumerate(zip(saved, results)):
+            if isinstance(result, ValueError):
+                os.remove(filepath)
+                documents.append({"success": False, "original_name": original_name, "error": str(result)})
+                continue
+            structured_json, sections, was_cached = result
+            documents.append({
+                "success": True,
+                "original_name": original_name,
+                "filename": filename,
+                "document_id": register_document(filename, filepath, shas[i], sections),
+                "outline": structured_json,
+                "sections": sections,
+                "cached": was_cached,
+                "message": f"Successfully processed PDF and found {len(structured_json['outline'])} headings and {len(sections)} sections"
+            })
+        documents.extend(errors)
+
+        return jsonify({
+            "success": any(d["success"] for d in documents),
+            "documents": documents,
+            "count": len(documents)
+        })
+
+    except Exception as e:
+        logger.exception(f"Error processing batch upload: {str(e)}")
+        return jsonify({"error": "Internal server error", "details": str(e)}), 500
+
+#--------------------------------------- #
+# registered documents for the queries   #
+#--------------------------------------- #
+def _request_documents(data):
+    """'documents' from the body plus one {"filename": id} entry per id in 'document_ids'."""
+    documents = data.get('documents', [])
+    document_ids = data.get('document_ids', [])
+    if not isinstance(documents, list) or not isinstance(document_ids, list):
+        return None
+    return documents + [{"filename": doc_id} for doc_id in document_ids]
+
+def _stored_section_data(doc):
+    """
+    (section_data entries, vectors) for a document registered at upload, or None so the
+    caller embeds the sections sent in the request instead.
+    """
+    if document_store is None or not isinstance(doc, dict):
+        return None
+    doc_id = doc.get('document_id') or doc.get('filename') or doc.get('serverFilename') or doc.get('name')
+    stored = document_store.get(doc_id)
+    if stored is None:
+        return None
+    entries = [_stored_section_entry(stored, i) for i in range(len(stored.sections))]
+    return entries, stored
+
+def _stored_section_entry(stored, i):
+    sec = stored.sections[i]
+    return {
+        'section_key': (stored.doc_id, i),
+        'Document': stored.filename,
+        'Page': sec['page'] if sec['page'] is not None else -1,
+        'heading': sec['heading'],
+        'text': sec['text'],
+        'embedding': stored.vectors[i],
+        'rects': sec['rects'] or [],
+        'start_line': sec['start_line'],
+        'end_line': sec['end_line'],
+        'start_page': sec['start_page'],
+        'end_page': sec['end_page']
+    }
+
+def _section_embeddings(section_data, stored_blocks, pending):
+    """
+    (n, dim) matrix aligned with section_data: stored documents contribute their vectors
+    at the recorded offsets, and the request's own sections (pending indices) are
+    encoded together in one batched pass and written back into their entries.
+    """
+    vectors = embed_texts([section_data[i]['text'] for i in pending]) if pending else None
+    if vectors is not None:
+        dim = vectors.shape[1]
+    else:
+        dim = next(doc.vectors.shape[1] for _, doc in stored_blocks if len(doc.vectors))
+    embeddings = np.empty((len(section_data), dim), dtype=np.float32)
+    for offset, doc in stored_blocks:
+        embeddings[offset:offset + len(doc.vectors)] = doc.vectors
+    if vectors is not None:
+        embeddings[pending] = vectors
+        for i, vec in zip(pending, vectors):
+            section_data[i]['embedding'] = vec
+    return embeddings
+
+def _retrieval_candidates(data, query_text, section_data, stored_blocks, pending, min_keep):
+    """
+    (section_data, embeddings, retrieval_info) for MMR. Dense mode keeps every section.
+    Hybrid mode keeps the HYBRID_CANDIDATES best BM25 matches (stored documents scored by
+    the upload-time lexical index, client-sent sections on the fly) and embeds/scores
+    only those; with fewer than min_keep matching sections it stays dense.
+    retrieval_info is None in dense mode.
+    """
+    mode = data.get('retrieval') or RETRIEVAL_MODE
+    if mode != "hybrid" or lexical_index is None:
+        return section_data, _section_embeddings(section_data, stored_blocks, pending), None
+
+    scores = np.zeros(len(section_data), dtype=np.float32)
+    indexed = lexical_index.score(query_text, [doc.doc_id for _, doc in stored_blocks])
+    for offset, doc in stored_blocks:
+        doc_scores = indexed.get(doc.doc_id)
+        if doc_scores is None:
+            doc_scores = lexical_index.score_texts(query_text, [_lexical_text(s) for s in doc.sections])
+        scores[offset:offset + len(doc_scores)] = doc_scores
+    if pending:
+        scores[pending] = lexical_index.score_texts(query_text, [_lexical_text(section_data[i]) for i in pending])
+
+    matched = np.flatnonzero(scores > 0)
+    info = {"mode": "hybrid", "lexical_matches": int(len(matched)), "sections": len(section_data)}
+    if len(matched) < min_keep:
+        info["mode"] = "dense (too few lexical matches)"
+        return section_data, _section_embeddings(section_data, stored_blocks, pending), info
+    if len(matched) > HYBRID_CANDIDATES:
+        matched = matched[np.argpartition(-scores[matched], HYBRID_CANDIDATES - 1)[:HYBRID_CANDIDATES]]
+    # document order, as in dense mode, so ties still resolve the same way
+    keep = np.sort(matched)
+    info["candidates"] = int(len(keep))
+
+    block_of = np.full(len(section_data), -1, dtype=np.int64)
+    for b, (offset, doc) in enumerate(stored_blocks):
+        block_of[offset:offset + len(doc.sections)] = b
+    subset = [section_data[i] for i in keep]
+    vectors = [None] * len(keep)
+    to_encode = []
+    for j, i in enumerate(keep):
+        if block_of[i] >= 0:
+            offset, doc = stored_blocks[block_of[i]]
+            vectors[j] = doc.vectors[i - offset]
+        else:
+            to_encode.append(j)
+    if to_encode:
+        encoded = embed_texts([subset[j]['text'] for j in to_encode])
+        for j, vec in zip(to_encode, encoded):
+            subset[j]['embedding'] = vec
+            vectors[j] = vec
+    return subset, np.vstack(vectors).astype(np.float32, copy=False), info
+
+def _collapse_duplicates(data, section_data, embeddings):
+    """
+    (section_data, embeddings, collapsed) with one section per near-duplicate group of
+    stored sections: the first in request order stands for the group and the others are
+    attached to it as sec['duplicates'] instead of being scored.
+    """
+    if duplicate_index is None or not data.get('dedup', True):
+        return section_data, embeddings, 0
+    keep, first = [], {}
+    for i, sec in enumerate(section_data):
+        key = sec.get('section_key')
+        if key is None:
+            keep.append(i)
+            continue
+        group = duplicate_index.canonical(*key)
+        j = first.get(group)
+        if j is None:
+            first[group] = i
+            keep.append(i)
+        else:
+            section_data[j].setdefault('duplicates', []).append(sec)
+    if len(keep) == len(section_data):
+        return section_data, embeddings, 0
+    return [section_data[i] for i in keep], embeddings[keep], len(section_data) - len(keep)
+
+def _duplicate_refs(sec):
+    """The copies _collapse_duplicates attached to a result section, for the response."""
+    return [{
+        "document": d['Document'],
+        "document_id": d['section_key'][0],
+        "section_title": d['heading'],
+        "page_number": d['Page'],
+        "rects": d['rects'],
+        "start_line": d['start_line'],
+        "end_line": d['end_line'],
+        "start_page": d['start_page'],
+        "end_page": d['end_page']
+    } for d in sec.get('duplicates', [])]
+
+def _highlights(data, output, build_pdf=highlight_refined_texts, color=HIGHLIGHT_COLOR):
+    """(annotated_files, highlight_overlays) for a query result under the request's highlight mode."""
+    mode = data.get('highlight') or HIGHLIGHT_MODE
+    if mode == "pdf":
+        return build_pdf(output, cache=get_annotated_cache()), None
+    return {}, highlight_overlays(output, fmt="xfdf" if mode == "xfdf" else "json", color=color)
+
 #---------------------------- #
 # negative pdf query          #
 #---------------------------- #
@@ -614,19 +1487,24 @@ def pdf_query_negative():
             return jsonify({"error": "Invalid JSON"}), 400
 
         selectedText = data.get('selectedText')
-        documents = data.get('documents', [])
-        if not isinstance(documents, list):
+        documents = _request_documents(data)
+        if documents is None:
             return jsonify({"error": "documents must be a list"}), 400
 
-        if embedder is None:
+        if get_embedder() is None:
             return jsonify({"error": "Embedder not loaded on server"}), 500
 
         # Generate contradictory query
         query_text = generate_contradictory(selectedText)
-        query_embedding = embedder.encode(query_text, normalize_embeddings=True)
+        query_embedding = embed_query(query_text)
 
-        section_data = []
+        section_data, stored_blocks, pending = [], [], []
         for doc in documents:
+            stored = _stored_section_data(doc)
+            if stored is not None:
+                stored_blocks.append((len(section_data), stored[1]))
+                section_data.extend(stored[0])
+                continue
             filename = doc.get('filename') or doc.get('serverFilename') or doc.get('name')
             sections_list = doc.get('sections')
             if not sections_list:
@@ -648,13 +1526,13 @@ def pdf_query_negative():
                 else:
                     continue
 
-                emb = embedder.encode(full_text, normalize_embeddings=True)
+                pending.append(len(section_data))
                 section_data.append({
                     'Document': filename,
                     'Page': page if page is not None else -1,
                     'heading': heading,
                     'text': full_text,
-                    'embedding': emb,
+                    'embedding': None,
                     'rects': rects,
                     'start_line': start_line,
                     'end_line': end_line,
@@ -664,9 +1542,11 @@ def pdf_query_negative():
 
         if not section_data:
             return jsonify({"error": "No headings/sections found"}), 400
+        embeddings = _section_embeddings(section_data, stored_blocks, pending)
+        section_data, embeddings, collapsed = _collapse_duplicates(data, section_data, embeddings)
 
         top_k = min(5, len(section_data))
-        selected_indices, sim_scores = mmr(query_embedding, section_data, lambda_param=0.72, top_k=top_k)
+        selected_indices, sim_scores = mmr(query_embedding, section_data, lambda_param=0.72, top_k=top_k, embeddings=embeddings)
 
         now = datetime.now().isoformat()
         output = {
@@ -678,6 +1558,8 @@ def pdf_query_negative():
             "extracted_sections": [],
             "subsection_analysis": []
         }
+        if collapsed:
+            output['metadata']['duplicates_collapsed'] = collapsed
 
         for rank, idx in enumerate(selected_indices, start=1):
             sec = section_data[idx]
@@ -692,6 +1574,8 @@ def pdf_query_negative():
                 "start_page": sec.get('start_page'),
                 "end_page": sec.get('end_page')
             })
+            if sec.get('duplicates'):
+                output['extracted_sections'][-1]['duplicates'] = _duplicate_refs(sec)
             output['subsection_analysis'].append({
                 "document": sec['Document'],
                 "refined_text": sec['text'],
@@ -702,7 +1586,7 @@ def pdf_query_negative():
                 "start_page": sec.get('start_page'),
                 "end_page": sec.get('end_page')
             })
-        annotated_map = highlight_refined_texts_negative(output)
+        annotated_map, overlays = _highlights(data, output, highlight_refined_texts_negative, NEGATIVE_HIGHLIGHT_COLOR)
         # Build the text for LLM podcast summarization, preserving importance order
         sections_formatted = "\n\n".join(
             f"Section {i+1} (Rank {sec.get('importance_rank', '?')}): {sec.get('section_title', 'Untitled')}\n{sec['refined_text']}"
@@ -712,6 +1596,8 @@ def pdf_query_negative():
         output['sections_formatted'] = sections_formatted
         
         output['metadata']['annotated_files'] = annotated_map
+        if overlays is not None:
+            output['metadata']['highlight_overlays'] = overlays
 
         
         print("done pdf negative processing to find contradictions")
@@ -750,7 +1636,7 @@ def generate_summary():
         ---
         """
 
-        summary_text = llm.generate(prompt).strip()
+        summary_text = get_llm().generate(prompt).strip()
         return jsonify({"summary": summary_text})
 
     except Exception as e:
@@ -784,7 +1670,7 @@ def generate_didyouknow():
         ---
         """
 
-        didyouknow_text = llm.generate(prompt).strip()
+        didyouknow_text = get_llm().generate(prompt).strip()
         return jsonify({"didYouKnow": didyouknow_text})
     except Exception as e:
         logger.exception("Error in generate_didyouknow")
@@ -815,10 +1701,10 @@ def generate_podcast():
         ---
         """
 
-        podcast_script = llm.generate(prompt).strip()
+        podcast_script = get_llm().generate(prompt).strip()
 
         # Generate audio file
-        tts = gTTS(text=podcast_script, lang="en", slow=False)
+        tts = gtts.gTTS(text=podcast_script, lang="en", slow=False)
         filename = secure_filename(f"podcast_{int(time.time())}.mp3")
         file_path = os.path.join(AUDIO_DIR, filename)
         tts.save(file_path)
@@ -846,18 +1732,28 @@ def pdf_query():
             return jsonify({"error": "Invalid JSON"}), 400
 
         selectedText = data.get('selectedText')
-        documents = data.get('documents', [])
-        if not isinstance(documents, list):
+        documents = _request_documents(data)
+        if documents is None:
             return jsonify({"error": "documents must be a list"}), 400
+        try:
+            contra_top_k, contra_diversity = _contra_params(data)
+        except (TypeError, ValueError):
+            return jsonify({"error": "contra_top_k must be an integer and contra_diversity a number "
+                                     "between 0 and 1 (or null)"}), 400
 
-        if embedder is None:
+        if get_embedder() is None:
             return jsonify({"error": "Embedder not loaded on server"}), 500
 
         query_text = selectedText
-        query_embedding = embedder.encode(query_text, normalize_embeddings=True)
+        query_embedding = embed_query(query_text)
 
-        section_data = []
+        section_data, stored_blocks, pending = [], [], []
         for doc in documents:
+            stored = _stored_section_data(doc)
+            if stored is not None:
+                stored_blocks.append((len(section_data), stored[1]))
+                section_data.extend(stored[0])
+                continue
             filename = doc.get('filename') or doc.get('serverFilename') or doc.get('name')
             sections_list = doc.get('sections')
             if not sections_list:
@@ -893,13 +1789,13 @@ def pdf_query():
                     start_page = item.get('start_page') if isinstance(item, dict) else None
                     end_page = item.get('end_page') if isinstance(item, dict) else None
 
-                emb = embedder.encode(full_text, normalize_embeddings=True)
+                pending.append(len(section_data))
                 section_data.append({
                     'Document': filename,
                     'Page': page if page is not None else -1,
                     'heading': heading,
                     'text': full_text,
-                    'embedding': emb,
+                    'embedding': None,
                     'rects': rects,
                     'start_line': start_line,
                     'end_line': end_line,
@@ -909,15 +1805,22 @@ def pdf_query():
 
         if not section_data:
             return jsonify({"error": "No headings/sections found in supplied documents"}), 400
+        top_k = min(5, len(section_data))
+        section_data, embeddings, retrieval = _retrieval_candidates(
+            data, query_text, section_data, stored_blocks, pending, top_k)
+        section_data, embeddings, collapsed = _collapse_duplicates(data, section_data, embeddings)
+        top_k = min(top_k, len(section_data))
+
+        # one scoring pass serves both views
+        sim_q = query_similarities(query_embedding, embeddings)
 
         # Positive retrieval
-        top_k = min(5, len(section_data))
-        pos_indices, pos_scores = mmr(query_embedding, section_data, lambda_param=0.72, top_k=top_k, isContra=0)
+        pos_indices, pos_scores = mmr(query_embedding, section_data, lambda_param=0.72, top_k=top_k, embeddings=embeddings, sim_q=sim_q)
 
         # Negative retrieval (contradictory)
         #neg_query = generate_contradictory(selectedText)
         #neg_query_emb = embedder.encode(neg_query, normalize_embeddings=True)
-        neg_indices, neg_scores = mmr(query_embedding, section_data, lambda_param=0.72, top_k=0, isContra=1)
+        neg_indices = contra_select(sim_q, contra_top_k, embeddings=embeddings, diversity=contra_diversity)
 
         def build_output(indices, label):
             now = datetime.now().isoformat()
@@ -930,6 +1833,10 @@ def pdf_query():
                 "extracted_sections": [],
                 "subsection_analysis": []
             }
+            if retrieval is not None:
+                out['metadata']['retrieval'] = retrieval
+            if collapsed:
+                out['metadata']['duplicates_collapsed'] = collapsed
 
             for rank, idx in enumerate(indices, start=1):
                 sec = section_data[idx]
@@ -944,6 +1851,8 @@ def pdf_query():
                     "start_page": sec.get('start_page'),
                     "end_page": sec.get('end_page')
                 })
+                if sec.get('duplicates'):
+                    out['extracted_sections'][-1]['duplicates'] = _duplicate_refs(sec)
                 out['subsection_analysis'].append({
                     "document": sec['Document'],
                     "refined_text": sec['text'],
@@ -955,7 +1864,11 @@ def pdf_query():
                     "end_page": sec.get('end_page')
                 })
 
-            annotated_map = highlight_refined_texts(out)
+            if label == "Negative":
+                annotated_map, overlays = _highlights(
+                    data, out, highlight_refined_texts_negative, NEGATIVE_HIGHLIGHT_COLOR)
+            else:
+                annotated_map, overlays = _highlights(data, out)
             sections_formatted = "\n\n".join(
                 f"Section {i+1} (Rank {sec.get('importance_rank', '?')}): {sec.get('section_title', 'Untitled')}\n{sec['refined_text']}"
                 for i, sec in enumerate(sorted(out['subsection_analysis'], key=lambda x: x.get('importance_rank', 999)))
@@ -963,6 +1876,8 @@ def pdf_query():
             )
             out['sections_formatted'] = sections_formatted
             out['metadata']['annotated_files'] = annotated_map
+            if overlays is not None:
+                out['metadata']['highlight_overlays'] = overlays
             return out
 
         output = {
@@ -1000,18 +1915,23 @@ def role_query():
         if not persona or not job:
             return jsonify({"error": "Missing persona or job_to_be_done"}), 400
 
-        documents = data.get('documents', [])
-        if not isinstance(documents, list):
+        documents = _request_documents(data)
+        if documents is None:
             return jsonify({"error": "documents must be a list"}), 400
 
-        if embedder is None:
+        if get_embedder() is None:
             return jsonify({"error": "Embedder not loaded on server"}), 500
         numRanks = data.get('numRanks')
         query_text = f"{job} {persona}"
-        query_embedding = embedder.encode(query_text, normalize_embeddings=True)
+        query_embedding = embed_query(query_text)
 
-        section_data = []
+        section_data, stored_blocks, pending = [], [], []
         for doc in documents:
+            stored = _stored_section_data(doc)
+            if stored is not None:
+                stored_blocks.append((len(section_data), stored[1]))
+                section_data.extend(stored[0])
+                continue
             filename = doc.get('filename') or doc.get('serverFilename') or doc.get('name')
             sections_list = doc.get('sections')
             if not sections_list:
@@ -1047,13 +1967,13 @@ def role_query():
                     start_page = item.get('start_page') if isinstance(item, dict) else None
                     end_page = item.get('end_page') if isinstance(item, dict) else None
 
-                emb = embedder.encode(full_text, normalize_embeddings=True)
+                pending.append(len(section_data))
                 section_data.append({
                     'Document': filename,
                     'Page': page if page is not None else -1,
                     'heading': heading,
                     'text': full_text,
-                    'embedding': emb,
+                    'embedding': None,
                     'rects': rects,
                     'start_line': start_line,
                     'end_line': end_line,
@@ -1063,9 +1983,12 @@ def role_query():
 
         if not section_data:
             return jsonify({"error": "No headings/sections found in supplied documents"}), 400
-
         top_k = min(numRanks, len(section_data))
-        selected_indices, sim_scores = mmr(query_embedding, section_data, lambda_param=0.72, top_k=top_k)
+        section_data, embeddings, retrieval = _retrieval_candidates(
+            data, query_text, section_data, stored_blocks, pending, top_k)
+        section_data, embeddings, collapsed = _collapse_duplicates(data, section_data, embeddings)
+        top_k = min(top_k, len(section_data))
+        selected_indices, sim_scores = mmr(query_embedding, section_data, lambda_param=0.72, top_k=top_k, embeddings=embeddings)
 
         now = datetime.now().isoformat()
         output = {
@@ -1078,6 +2001,10 @@ def role_query():
             "extracted_sections": [],
             "subsection_analysis": []
         }
+        if retrieval is not None:
+            output['metadata']['retrieval'] = retrieval
+        if collapsed:
+            output['metadata']['duplicates_collapsed'] = collapsed
 
         for rank, idx in enumerate(selected_indices, start=1):
             sec = section_data[idx]
@@ -1092,6 +2019,8 @@ def role_query():
                 "start_page": sec.get('start_page'),
                 "end_page": sec.get('end_page')
             })
+            if sec.get('duplicates'):
+                output['extracted_sections'][-1]['duplicates'] = _duplicate_refs(sec)
             output['subsection_analysis'].append({
                 "document": sec['Document'],
                 "refined_text": sec['text'],
@@ -1103,7 +2032,7 @@ def role_query():
                 "end_page": sec.get('end_page')
             })
 
-        annotated_map = highlight_refined_texts(output)  # returns { original_filename: annotated_filename, ... }
+        annotated_map, overlays = _highlights(data, output)  # annotated copies only in "pdf" mode
 
         # Build the text for LLM podcast summarization, preserving importance order
         sections_formatted = "\n\n".join(
@@ -1112,8 +2041,10 @@ def role_query():
             if sec.get('refined_text')
         )
 
-        # attach to metadata so frontend can use annotated copies
+        # attach to metadata so frontend can use annotated copies (or draw the overlays)
         output['metadata']['annotated_files'] = annotated_map
+        if overlays is not None:
+            output['metadata']['highlight_overlays'] = overlays
         
         output['sections_formatted'] = sections_formatted
         return jsonify(output)
@@ -1123,6 +2054,33 @@ def role_query():
         return jsonify({"error": "Internal server error", "details": str(e)}), 500
 
 #----------------------------- PDF Route handling --------------------------------------#
+@app.route('/annotated_pdf', methods=['POST'])
+def annotated_pdf():
+    """
+    Annotated copy of one document for download: {"document": filename,
+    "extracted_sections": [...] (from a query result), "negative": false}. This is the only
+    place overlay-mode queries write a PDF.
+    """
+    try:
+        data = request.get_json(force=True)
+        if data is None:
+            return jsonify({"error": "Invalid JSON"}), 400
+        fname = secure_filename(data.get('document') or '')
+        sections = [s for s in data.get('extracted_sections') or []
+                    if isinstance(s, dict) and s.get('document') == fname]
+        if not fname or not sections:
+            return jsonify({"error": "document and its extracted_sections are required"}), 400
+        build_pdf = highlight_refined_texts_negative if data.get('negative') else highlight_refined_texts
+        annotated = build_pdf({"extracted_sections": sections}, cache=get_annotated_cache()).get(fname)
+        if annotated is None:
+            return jsonify({"error": f"No highlights could be added to '{fname}'"}), 404
+        return send_from_directory(app.config['UPLOAD_FOLDER'], annotated, as_attachment=True,
+                                   download_name=f"annotated_{fname}")
+
+    except Exception as e:
+        logger.exception("Error in annotated_pdf")
+        return jsonify({"error": "Internal server error", "details": str(e)}), 500
+
 @app.route('/uploads/<path:filename>', methods=['GET'])
 def serve_pdf(filename):
     safe_name = secure_filename(filename)
@@ -1155,7 +2113,7 @@ def generate(task):
         elif task != "generate":
             return jsonify({"error": "Invalid task"}), 400
 
-        response = llm.generate(prompt)
+        response = get_llm().generate(prompt)
         return jsonify({"response": response})
     except Exception as e:
         logger.exception("Error in generate")
@@ -1204,7 +2162,7 @@ def podcast():
         podcast_prompt = podcast_input + """
         Please create a concise and engaging 2-minute summary...
         """
-        script_text = llm.generate(podcast_prompt)
+        script_text = get_llm().generate(podcast_prompt)
 
         # 2. Convert to Audio
         filename = secure_filename(f"podcast_{int(time.time())}.mp3")
@@ -1214,10 +2172,10 @@ def podcast():
 
         if tts_provider == "azure":
             # Use Adobe’s provided script (Azure TTS)
-            generate_audio(script_text, file_path)  
+            tts_providers.generate_audio(script_text, file_path)  
         else:
             # Local dev: fallback to Google TTS
-            tts = gTTS(text=script_text, lang="en", slow=False)
+            tts = gtts.gTTS(text=script_text, lang="en", slow=False)
             tts.save(file_path)
 
         # 3. Return script + audio URL
@@ -1231,6 +2189,17 @@ def podcast():
         return jsonify({"error": str(e)}), 500
 
 
+profile.record("import", "app (module total)", "core", profile.elapsed())
+
+if WARMUP_ENABLED and __name__ != '__main__' and not in_spawned_worker():
+    # imported by a WSGI server: warm up in the background, /readyz flips when done
+    warmup.start()
+
 if __name__ == '__main__':
-    load_model()
+    if WARMUP_ENABLED and FAST_START:
+        warmup.start()
+    elif WARMUP_ENABLED:
+        warmup.run()
+    elif not FAST_START:
+        load_model()
     app.run(debug=True, host='0.0.0.0', port=5001)
@@ -0,0 +1,237 @@
+# documentStore.py
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# section fields kept in the store (everything /upload returns per section)
+SECTION_FIELDS = ("heading", "text", "page", "start_line", "start_page", "end_line", "end_page", "rects")
+
+
+def embed_text(section):
+    """The text a section is embedded from."""
+    return section.get("text") or section.get("heading") or ""
+
+
+class StoredDocument:
+    __slots__ = ("doc_id", "filename", "content_sha", "sections", "vectors")
+
+    def __init__(self, doc_id, filename, content_sha, sections, vectors):
+        self.doc_id = doc_id
+        self.filename = filename
+        self.content_sha = content_sha
+        self.sections = sections
+        self.vectors = vectors
+
+
+class DocumentStore:
+    """
+    Server-side registry of uploaded documents for the query endpoints.
+    - <root>/docs/<doc_id>.json holds the document's filename, content SHA-256 and section
+      metadata (heading, text, page, line range, rects).
+    - <root>/vectors/<model_tag>/<sha[:2]>/<sha>.npy holds the normalised section embeddings,
+      one float32 row per section. Vectors are keyed by content, so re-uploading the same
+      bytes under a new name embeds nothing; a new model tag re-embeds lazily from the
+      stored texts.
+    - encode(texts) -> (n, dim) float32 is supplied by the app (it owns the embedder).
+    - Recently used documents stay in memory (vectors memory-mapped), up to max_loaded.
+    - vectors(doc_id) memory-maps just the embeddings, for the indexes: no section
+      metadata is kept and nothing is ever embedded.
+    """
+
+    def __init__(self, root, model_tag, encode, max_loaded=256):
+        self.root = root
+        self.model_tag = model_tag
+        self.encode = encode
+        self.max_loaded = max(1, int(max_loaded))
+        self.docs_dir = os.path.join(root, "docs")
+        self.vectors_dir = os.path.join(root, "vectors", model_tag)
+        os.makedirs(self.docs_dir, exist_ok=True)
+        os.makedirs(self.vectors_dir, exist_ok=True)
+        self._loaded = OrderedDict()
+        self._vector_refs = {}     # doc_id -> (content_sha, section count)
+        self._lock = threading.Lock()
+
+    def _doc_path(self, doc_id):
+        return os.path.join(self.docs_dir, f"{doc_id}.json")
+
+    def _vectors_path(self, content_sha):
+        return os.path.join(self.vectors_dir, content_sha[:2], f"{content_sha}.npy")
+
+    @staticmethod
+    def _atomic_write(path, write):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except Exception:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def _load_vectors(self, content_sha, n_sections):
+        try:
+            vectors = np.load(self._vectors_path(content_sha), mmap_mode='r')
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable vectors for {content_sha[:12]}: {e}")
+            return None
+        return vectors if vectors.shape[0] == n_sections else None
+
+    def _embed(self, content_sha, sections, reuse=None):
+        texts = [embed_text(s) for s in sections]
+        if reuse is None or not texts:
+            vectors = np.ascontiguousarray(self.encode(texts), dtype=np.float32) if texts else np.zeros((0, 0), np.float32)
+        else:
+            vectors = self._embed_reusing(texts, reuse)
+        self._atomic_write(self._vectors_path(content_sha), lambda f: np.save(f, vectors))
+        return vectors
+
+    def _embed_reusing(self, texts, reuse):
+        # reuse[i]: None (encode), an earlier section index, or a vector to copy
+        todo = [i for i, r in enumerate(reuse) if r is None]
+        encoded = np.asarray(self.encode([texts[i] for i in todo]), dtype=np.float32) if todo else None
+        if encoded is not None:
+            dim = encoded.shape[1]
+        else:
+            dim = len(next(r for r in reuse if not isinstance(r, int)))
+        vectors = np.empty((len(texts), dim), dtype=np.float32)
+        if encoded is not None:
+            vectors[todo] = encoded
+        for i, r in enumerate(reuse):
+            if r is not None:
+                vectors[i] = vectors[r] if isinstance(r, int) else r
+        return vectors
+
+    def put(self, doc_id, filename, content_sha, sections, reuse=None):
+        """
+        Register a document; embeds its sections unless vectors for these bytes exist.
+        reuse (one item per section) lets near-duplicate sections skip the encoder: None
+        encodes the section, an int copies an earlier section's vector, an array is used
+        as is.
+        """
+        sections = [{k: s.get(k) for k in SECTION_FIELDS} for s in sections]
+        vectors = self._load_vectors(content_sha, len(sections))
+        if vectors is None:
+            vectors = self._embed(content_sha, sections, reuse)
+        meta = {
+            "doc_id": doc_id,
+            "filename": filename,
+            "content_sha": content_sha,
+            "created_at": time.time(),
+            "sections": sections,
+        }
+        self._atomic_write(self._doc_path(doc_id), lambda f: f.write(json.dumps(meta).encode('utf-8')))
+        doc = StoredDocument(doc_id, filename, content_sha, sections, vectors)
+        self._remember(doc)
+        return doc
+
+    def _remember(self, doc):
+        with self._lock:
+            self._vector_refs[doc.doc_id] = (doc.content_sha, len(doc.sections))
+            self._loaded[doc.doc_id] = doc
+            self._loaded.move_to_end(doc.doc_id)
+            while len(self._loaded) > self.max_loaded:
+                self._loaded.popitem(last=False)
+
+    def get(self, doc_id):
+        """The stored document (sections + vectors), or None if doc_id was never registered."""
+        if not doc_id or os.path.basename(doc_id) != doc_id:
+            return None
+        with self._lock:
+            doc = self._loaded.get(doc_id)
+            if doc is not None:
+                self._loaded.move_to_end(doc_id)
+                return doc
+        try:
+            with open(self._doc_path(doc_id), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable document record {doc_id}: {e}")
+            return None
+
+        sections = meta["sections"]
+        vectors = self._load_vectors(meta["content_sha"], len(sections))
+        if vectors is None:
+            # stored under another model tag (or lost): embed again from the stored texts
+            vectors = self._embed(meta["content_sha"], sections)
+        doc = StoredDocument(doc_id, meta["filename"], meta["content_sha"], sections, vectors)
+        self._remember(doc)
+        return doc
+
+    def vectors(self, doc_id):
+        """
+        The document's (n_sections, dim) vectors memory-mapped from their .npy, or None if
+        it is unknown or has no vectors under this model tag. The record is read once per
+        document for its content hash; the vectors are never re-embedded here.
+        """
+        if not doc_id or os.path.basename(doc_id) != doc_id:
+            return None
+        with self._lock:
+            doc = self._loaded.get(doc_id)
+            if doc is not None:
+                return doc.vectors
+            ref = self._vector_refs.get(doc_id)
+        if ref is None:
+            try:
+                with open(self._doc_path(doc_id), 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+            except FileNotFoundError:
+                return None
+            except Exception as e:
+                logger.warning(f"Ignoring unreadable document record {doc_id}: {e}")
+                return None
+            ref = (meta["content_sha"], len(meta["sections"]))
+            with self._lock:
+                self._vector_refs[doc_id] = ref
+        return self._load_vectors(*ref)
+
+    def doc_ids(self, by_created=False):
+        """Stored document ids; by_created=True orders them by upload time (reads every record)."""
+        ids = [name[:-len(".json")] for name in os.listdir(self.docs_dir) if name.endswith(".json")]
+        if not by_created:
+            return ids
+        created = {}
+        for doc_id in ids:
+            try:
+                with open(self._doc_path(doc_id), 'r', encoding='utf-8') as f:
+                    created[doc_id] = float(json.load(f).get("created_at") or 0.0)
+            except Exception:
+                created[doc_id] = 0.0
+        return sorted(ids, key=lambda doc_id: (created[doc_id], doc_id))
+
+    def delete(self, doc_id):
+        """Forget a document; its vectors stay, since other ids may share the same bytes."""
+        if not doc_id or os.path.basename(doc_id) != doc_id:
+            return False
+        with self._lock:
+            self._loaded.pop(doc_id, None)
+            self._vector_refs.pop(doc_id, None)
+        try:
+            os.remove(self._doc_path(doc_id))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def stats(self):
+        with self._lock:
+            loaded = len(self._loaded)
+        return {
+            "model_tag": self.model_tag,
+            "documents": sum(1 for name in os.listdir(self.docs_dir) if name.endswith(".json")),
+            "loaded": loaded,
+            "max_loaded": self.max_loaded,
+        }
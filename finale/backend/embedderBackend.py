@@ -0,0 +1,217 @@
+# embedderBackend.py
+# Selectable execution backend for the sentence embedder (EMBEDDER_BACKEND):
+#   torch       the SentenceTransformer as loaded (float32)
+#   torch-int8  torch dynamic int8 quantisation of every nn.Linear (weights int8,
+#               activations quantised per batch); no extra dependencies
+#   onnx        the whole pipeline (transformer + pooling [+ normalize]) exported once to
+#               <model dir>/onnx/model.onnx and run by onnxruntime; needs the onnx and
+#               onnxruntime packages, otherwise falls back to torch with a warning
+# Every backend exposes what the app uses: encode(), tokenizer, max_seq_length and
+# get_sentence_embedding_dimension().
+#
+# Benchmark (throughput, and cosine drift against the float32 model on our sections):
+#   python embedderBackend.py [model_dir] [--backends torch-int8,onnx] [--limit 500]
+import logging
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("torch", "torch-int8", "onnx")
+ONNX_OPSET = 14
+
+
+def quantize_dynamic_int8(model):
+    """Quantise the model's Linear layers to int8 in place (torch dynamic quantisation)."""
+    import torch
+    model.eval()
+    torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    return model
+
+
+def onnx_path_for(model_dir):
+    return os.path.join(model_dir, "onnx", "model.onnx")
+
+
+def export_onnx(model, path, opset=ONNX_OPSET):
+    """Export input_ids/attention_mask -> sentence_embedding for a SentenceTransformer."""
+    import torch
+
+    class _SentenceEmbedding(torch.nn.Module):
+        def __init__(self, st):
+            super().__init__()
+            self.st = st
+
+        def forward(self, input_ids, attention_mask):
+            return self.st({"input_ids": input_ids, "attention_mask": attention_mask})["sentence_embedding"]
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    sample = model.tokenizer(["export sample", "a somewhat longer export sample"], padding=True, return_tensors="pt")
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with torch.no_grad():
+            torch.onnx.export(
+                _SentenceEmbedding(model).eval(), (sample["input_ids"], sample["attention_mask"]), tmp_path,
+                input_names=["input_ids", "attention_mask"], output_names=["sentence_embedding"],
+                dynamic_axes={"input_ids": {0: "batch", 1: "tokens"}, "attention_mask": {0: "batch", 1: "tokens"},
+                              "sentence_embedding": {0: "batch"}},
+                opset_version=opset,
+            )
+        os.replace(tmp_path, path)
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    logger.info(f"Exported ONNX embedder to {path}")
+    return path
+
+
+class OnnxSentenceEncoder:
+    """
+    SentenceTransformer.encode() work-alike over an onnxruntime session.
+    - Tokenises with the model's own tokenizer (same padding/truncation arguments, so
+      sectionEncoder's length bucketing sees identical token counts).
+    - Batches longest-first like SentenceTransformer and restores input order.
+    """
+
+    def __init__(self, model, path, threads=None):
+        import onnxruntime as ort
+        self.tokenizer = model.tokenizer
+        self.max_seq_length = model.max_seq_length
+        self._dim = model.get_sentence_embedding_dimension()
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = int(threads)
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+    def get_sentence_embedding_dimension(self):
+        return self._dim
+
+    def encode(self, sentences, batch_size=32, show_progress_bar=None, convert_to_numpy=True,
+               normalize_embeddings=False, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        out = np.zeros((len(texts), self._dim), dtype=np.float32)
+        order = np.argsort([-len(t) for t in texts], kind='stable')
+        for start in range(0, len(texts), batch_size):
+            idx = order[start:start + batch_size]
+            features = self.tokenizer(
+                [texts[i] for i in idx], padding=True, truncation="longest_first",
+                max_length=self.max_seq_length, return_tensors="np",
+            )
+            out[idx] = self.session.run(["sentence_embedding"], {
+                "input_ids": features["input_ids"].astype(np.int64),
+                "attention_mask": features["attention_mask"].astype(np.int64),
+            })[0]
+        if normalize_embeddings:
+            out /= np.clip(np.linalg.norm(out, axis=1, keepdims=True), 1e-12, None)
+        return out[0] if single else out
+
+
+def build_embedder(model, backend, model_dir):
+    """
+    `model` (a loaded float32 SentenceTransformer) run through `backend`. A backend that
+    cannot be used here is logged and the plain torch model is returned instead.
+    """
+    if backend not in BACKENDS:
+        logger.warning(f"Unknown EMBEDDER_BACKEND {backend!r}; using torch")
+        return model, "torch"
+    if backend == "torch-int8":
+        try:
+            return quantize_dynamic_int8(model), backend
+        except Exception as e:
+            logger.warning(f"torch int8 quantisation failed ({e}); using float32 torch")
+            return model, "torch"
+    if backend == "onnx":
+        try:
+            import onnxruntime  # noqa: F401
+        except ImportError:
+            logger.warning("EMBEDDER_BACKEND=onnx but onnxruntime is not installed; using torch")
+            return model, "torch"
+        path = onnx_path_for(model_dir)
+        try:
+            if not os.path.exists(path):
+                export_onnx(model, path)
+            return OnnxSentenceEncoder(model, path), backend
+        except Exception as e:
+            logger.warning(f"ONNX embedder unavailable ({e}); using torch")
+            return model, "torch"
+    return model, "torch"
+
+
+# ---------------------------------------------------------------------------- benchmark
+def load_section_texts(doc_store_dir="document_store", uploads_dir="uploads", limit=500):
+    """Section texts from the document store, else paragraphs of the PDFs in uploads/."""
+    import json
+    texts = []
+    docs_dir = os.path.join(doc_store_dir, "docs")
+    if os.path.isdir(docs_dir):
+        for name in sorted(os.listdir(docs_dir)):
+            if name.endswith(".json"):
+                with open(os.path.join(docs_dir, name), 'r', encoding='utf-8') as f:
+                    texts.extend(s.get("text") or s.get("heading") or "" for s in json.load(f)["sections"])
+            if len(texts) >= limit:
+                return texts[:limit]
+    if not texts and os.path.isdir(uploads_dir):
+        import fitz
+        for name in sorted(os.listdir(uploads_dir)):
+            if not name.lower().endswith(".pdf"):
+                continue
+            with fitz.open(os.path.join(uploads_dir, name)) as pdf:
+                for page in pdf:
+                    texts.extend(b[4].strip() for b in page.get_text("blocks") if b[4].strip())
+            if len(texts) >= limit:
+                break
+    return texts[:limit]
+
+
+def _bench(encode, texts, repeat=3):
+    encode(texts[:8])  # warm up
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        vectors = encode(texts)
+        best = min(best, time.perf_counter() - t)
+    return best, vectors
+
+
+if __name__ == '__main__':
+    import argparse
+    import copy
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Embedder backend throughput and cosine drift")
+    parser.add_argument("model_dir", nargs="?", default="./cached_model")
+    parser.add_argument("--backends", default="torch-int8,onnx")
+    parser.add_argument("--limit", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    from sentence_transformers import SentenceTransformer
+    base = SentenceTransformer(args.model_dir, device="cpu")
+    texts = load_section_texts(limit=args.limit)
+    if not texts:
+        print("no sections found (upload some PDFs first)")
+        sys.exit(1)
+    encode_with = lambda m: (lambda batch: m.encode(batch, batch_size=args.batch_size, normalize_embeddings=True,
+                                                    convert_to_numpy=True, show_progress_bar=False))
+    base_seconds, base_vectors = _bench(encode_with(base), texts)
+    print(f"{len(texts)} sections, batch size {args.batch_size}")
+    print(f"{'torch':>10}: {len(texts) / base_seconds:8.1f} texts/s  (baseline)")
+    for backend in args.backends.split(","):
+        t = time.perf_counter()
+        embedder, used = build_embedder(copy.deepcopy(base), backend, args.model_dir)
+        load_seconds = time.perf_counter() - t
+        if used != backend:
+            print(f"{backend:>10}: unavailable here (see log)")
+            continue
+        seconds, vectors = _bench(encode_with(embedder), texts)
+        cosine = np.sum(vectors * base_vectors, axis=1)
+        print(f"{backend:>10}: {len(texts) / seconds:8.1f} texts/s  ({base_seconds / seconds:.2f}x), "
+              f"setup {load_seconds:.1f}s, cosine to float32 mean {cosine.mean():.5f} min {cosine.min():.5f}")
@@ -0,0 +1,245 @@
+# embeddingCache.py
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+from ingestCache import make_version_tag
+
+try:
+    import fcntl
+except ImportError:      # not POSIX: one process per cache directory
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+KEY_BYTES = 16
+
+
+def text_key(text):
+    return hashlib.sha256(text.encode('utf-8')).digest()[:KEY_BYTES]
+
+
+def _inode(path):
+    try:
+        return os.stat(path).st_ino
+    except FileNotFoundError:
+        return None
+
+
+class _Segment:
+    """One generation file of records, memory-mapped, with a key -> row index."""
+
+    def __init__(self, path, record):
+        self.path = path
+        self.record = record
+        self.inode = _inode(path)
+        self.map = None
+        self.rows = {}
+        self.mapped_rows = 0
+
+    def scan(self):
+        try:
+            rows = os.path.getsize(self.path) // self.record.itemsize
+        except FileNotFoundError:
+            return
+        if rows <= self.mapped_rows:
+            return
+        self.map = np.memmap(self.path, dtype=self.record, mode='r', shape=(rows,))
+        keys = self.map["key"][self.mapped_rows:rows]
+        for i, key in enumerate(keys.tolist(), start=self.mapped_rows):
+            self.rows.setdefault(key, i)
+        self.mapped_rows = rows
+
+
+class EmbeddingCache:
+    """
+    Content-addressed text -> vector cache in front of the embedder.
+    - Keys are the first 16 bytes of SHA-256(text); the directory
+      <root>/<tag(model_id, normalize, dim)> namespaces them, so another model or
+      normalize flag never sees these vectors.
+    - Memory tier: LRU of up to max_items vectors.
+    - Disk tier: two generations of fixed-size (key, float32 vector) records read
+      through memory maps. Puts append to <dir>/vectors.bin in a single O_APPEND write;
+      once it would pass max_disk_bytes / 2 it becomes vectors.prev.bin (dropping the
+      older generation) and a new vectors.bin starts, so the tier keeps taking new texts
+      within max_disk_bytes. A hit in the previous generation is appended to the current
+      one, so texts still in use survive the next rotation.
+    - Records other workers appended (or a rotation they made) are picked up on the next
+      miss. <dir>/vectors.lock (fcntl) serialises appends, rotations and torn-tail
+      repair across processes; scans take it shared.
+    - stats() reports lookups and hits per tier so the tiers can be sized.
+    """
+
+    def __init__(self, root, model_id, normalize, dim, max_items=20000, max_disk_bytes=1 << 30):
+        self.dim = int(dim)
+        self.max_items = max(0, int(max_items))
+        self.max_disk_bytes = int(max_disk_bytes)
+        self.dir = os.path.join(root, make_version_tag(model_id, f"normalize={bool(normalize)}", self.dim))
+        os.makedirs(self.dir, exist_ok=True)
+        self.path = os.path.join(self.dir, "vectors.bin")
+        self.prev_path = os.path.join(self.dir, "vectors.prev.bin")
+        self.record = np.dtype([("key", f"V{KEY_BYTES}"), ("vec", "<f4", (self.dim,))])
+        self._memory = OrderedDict()
+        self._current = _Segment(self.path, self.record)
+        self._previous = _Segment(self.prev_path, self.record)
+        self._lock_path = os.path.join(self.dir, "vectors.lock")
+        self._lock_fd, self._lock_pid = None, None
+        self._lock = threading.Lock()
+        self._stats = {"lookups": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0, "disk_full_skips": 0,
+                       "promotions": 0, "rotations": 0}
+        with self._lock:
+            with self._file_lock(exclusive=True):
+                self._repair_tail()
+            self._scan()
+
+    @contextmanager
+    def _file_lock(self, exclusive):
+        if fcntl is None:
+            yield
+            return
+        if self._lock_pid != os.getpid():
+            # flock belongs to the open file, which a forked child would share: open our own
+            self._lock_fd = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._lock_pid = os.getpid()
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _repair_tail(self):
+        # a torn record (crash mid-append) would misalign every record after it; call
+        # with the exclusive file lock held
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+        whole = size - size % self.record.itemsize
+        if whole != size:
+            logger.warning(f"Embedding cache: dropping {size - whole} bytes of torn record at {self.path}")
+            with open(self.path, 'r+b') as f:
+                f.truncate(whole)
+        return whole
+
+    def _scan(self):
+        """Map the generations again if they grew or were rotated, and index new keys."""
+        with self._file_lock(exclusive=False):
+            if _inode(self.path) != self._current.inode:
+                # created, or rotated by any worker: the file mapped as current may now be
+                # the previous one
+                if self._current.inode is not None and _inode(self.prev_path) == self._current.inode:
+                    self._current.path = self.prev_path
+                    self._previous = self._current
+                elif self._current.inode is not None:
+                    self._previous = _Segment(self.prev_path, self.record)
+                self._current = _Segment(self.path, self.record)
+            self._previous.scan()
+            self._current.scan()
+
+    def _append(self, records):
+        """Append records to the current generation, rotating first if it would overflow."""
+        segment_bytes = self.max_disk_bytes // 2
+        if records.nbytes > segment_bytes:
+            self._stats["disk_full_skips"] += len(records)
+            return
+        try:
+            with self._file_lock(exclusive=True):
+                if self._repair_tail() + records.nbytes > segment_bytes:
+                    os.replace(self.path, self.prev_path)
+                    self._stats["rotations"] += 1
+                    logger.info(f"Embedding cache: rotated {self.path} to {self.prev_path}")
+                fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    os.write(fd, records.tobytes())
+                finally:
+                    os.close(fd)
+        except OSError as e:
+            logger.warning(f"Failed to append to embedding cache {self.path}: {e}")
+            return
+        # the rows actually written (possibly after other workers' records) come from the file
+        self._scan()
+
+    def _remember(self, key, vector):
+        if not self.max_items:
+            return
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+
+    def get_many(self, texts):
+        """(vectors, missing): (len(texts), dim) float32 with cached rows filled, and the
+        indices of texts not in either tier."""
+        keys = [text_key(t) for t in texts]
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        missing, promote = [], {}
+        with self._lock:
+            self._stats["lookups"] += len(keys)
+            rescanned = False
+            for i, key in enumerate(keys):
+                vec = self._memory.get(key)
+                if vec is not None:
+                    self._memory.move_to_end(key)
+                    vectors[i] = vec
+                    self._stats["memory_hits"] += 1
+                    continue
+                vec = self._disk_get(key)
+                if vec is None and not rescanned:
+                    self._scan()
+                    rescanned = True
+                    vec = self._disk_get(key)
+                if vec is not None:
+                    vectors[i] = vec
+                    self._remember(key, vec)
+                    self._stats["disk_hits"] += 1
+                    if key not in self._current.rows:
+                        promote[key] = vec
+                    continue
+                missing.append(i)
+                self._stats["misses"] += 1
+            if promote:
+                records = np.zeros(len(promote), dtype=self.record)
+                for j, (key, vec) in enumerate(promote.items()):
+                    records[j] = (key, vec)
+                self._stats["promotions"] += len(promote)
+                self._append(records)
+        return vectors, missing
+
+    def _disk_get(self, key):
+        for segment in (self._current, self._previous):
+            row = segment.rows.get(key)
+            if row is not None:
+                return np.array(segment.map["vec"][row])
+        return None
+
+    def put_many(self, texts, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        records = np.zeros(len(texts), dtype=self.record)
+        fresh = set()
+        with self._lock:
+            for text, vec in zip(texts, vectors):
+                key = text_key(text)
+                self._remember(key, vec.copy())
+                if key in self._current.rows or key in fresh:
+                    continue
+                records[len(fresh)] = (key, vec)
+                fresh.add(key)
+            if not fresh:
+                return
+            self._append(records[:len(fresh)])
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+            s["memory_items"] = len(self._memory)
+            s["max_items"] = self.max_items
+            s["disk_items"] = self._current.mapped_rows + self._previous.mapped_rows
+            s["disk_bytes"] = s["disk_items"] * self.record.itemsize
+            s["max_disk_bytes"] = self.max_disk_bytes
+        s["hit_rate"] = round((s["memory_hits"] + s["disk_hits"]) / s["lookups"], 4) if s["lookups"] else 0.0
+        return s
@@ -0,0 +1,211 @@
+# featureEngine.py
+# Heading-classifier features, computed column-wise with NumPy. Numerically equivalent
+# to the old per-row extract_features + pandas/MinMaxScaler preprocess_features.
+import re
+
+import numpy as np
+import pandas as pd
+
+HEADING_FEATURES = [
+    'Font Ratio', 'Font Size Rank', 'Text Length', 'Capitalization Ratio',
+    'Position Y', 'Is Bold', 'Is Italic',
+    'Starts with Numbering', 'Font Size Count', 'Is Unique Font Size'
+]
+
+NUMBERING_RE = re.compile(r'^\d+(\.\d+)*(\.|\))\s')
+DOT_PREFIX_RE = re.compile(r'^(\d+\.)+(\d+)')
+
+# grouped-row column order (as produced by the old extract_features)
+ROW_COLUMNS = [
+    'PDF Path', 'Page Number', 'Section Text', 'Font Size', 'Is Bold', 'Is Italic',
+    'Text Length', 'Capitalization Ratio', 'Starts with Numbering', 'Position Y',
+    'Prefix Dot Count', 'Y Gap', 'Start Line', 'End Line'
+]
+
+
+def _char_counts(texts):
+    """Per-text counts of upper-case and alphabetic characters (str.isupper / str.isalpha)."""
+    lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+    codepoints = np.frombuffer("".join(texts).encode('utf-32-le'), dtype=np.uint32)
+    # classify each distinct code point once, then gather
+    uniq, inverse = np.unique(codepoints, return_inverse=True)
+    chars = [chr(c) for c in uniq.tolist()]
+    upper = np.fromiter((c.isupper() for c in chars), dtype=bool, count=len(chars))[inverse]
+    alpha = np.fromiter((c.isalpha() for c in chars), dtype=bool, count=len(chars))[inverse]
+
+    bounds = np.concatenate(([0], np.cumsum(lengths)))
+    upper_cum = np.concatenate(([0], np.cumsum(upper, dtype=np.int64)))
+    alpha_cum = np.concatenate(([0], np.cumsum(alpha, dtype=np.int64)))
+    upper_count = upper_cum[bounds[1:]] - upper_cum[bounds[:-1]]
+    alpha_count = alpha_cum[bounds[1:]] - alpha_cum[bounds[:-1]]
+    return lengths, upper_count, alpha_count
+
+
+def rows_to_frame(grouped_rows):
+    """
+    Build the classifier DataFrame from raw grouped rows (text, style, position, line range)
+    and add the text-derived columns for all rows at once.
+    """
+    df = pd.DataFrame(grouped_rows)
+    if df.empty:
+        return df
+
+    texts = df['Section Text'].tolist()
+    lengths, caps, numbering = _text_columns(texts)
+    dot_matches = [DOT_PREFIX_RE.match(t) for t in texts]
+
+    df['Text Length'] = lengths
+    df['Capitalization Ratio'] = caps
+    df['Starts with Numbering'] = numbering
+    df['Prefix Dot Count'] = [m.group(1).count('.') if m else 0 for m in dot_matches]
+    return df[[c for c in ROW_COLUMNS if c in df.columns]]
+
+
+def _text_columns(texts):
+    """Text Length, Capitalization Ratio and Starts with Numbering of each text."""
+    lengths, upper_count, alpha_count = _char_counts(texts)
+    safe_alpha = np.where(alpha_count > 0, alpha_count, 1)
+    caps = np.where(alpha_count > 0, upper_count / safe_alpha, 0)
+    numbering = [NUMBERING_RE.match(t) is not None for t in texts]
+    return lengths, caps, numbering
+
+
+def _minmax(x, lo, hi):
+    """MinMaxScaler(feature_range=(0, 1)).fit_transform, same arithmetic order as sklearn."""
+    data_range = hi - lo
+    # sklearn's _handle_zeros_in_scale: near-constant columns get scale 1
+    data_range = np.where(data_range < 10 * np.finfo(np.float64).eps, 1.0, data_range)
+    scale = 1.0 / data_range
+    return x * scale + (0.0 - lo * scale)
+
+
+def _minmax_columns(x):
+    return _minmax(x, x.min(axis=0), x.max(axis=0))
+
+
+def _minmax_per_group(x, group, n_groups):
+    """
+    Per-PDF min-max of one column; groups with a single row or no spread get 0
+    (the old scale_column_per_pdf rule).
+    """
+    lo = np.full(n_groups, np.inf)
+    hi = np.full(n_groups, -np.inf)
+    np.minimum.at(lo, group, x)
+    np.maximum.at(hi, group, x)
+    sizes = np.bincount(group, minlength=n_groups)
+    scaled = _minmax(x, lo[group], hi[group])
+    spread = (sizes > 1) & (hi > lo)
+    return np.where(spread[group], scaled, 0.0)
+
+
+def preprocess_features(df):
+    if df.empty:
+        return df
+
+    df['Is Bold'] = df['Is Bold'].astype(int)
+    df['Is Italic'] = df['Is Italic'].astype(int)
+    df['Starts with Numbering'] = df['Starts with Numbering'].astype(int)
+
+    font_size = df['Font Size'].to_numpy(dtype=np.float64)
+    sizes, size_idx, size_counts = np.unique(font_size, return_inverse=True, return_counts=True)
+    # rank 1 = largest font size
+    df['Font Size Rank'] = len(sizes) - size_idx
+
+    columns = np.column_stack([
+        font_size,
+        df['Text Length'].to_numpy(dtype=np.float64),
+        df['Capitalization Ratio'].to_numpy(dtype=np.float64),
+        df['Position Y'].to_numpy(dtype=np.float64),
+    ])
+    scaled = _minmax_columns(columns)
+    df['Font Size Normalised'] = scaled[:, 0]
+    df['Text Length'] = scaled[:, 1]
+    df['Capitalization Ratio'] = scaled[:, 2]
+    df['Position Y'] = scaled[:, 3]
+
+    # body font size = most frequent size (smallest on ties, like Series.mode()[0])
+    df['Font Ratio'] = font_size / sizes[np.argmax(size_counts)]
+
+    font_size_count = size_counts[size_idx]
+    df['Is Unique Font Size'] = (font_size_count == 1).astype(int)
+
+    y_gap = pd.to_numeric(df['Y Gap'], errors='coerce').to_numpy(dtype=np.float64)
+    y_gap = np.where(np.isnan(y_gap), 2.0, y_gap)
+    df['Y Gap'] = y_gap
+
+    _, pdf_idx = np.unique(df['PDF Path'].to_numpy(dtype=str), return_inverse=True)
+    n_pdfs = int(pdf_idx.max()) + 1
+    df['Y Gap Scaled'] = _minmax_per_group(y_gap, pdf_idx, n_pdfs)
+    df['Font Size Count'] = _minmax_per_group(font_size_count.astype(np.float64), pdf_idx, n_pdfs)
+    return df
+
+
+class RunningFeatures:
+    """
+    HEADING_FEATURES for one PDF whose rows arrive page by page (streaming upload).
+    - add(rows) returns the new rows' features normalised against every row seen so far:
+      exactly what preprocess_features over the whole prefix would give those rows.
+    - Only the font-size histogram and the min/max of the scaled columns are kept, so a
+      page costs O(its rows + distinct font sizes), not O(rows so far). Works on the row
+      dicts directly: a DataFrame per page would cost more than the features.
+    """
+
+    def __init__(self):
+        self._sizes = np.zeros(0, dtype=np.float64)   # distinct font sizes, ascending
+        self._counts = np.zeros(0, dtype=np.int64)    # rows per font size
+        self._lo = np.full(4, np.inf)                 # font size, length, caps, position y
+        self._hi = np.full(4, -np.inf)
+        self.rows = 0
+
+    def add(self, grouped_rows):
+        """float32 (len(grouped_rows), len(HEADING_FEATURES)) feature matrix of the new rows."""
+        if not grouped_rows:
+            return np.zeros((0, len(HEADING_FEATURES)), dtype=np.float32)
+
+        lengths, caps, numbering = _text_columns([row['Section Text'] for row in grouped_rows])
+        font_size = np.array([row['Font Size'] for row in grouped_rows], dtype=np.float64)
+        new_sizes, new_counts = np.unique(font_size, return_counts=True)
+        sizes, merged = np.unique(np.concatenate([self._sizes, new_sizes]), return_inverse=True)
+        self._counts = np.bincount(merged, weights=np.concatenate([self._counts, new_counts]),
+                                   minlength=len(sizes)).astype(np.int64)
+        self._sizes = sizes
+        self.rows += len(grouped_rows)
+
+        columns = np.column_stack([
+            font_size,
+            lengths.astype(np.float64),
+            caps.astype(np.float64),
+            np.array([row['Position Y'] for row in grouped_rows], dtype=np.float64),
+        ])
+        self._lo = np.minimum(self._lo, columns.min(axis=0))
+        self._hi = np.maximum(self._hi, columns.max(axis=0))
+        scaled = _minmax(columns, self._lo, self._hi)
+
+        size_idx = np.searchsorted(self._sizes, font_size)
+        font_size_count = self._counts[size_idx]
+        # one PDF: the per-PDF min-max of the font-size counts runs over the histogram
+        count_lo, count_hi = self._counts.min(), self._counts.max()
+        if self.rows > 1 and count_hi > count_lo:
+            count_scaled = _minmax(font_size_count.astype(np.float64), float(count_lo), float(count_hi))
+        else:
+            count_scaled = np.zeros(len(grouped_rows))
+
+        features = {
+            'Font Ratio': font_size / self._sizes[np.argmax(self._counts)],
+            'Font Size Rank': len(self._sizes) - size_idx,
+            'Text Length': scaled[:, 1],
+            'Capitalization Ratio': scaled[:, 2],
+            'Position Y': scaled[:, 3],
+            'Is Bold': [row['Is Bold'] for row in grouped_rows],
+            'Is Italic': [row['Is Italic'] for row in grouped_rows],
+            'Starts with Numbering': numbering,
+            'Font Size Count': count_scaled,
+            'Is Unique Font Size': font_size_count == 1,
+        }
+        X = np.column_stack([np.asarray(features[name], dtype=np.float64) for name in HEADING_FEATURES])
+        return np.ascontiguousarray(X, dtype=np.float32)
+
+
+def heading_feature_matrix(df):
+    """Contiguous float32 (n_rows, len(HEADING_FEATURES)) matrix for the classifier."""
+    return np.ascontiguousarray(df[HEADING_FEATURES].to_numpy(dtype=np.float32))
@@ -0,0 +1,442 @@
+# forestInference.py
+# NumPy-only inference for the heading classifier pickle. A fitted sklearn tree ensemble is
+# converted into a few NumPy arrays and cached next to the pickle, so later startups load
+# the .npz without joblib/sklearn and predict is a handful of vectorised table lookups.
+import logging
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+from ingestCache import file_sha256
+
+logger = logging.getLogger(__name__)
+
+# bump when the .npz layout or the conversion changes
+COMPILED_FORMAT_VERSION = 1
+PARITY_SAMPLE_ROWS = 5000
+# rows evaluated together; keeps the (rows, trees, words) leaf masks cache-sized
+PREDICT_BLOCK_ROWS = 256
+# forests whose lookup tables would exceed this stay on sklearn
+MAX_TABLE_BYTES = 256 * 1024 * 1024
+# batches above this many rows go to sklearn, whose per-row cost is lower; the compiled
+# forest wins on the small batches of a single upload (crossover ~1500 rows on one CPU)
+SKLEARN_ABOVE_ROWS = 1500
+
+_ALL_ONES = np.uint64(0xFFFFFFFFFFFFFFFF)
+# ones below bit k, for k = 0..64
+_LOW_BITS = np.array([(1 << k) - 1 for k in range(65)], dtype=np.uint64)
+# de Bruijn multiply-and-shift maps an isolated bit to its position
+_DEBRUIJN = np.uint64(0x03F79D71B4CB0A89)
+_DEBRUIJN_POSITION = np.zeros(64, dtype=np.intp)
+for _bit in range(64):
+    _DEBRUIJN_POSITION[((1 << _bit) * 0x03F79D71B4CB0A89 & 0xFFFFFFFFFFFFFFFF) >> 58] = _bit
+
+
+def _float32_floor(threshold):
+    """
+    Largest float32 not above each float64 threshold. Inputs are float32, so
+    "x <= t" (compared in float64, as sklearn does) is the same as "x <= t32".
+    """
+    t32 = threshold.astype(np.float32)
+    too_high = t32.astype(np.float64) > threshold
+    t32[too_high] = np.nextafter(t32[too_high], np.float32(-np.inf))
+    return t32
+
+
+def _leaf_ranges(left, right):
+    """In-order leaf numbering of one tree: each node's leaves are [lo[n], hi[n])."""
+    lo = np.zeros(len(left), dtype=np.int64)
+    hi = np.zeros(len(left), dtype=np.int64)
+    leaves = []
+    stack = [(0, False)]
+    while stack:
+        node, done = stack.pop()
+        if done:
+            hi[node] = len(leaves)
+        elif left[node] == -1:
+            lo[node] = len(leaves)
+            leaves.append(node)
+            hi[node] = len(leaves)
+        else:
+            lo[node] = len(leaves)
+            stack.extend(((node, True), (right[node], False), (left[node], False)))
+    return lo, hi, np.asarray(leaves)
+
+
+class CompiledForest:
+    """
+    Tree ensemble evaluated QuickScorer-style. Every tree's leaves are numbered left to
+    right and tracked as a bitmask; a split that sends x right rules out the leaves of its
+    left subtree, and the exit leaf is the lowest bit still set. The splits a row fails on
+    feature f are exactly those with threshold < x[f], a prefix of f's sorted thresholds,
+    so per feature we precompute the running AND of those masks and a row costs one
+    searchsorted + one table row per feature.
+    """
+
+    def __init__(self, node_tree, node_feature, node_threshold, node_mask, leaf_proba, n_features, classes):
+        self.node_tree = node_tree
+        self.node_feature = node_feature
+        self.node_threshold = node_threshold
+        self.node_mask = node_mask
+        self.leaf_proba = leaf_proba
+        self.n_features = int(n_features)
+        self.classes_ = classes
+        self.n_trees, self.max_leaves, _ = leaf_proba.shape
+        self._flat_proba = leaf_proba.reshape(-1, leaf_proba.shape[2])
+        self._tree_offsets = np.arange(self.n_trees, dtype=np.intp) * self.max_leaves
+        self._build_tables()
+
+    def _build_tables(self):
+        t32 = _float32_floor(self.node_threshold)
+        n_words = self.node_mask.shape[1]
+        self._features, self._thresholds, self._tables = [], [], []
+        for f in range(self.n_features):
+            nodes = np.flatnonzero(self.node_feature == f)
+            if not len(nodes):
+                continue
+            nodes = nodes[np.argsort(t32[nodes], kind='stable')]
+            # row j = AND of the masks of the j smallest-threshold splits, per tree
+            table = np.full((len(nodes) + 1, self.n_trees, n_words), _ALL_ONES, dtype=np.uint64)
+            table[np.arange(1, len(nodes) + 1), self.node_tree[nodes]] = self.node_mask[nodes]
+            np.bitwise_and.accumulate(table, axis=0, out=table)
+            self._features.append(f)
+            self._thresholds.append(t32[nodes])
+            self._tables.append(table)
+
+    @staticmethod
+    def table_bytes(n_splits, n_features, n_trees, max_leaves):
+        return (n_splits + n_features) * n_trees * ((max_leaves + 63) // 64) * 8
+
+    @classmethod
+    def from_estimator(cls, estimator):
+        """Convert a fitted RandomForest/ExtraTrees/DecisionTree classifier; None if unsupported."""
+        trees = getattr(estimator, 'estimators_', None)
+        if trees is None and hasattr(estimator, 'tree_'):
+            trees = [estimator]
+        if not trees or getattr(estimator, 'n_outputs_', 1) != 1:
+            return None
+        if not all(hasattr(t, 'tree_') for t in trees):
+            return None
+
+        n_features = estimator.n_features_in_
+        max_leaves = max(t.tree_.n_leaves for t in trees)
+        n_splits = sum(t.tree_.node_count - t.tree_.n_leaves for t in trees)
+        if cls.table_bytes(n_splits, n_features, len(trees), max_leaves) > MAX_TABLE_BYTES:
+            logger.info(f"Forest too large to compile ({n_splits} splits, {max_leaves} leaves per tree)")
+            return None
+        n_words = (max_leaves + 63) // 64
+        word_starts = np.arange(n_words) * 64
+
+        node_tree, node_feature, node_threshold, node_mask = [], [], [], []
+        leaf_proba = np.zeros((len(trees), max_leaves, len(estimator.classes_)), dtype=np.float64)
+        for i, t in enumerate(trees):
+            tree = t.tree_
+            lo, hi, leaves = _leaf_ranges(tree.children_left, tree.children_right)
+            split = np.flatnonzero(tree.children_left != -1)
+            # zero the bits of each split's left subtree
+            left = tree.children_left[split]
+            start = np.clip(lo[left][:, None] - word_starts, 0, 64)
+            stop = np.clip(hi[left][:, None] - word_starts, 0, 64)
+            node_mask.append(~(_LOW_BITS[stop] ^ _LOW_BITS[start]))
+            node_tree.append(np.full(len(split), i, dtype=np.intp))
+            node_feature.append(tree.feature[split])
+            node_threshold.append(tree.threshold[split].astype(np.float64))
+
+            value = tree.value[leaves, 0, :].astype(np.float64)
+            totals = value.sum(axis=1, keepdims=True)
+            totals[totals == 0] = 1.0
+            leaf_proba[i, :len(leaves)] = value / totals
+
+        return cls(
+            np.concatenate(node_tree),
+            np.concatenate(node_feature),
+            np.concatenate(node_threshold),
+            np.concatenate(node_mask),
+            leaf_proba,
+            n_features,
+            np.asarray(estimator.classes_),
+        )
+
+    def split_thresholds(self, f):
+        return self.node_threshold[self.node_feature == f]
+
+    def _exit_leaves(self, X):
+        masks = None
+        for f, thresholds, table in zip(self._features, self._thresholds, self._tables):
+            rows = table[np.searchsorted(thresholds, X[:, f], side='left')]
+            if masks is None:
+                masks = rows
+            else:
+                np.bitwise_and(masks, rows, out=masks)
+        if masks is None:
+            # no splits at all: every tree is a single leaf
+            return np.zeros((len(X), self.n_trees), dtype=np.intp)
+
+        leaves = None
+        for w in reversed(range(masks.shape[2])):
+            word = masks[..., w]
+            lowest = word & (~word + np.uint64(1))
+            position = _DEBRUIJN_POSITION[(lowest * _DEBRUIJN) >> np.uint64(58)] + 64 * w
+            leaves = position if leaves is None else np.where(word != 0, position, leaves)
+        return leaves
+
+    def apply(self, X):
+        """Exit leaf (in-order index within its tree) per (row, tree): an (n_rows, n_trees) array."""
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        leaves = np.empty((len(X), self.n_trees), dtype=np.intp)
+        for start in range(0, len(X), PREDICT_BLOCK_ROWS):
+            stop = start + PREDICT_BLOCK_ROWS
+            leaves[start:stop] = self._exit_leaves(X[start:stop])
+        return leaves
+
+    def predict_proba(self, X):
+        leaves = self.apply(X) + self._tree_offsets
+        # accumulate tree by tree, like RandomForestClassifier.predict_proba
+        proba = np.zeros((len(leaves), self._flat_proba.shape[1]), dtype=np.float64)
+        for t in range(self.n_trees):
+            proba += self._flat_proba[leaves[:, t]]
+        return proba / self.n_trees
+
+    def predict(self, X):
+        if len(X) == 0:
+            return self.classes_[:0]
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+    def save(self, path, source_sha):
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(
+            tmp_path,
+            format_version=np.int64(COMPILED_FORMAT_VERSION),
+            source_sha=np.str_(source_sha),
+            node_tree=self.node_tree.astype(np.int32),
+            node_feature=self.node_feature.astype(np.int32),
+            node_threshold=self.node_threshold,
+            node_mask=self.node_mask,
+            leaf_proba=self.leaf_proba,
+            n_features=np.int64(self.n_features),
+            classes=self.classes_.astype(str),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, source_sha):
+        """The cached forest at path, or None when it is stale or unreadable."""
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if int(data['format_version']) != COMPILED_FORMAT_VERSION or str(data['source_sha']) != source_sha:
+                    return None
+                return cls(
+                    data['node_tree'].astype(np.intp), data['node_feature'].astype(np.intp),
+                    data['node_threshold'], data['node_mask'], data['leaf_proba'],
+                    int(data['n_features']), data['classes'],
+                )
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable compiled classifier {path}: {e}")
+            return None
+
+
+def parity_sample(compiled, n_rows=PARITY_SAMPLE_ROWS, seed=0):
+    """
+    Synthetic rows that exercise the split points: per feature, a mix of exact
+    thresholds, values just around them and uniform draws across their range.
+    """
+    rng = np.random.default_rng(seed)
+    X = np.empty((n_rows, compiled.n_features), dtype=np.float32)
+    for f in range(compiled.n_features):
+        th = compiled.split_thresholds(f)
+        if not len(th):
+            X[:, f] = rng.uniform(0, 1, n_rows)
+            continue
+        lo, hi = th.min(), th.max()
+        span = max(hi - lo, 1.0)
+        picks = rng.choice(th, n_rows)
+        jitter = rng.choice([-1e-6, 0.0, 1e-6], n_rows) * span
+        uniform = rng.uniform(lo - 0.1 * span, hi + 0.1 * span, n_rows)
+        X[:, f] = np.where(rng.random(n_rows) < 0.5, picks + jitter, uniform)
+    return X
+
+
+def check_parity(estimator, compiled, X):
+    """Number of rows where the compiled forest and sklearn disagree on the label."""
+    import warnings
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", message="X does not have valid feature names")
+        expected = estimator.predict(X)
+    return int(np.sum(compiled.predict(X) != expected))
+
+
+def compiled_path_for(pickle_path):
+    return f"{pickle_path}.compiled.npz"
+
+
+def parity_fixture_path_for(pickle_path):
+    return f"{pickle_path}.parity.npz"
+
+
+def write_parity_fixture(estimator, X, path, source_sha):
+    """Commit X (float32 feature rows) and sklearn's labels for them as the parity fixture."""
+    import warnings
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", message="X does not have valid feature names")
+        labels = np.asarray(estimator.predict(X)).astype(str)
+    np.savez_compressed(path, source_sha=np.str_(source_sha), X=np.asarray(X, dtype=np.float32), labels=labels)
+    return len(labels)
+
+
+def check_parity_fixture(classifier, path, source_sha):
+    """
+    Rows of the fixture at path whose label classifier.predict gets wrong; None when
+    there is no fixture or it was written for another pickle.
+    """
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            if str(data['source_sha']) != source_sha:
+                logger.warning(f"Parity fixture {path} is for another classifier pickle; not checked")
+                return None
+            X, labels = data['X'], data['labels']
+    except FileNotFoundError:
+        return None
+    return int(np.sum(np.asarray(classifier.predict(X)).astype(str) != labels))
+
+
+class HybridForest:
+    """
+    CompiledForest for batches of up to sklearn_above_rows rows, the sklearn estimator
+    for larger ones.
+    - The estimator is unpickled on the first large batch unless load_classifier already
+      had it, so startups from the .npz cache still skip joblib/sklearn until needed.
+    - If it cannot be loaded, every batch stays on the compiled forest.
+    """
+
+    def __init__(self, compiled, pickle_path, sklearn_above_rows=SKLEARN_ABOVE_ROWS, estimator=None):
+        self.compiled = compiled
+        self.pickle_path = pickle_path
+        self.sklearn_above_rows = int(sklearn_above_rows)
+        self.classes_ = compiled.classes_
+        self._estimator = estimator
+        self._lock = threading.Lock()
+
+    def _sklearn(self):
+        with self._lock:
+            if self._estimator is None and self.sklearn_above_rows:
+                try:
+                    import joblib
+                    self._estimator = joblib.load(self.pickle_path)
+                    logger.info(f"Loaded sklearn classifier for batches above {self.sklearn_above_rows} rows")
+                except Exception as e:
+                    logger.warning(f"Could not load {self.pickle_path} with joblib; compiled forest for every batch: {e}")
+                    self.sklearn_above_rows = 0
+            return self._estimator
+
+    def predict(self, X):
+        if self.sklearn_above_rows and len(X) > self.sklearn_above_rows:
+            estimator = self._sklearn()
+            if estimator is not None:
+                return estimator.predict(X)
+        return self.compiled.predict(X)
+
+
+def load_classifier(pickle_path, sklearn_above_rows=SKLEARN_ABOVE_ROWS):
+    """
+    Classifier with .predict(X) / .classes_ for a float32 feature matrix.
+    Uses the cached CompiledForest when it matches the pickle's hash; otherwise unpickles
+    with joblib, converts, checks parity against sklearn and caches the result. Either
+    way the forest must then reproduce the committed parity fixture (<pickle>.parity.npz).
+    Falls back to the sklearn estimator for unsupported models or a failed parity check.
+    With sklearn_above_rows (0 = never) the result is a HybridForest.
+    """
+    source_sha = file_sha256(pickle_path)
+    cache_path = compiled_path_for(pickle_path)
+    estimator = None
+    compiled = CompiledForest.load(cache_path, source_sha)
+    if compiled is not None:
+        logger.info(f"Loaded compiled classifier from {cache_path}")
+    else:
+        import joblib
+        estimator = joblib.load(pickle_path)
+        compiled = CompiledForest.from_estimator(estimator)
+        if compiled is None:
+            logger.info(f"{type(estimator).__name__} is not a supported tree ensemble; using sklearn predict")
+            return estimator
+
+        mismatches = check_parity(estimator, compiled, parity_sample(compiled))
+        if mismatches:
+            logger.error(f"Compiled classifier disagrees with sklearn on {mismatches} rows; using sklearn predict")
+            return estimator
+
+        try:
+            compiled.save(cache_path, source_sha)
+            logger.info(f"Compiled classifier cached at {cache_path}")
+        except Exception as e:
+            logger.warning(f"Could not cache compiled classifier at {cache_path}: {e}")
+
+    fixture_path = parity_fixture_path_for(pickle_path)
+    mismatches = check_parity_fixture(compiled, fixture_path, source_sha)
+    if mismatches:
+        logger.error(f"Compiled classifier gets {mismatches} rows of {fixture_path} wrong; using sklearn predict")
+        if estimator is None:
+            import joblib
+            estimator = joblib.load(pickle_path)
+        return estimator
+    if sklearn_above_rows:
+        return HybridForest(compiled, pickle_path, sklearn_above_rows, estimator)
+    return compiled
+
+
+if __name__ == '__main__':
+    # parity + timing report: python forestInference.py [model.pkl] [rows]
+    # after retraining, rewrite the committed fixture from sample documents:
+    #   python forestInference.py model.pkl --write-fixture a.pdf b.pdf ...
+    import argparse
+    import joblib
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", nargs="?", default="heading_classifier_with_font_count_norm_textNorm_5.pkl")
+    parser.add_argument("rows", nargs="?", type=int, default=10000)
+    parser.add_argument("--write-fixture", nargs="+", metavar="PDF",
+                        help="documents whose classifier rows (plus split-point rows) make up the fixture")
+    args = parser.parse_args()
+    path, rows = args.path, args.rows
+    estimator = joblib.load(path)
+    compiled = CompiledForest.from_estimator(estimator)
+    if compiled is None:
+        print(f"{type(estimator).__name__} is not supported")
+        sys.exit(1)
+    source_sha = file_sha256(path)
+    fixture_path = parity_fixture_path_for(path)
+    if args.write_fixture:
+        from featureEngine import heading_feature_matrix, preprocess_features
+        from pdfParser import analyze_pdf_sections
+        frames = [heading_feature_matrix(preprocess_features(analyze_pdf_sections(pdf, parallel=False)[0]))
+                  for pdf in args.write_fixture]
+        n = write_parity_fixture(estimator, np.concatenate(frames + [parity_sample(compiled, 1000, seed=2)]),
+                                 fixture_path, source_sha)
+        print(f"wrote {n} rows to {fixture_path}")
+    X = parity_sample(compiled, rows, seed=1)
+    print(f"parity mismatches on {rows} rows: {check_parity(estimator, compiled, X)}")
+    print(f"parity fixture mismatches: {check_parity_fixture(compiled, fixture_path, source_sha)}")
+
+    def best_of(fn, data, repeat=5):
+        fn(data[:100])  # warm up
+        times = []
+        for _ in range(repeat):
+            t = time.perf_counter()
+            fn(data)
+            times.append(time.perf_counter() - t)
+        return min(times)
+
+    for name, fn in [("sklearn", estimator.predict), ("compiled", compiled.predict)]:
+        dt = best_of(fn, X)
+        small = best_of(fn, X[:100], repeat=20)
+        print(f"{name:>8}: {dt * 1000:.1f} ms for {rows} rows ({dt * 1e5 / rows:.3f} ms per 100 rows), "
+              f"{small * 1000:.2f} ms for a single 100-row call")
+    # where the compiled forest stops winning (SKLEARN_ABOVE_ROWS)
+    for n in (250, 500, 1000, 1500, 2000, 3000, 5000):
+        if n <= rows:
+            ratio = best_of(compiled.predict, X[:n], repeat=10) / best_of(estimator.predict, X[:n], repeat=10)
+            print(f"{n:>6} rows: compiled / sklearn time {ratio:.2f}")
@@ -0,0 +1,137 @@
+# inferenceBroker.py
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class _Pending:
+    __slots__ = ("texts", "future", "queued_at")
+
+    def __init__(self, texts):
+        self.texts = texts
+        self.future = Future()
+        self.queued_at = time.perf_counter()
+
+
+class InferenceBroker:
+    """
+    Cross-request micro-batcher for the embedder.
+    - submit(texts) queues the texts and returns a concurrent.futures.Future that resolves
+      to their (len(texts), dim) embeddings; encode(texts) waits for it.
+    - One daemon worker takes the oldest request, keeps collecting until max_batch texts
+      are waiting or max_wait_ms has passed since it arrived, runs encode() once on
+      everything collected and hands each request its own rows. A request larger than
+      max_batch goes out on its own.
+    - If encode() raises, every request in that batch gets the exception.
+    - stats() reports queue depth, batch sizes and why batches were flushed.
+    """
+
+    def __init__(self, encode, max_batch=32, max_wait_ms=5.0):
+        self.encode_batch = encode
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stats = {
+            "requests": 0,
+            "texts": 0,
+            "batches": 0,
+            "flushed_full": 0,
+            "flushed_window": 0,
+            "failed_batches": 0,
+            "max_batch_texts": 0,
+            "max_batch_requests": 0,
+            "max_queue_depth": 0,
+            "queue_wait_seconds": 0.0,
+            "encode_seconds": 0.0,
+        }
+
+    def _ensure_worker(self):
+        # started lazily so importing the app spawns nothing
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker_loop, name="inference-broker", daemon=True)
+                self._thread.start()
+                logger.info(f"Started inference broker (max_batch={self.max_batch}, "
+                            f"window={self.max_wait * 1000:.1f}ms)")
+
+    def submit(self, texts):
+        self._ensure_worker()
+        item = _Pending(list(texts))
+        self._queue.put(item)
+        with self._lock:
+            self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], self._queue.qsize())
+        return item.future
+
+    def encode(self, texts):
+        return self.submit(texts).result()
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+        batches = s["batches"]
+        s["queue_depth"] = self._queue.qsize()
+        s["max_batch"] = self.max_batch
+        s["max_wait_ms"] = self.max_wait * 1000
+        s["mean_batch_texts"] = round(s["texts"] / batches, 2) if batches else 0.0
+        s["mean_batch_requests"] = round(s["requests"] / batches, 2) if batches else 0.0
+        s["mean_queue_wait_ms"] = round(s["queue_wait_seconds"] * 1000 / s["requests"], 3) if s["requests"] else 0.0
+        s["queue_wait_seconds"] = round(s["queue_wait_seconds"], 4)
+        s["encode_seconds"] = round(s["encode_seconds"], 4)
+        return s
+
+    def _collect(self):
+        first = self._queue.get()
+        batch = [first]
+        count = len(first.texts)
+        deadline = first.queued_at + self.max_wait
+        while count < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+            count += len(item.texts)
+        return batch, count >= self.max_batch
+
+    def _worker_loop(self):
+        while True:
+            batch, full = self._collect()
+            batch = [item for item in batch if item.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            texts = [t for item in batch for t in item.texts]
+            started = time.perf_counter()
+            try:
+                vectors = self.encode_batch(texts)
+            except Exception as e:
+                logger.exception(f"Inference batch of {len(texts)} texts failed")
+                for item in batch:
+                    item.future.set_exception(e)
+                with self._lock:
+                    self._stats["failed_batches"] += 1
+                continue
+            finished = time.perf_counter()
+
+            offset = 0
+            for item in batch:
+                n = len(item.texts)
+                item.future.set_result(vectors[offset:offset + n])
+                offset += n
+
+            with self._lock:
+                s = self._stats
+                s["requests"] += len(batch)
+                s["texts"] += len(texts)
+                s["batches"] += 1
+                s["flushed_full" if full else "flushed_window"] += 1
+                s["max_batch_texts"] = max(s["max_batch_texts"], len(texts))
+                s["max_batch_requests"] = max(s["max_batch_requests"], len(batch))
+                s["queue_wait_seconds"] += sum(started - item.queued_at for item in batch)
+                s["encode_seconds"] += finished - started
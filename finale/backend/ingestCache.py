@@ -0,0 +1,105 @@
+# ingestCache.py
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """SHA-256 hex digest of a file's bytes, read in chunks."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def make_version_tag(*parts):
+    """Short stable tag derived from everything that changes the /upload output."""
+    joined = "|".join(str(p) for p in parts)
+    return hashlib.sha256(joined.encode('utf-8')).hexdigest()[:16]
+
+
+class IngestCache:
+    """
+    Content-addressed sidecar store for /upload results.
+    - Entries live in <root>/<version_tag>/<sha[:2]>/<sha>.json, keyed by the SHA-256
+      of the PDF bytes, so the same file uploaded under a new name is a hit.
+    - The version tag covers the parser version and the classifier pickle; when either
+      changes, a new tag directory is used. Other tag directories are removed only once
+      unused for prune_after_seconds (None: never), so the two sides of a rolling deploy,
+      or two versions sharing the directory, do not wipe each other's entries.
+    """
+
+    def __init__(self, root, version_tag, prune_after_seconds=None):
+        self.root = root
+        self.version_tag = version_tag
+        self.dir = os.path.join(root, version_tag)
+        os.makedirs(self.dir, exist_ok=True)
+        # marks this version as in use for the other versions' pruning
+        os.utime(self.dir)
+        if prune_after_seconds is not None:
+            self._prune_stale_versions(prune_after_seconds)
+
+    @staticmethod
+    def _last_used(path):
+        """Newest mtime of a tag directory and its shard directories (each put renames into one)."""
+        newest = os.path.getmtime(path)
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    newest = max(newest, entry.stat(follow_symlinks=False).st_mtime)
+        return newest
+
+    def _prune_stale_versions(self, prune_after_seconds):
+        cutoff = time.time() - prune_after_seconds
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name == self.version_tag or not os.path.isdir(path):
+                continue
+            try:
+                if self._last_used(path) >= cutoff:
+                    continue
+            except OSError:
+                continue   # removed by another instance meanwhile
+            logger.info(f"Removing stale ingest cache version: {name}")
+            shutil.rmtree(path, ignore_errors=True)
+
+    def _entry_path(self, sha):
+        return os.path.join(self.dir, sha[:2], f"{sha}.json")
+
+    def get(self, sha):
+        path = self._entry_path(sha)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Dropping unreadable ingest cache entry {path}: {e}")
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+    def put(self, sha, payload):
+        path = self._entry_path(sha)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(payload, f)
+            # atomic swap so concurrent readers never see a partial entry
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"Failed to write ingest cache entry {path}: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
@@ -0,0 +1,125 @@
+# ingestJobs.py
+import logging
+import queue
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class IngestJobQueue:
+    """
+    Bounded background queue for /upload?async=1.
+    - submit() enqueues a job and returns its id at once; it raises queue.Full when
+      max_depth jobs are already waiting (the route turns that into a 429).
+    - `workers` daemon threads run handler(job_id, *args) and store its return value
+      as the job result; a ValueError is recorded as a client-facing error message.
+    - Finished jobs are kept for retention_seconds so clients can collect the payload.
+    """
+
+    def __init__(self, handler, workers=2, max_depth=16, retention_seconds=3600):
+        self.handler = handler
+        self.workers = max(1, int(workers))
+        self.max_depth = max(1, int(max_depth))
+        self.retention_seconds = retention_seconds
+        self._queue = queue.Queue(maxsize=self.max_depth)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def _ensure_workers(self):
+        # started lazily so importing the app (e.g. under a WSGI server) spawns nothing
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker_loop, name=f"ingest-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+            logger.info(f"Started {self.workers} ingest job workers (queue depth {self.max_depth})")
+
+    def _prune(self):
+        cutoff = time.time() - self.retention_seconds
+        with self._lock:
+            expired = [jid for jid, job in self._jobs.items()
+                       if job['finished_at'] is not None and job['finished_at'] < cutoff]
+            for jid in expired:
+                del self._jobs[jid]
+
+    def submit(self, *args):
+        self._ensure_workers()
+        self._prune()
+        job_id = uuid.uuid4().hex
+        job = {
+            "id": job_id,
+            "state": "queued",
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "progress": {"stage": "queued"},
+            "result": None,
+            "error": None,
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+        try:
+            self._queue.put_nowait((job_id, args))
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job_id]
+            raise
+        return job_id
+
+    def full(self):
+        return self._queue.full()
+
+    def update_progress(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job['progress'].update(fields)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            snapshot = dict(job)
+            snapshot['progress'] = dict(job['progress'])
+        return snapshot
+
+    def stats(self):
+        with self._lock:
+            states = {}
+            for job in self._jobs.values():
+                states[job['state']] = states.get(job['state'], 0) + 1
+        return {
+            "queued": self._queue.qsize(),
+            "max_depth": self.max_depth,
+            "workers": self.workers,
+            "jobs": states,
+        }
+
+    def _set(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(fields)
+
+    def _worker_loop(self):
+        while True:
+            job_id, args = self._queue.get()
+            self._set(job_id, state="running", started_at=time.time())
+            self.update_progress(job_id, stage="running")
+            try:
+                result = self.handler(job_id, *args)
+                self._set(job_id, state="done", result=result, finished_at=time.time())
+                self.update_progress(job_id, stage="done")
+            except ValueError as e:
+                self._set(job_id, state="failed", error=str(e), finished_at=time.time())
+            except Exception as e:
+                logger.exception(f"Ingest job {job_id} failed")
+                self._set(job_id, state="failed", error=f"Internal server error: {e}", finished_at=time.time())
+            finally:
+                self._queue.task_done()
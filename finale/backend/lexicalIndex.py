@@ -0,0 +1,182 @@
+# lexicalIndex.py
+# BM25 inverted index over section text, for the lexical prefilter of hybrid retrieval.
+import math
+import re
+import threading
+from collections import Counter
+
+import numpy as np
+
+# words, plus dotted/hyphenated compounds kept whole ("4.3", "covid-19", "gpt-4o")
+TOKEN_RE = re.compile(r"\w+(?:[.\-/]\w+)*")
+COMPOUND_SPLIT_RE = re.compile(r"[.\-/]")
+
+
+def tokenize(text):
+    """Lower-cased terms; a compound also yields its parts so "4.3" matches "section 4"."""
+    terms = []
+    for token in TOKEN_RE.findall((text or "").lower()):
+        terms.append(token)
+        if not token.isalnum():
+            terms.extend(part for part in COMPOUND_SPLIT_RE.split(token) if part)
+    return terms
+
+
+class LexicalIndex:
+    """
+    Incremental BM25 (k1, b) index; entries are (doc_id, section number).
+    - add(doc_id, texts) appends the document's sections to the postings; re-adding a
+      doc_id replaces it. remove(doc_id) tombstones its entries and takes them out of the
+      corpus statistics at once; their postings are dropped once tombstones pass half
+      of all entries.
+    - score(query, doc_ids) -> {doc_id: per-section scores} using corpus-wide idf and
+      average length; score_texts(query, texts) scores ad-hoc texts against their own
+      statistics (sections a client sends instead of a document id).
+    - In memory only: the app rebuilds it from the document store on startup.
+    """
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._docs = {}            # doc_id -> [start, count, alive]
+        self._doc_terms = {}       # doc_id -> Counter(term -> sections containing it)
+        self._postings = {}        # term -> ([entry], [tf])
+        self._arrays = {}          # term -> (entries, tfs) as arrays, rebuilt after changes
+        self._df = Counter()       # term -> live sections containing it
+        self._lengths = np.zeros(0, dtype=np.float32)
+        self._alive = np.zeros(0, dtype=bool)
+        self._size = 0
+        self._live = 0
+        self._dead = 0
+        self._total_length = 0.0
+        self._lock = threading.Lock()
+
+    def __contains__(self, doc_id):
+        with self._lock:
+            entry = self._docs.get(doc_id)
+            return entry is not None and entry[2]
+
+    def _grow(self, extra):
+        need = self._size + extra
+        if need <= len(self._alive):
+            return
+        capacity = max(need, 2 * len(self._alive), 1024)
+        lengths = np.zeros(capacity, dtype=np.float32)
+        lengths[:self._size] = self._lengths[:self._size]
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:self._size] = self._alive[:self._size]
+        self._lengths, self._alive = lengths, alive
+
+    def add(self, doc_id, texts):
+        counted = [Counter(tokenize(text)) for text in texts]
+        with self._lock:
+            self._remove(doc_id)
+            start = self._size
+            self._grow(len(counted))
+            doc_terms = Counter()
+            for i, tf in enumerate(counted):
+                entry = start + i
+                for term, n in tf.items():
+                    postings = self._postings.get(term)
+                    if postings is None:
+                        postings = self._postings[term] = ([], [])
+                    postings[0].append(entry)
+                    postings[1].append(n)
+                    self._arrays.pop(term, None)
+                doc_terms.update(tf.keys())
+                length = sum(tf.values())
+                self._lengths[entry] = length
+                self._total_length += length
+            self._alive[start:start + len(counted)] = True
+            self._df.update(doc_terms)
+            self._doc_terms[doc_id] = doc_terms
+            self._docs[doc_id] = [start, len(counted), True]
+            self._size += len(counted)
+            self._live += len(counted)
+
+    def remove(self, doc_id):
+        with self._lock:
+            return self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        entry = self._docs.get(doc_id)
+        if entry is None or not entry[2]:
+            return False
+        start, count, _ = entry
+        entry[2] = False
+        self._alive[start:start + count] = False
+        self._total_length -= float(self._lengths[start:start + count].sum())
+        self._df.subtract(self._doc_terms.pop(doc_id))
+        self._live -= count
+        self._dead += count
+        if self._dead > self._live:
+            self._compact()
+        return True
+
+    def _compact(self):
+        # entry numbers stay; only postings of tombstoned entries are dropped
+        for term in list(self._postings):
+            entries, tfs = self._postings[term]
+            kept = [(e, n) for e, n in zip(entries, tfs) if self._alive[e]]
+            if kept:
+                self._postings[term] = ([e for e, _ in kept], [n for _, n in kept])
+            else:
+                del self._postings[term]
+                self._df.pop(term, None)
+        self._arrays.clear()
+        self._docs = {d: e for d, e in self._docs.items() if e[2]}
+        self._dead = 0
+
+    def _term_arrays(self, term):
+        arrays = self._arrays.get(term)
+        if arrays is None:
+            entries, tfs = self._postings[term]
+            arrays = self._arrays[term] = (np.asarray(entries, dtype=np.int64), np.asarray(tfs, dtype=np.float32))
+        return arrays
+
+    def _idf(self, df, n):
+        return math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+
+    def score(self, query, doc_ids):
+        """{doc_id: float32 BM25 score per section} for the indexed, live doc_ids."""
+        terms = set(tokenize(query))
+        with self._lock:
+            wanted = {d: self._docs[d] for d in doc_ids if d in self._docs and self._docs[d][2]}
+            if not wanted:
+                return {}
+            scores = np.zeros(self._size, dtype=np.float32)
+            avg_length = self._total_length / self._live if self._live else 1.0
+            for term in terms:
+                if term not in self._postings or self._df[term] <= 0:
+                    continue
+                entries, tfs = self._term_arrays(term)
+                norm = self.k1 * (1.0 - self.b + self.b * self._lengths[entries] / avg_length)
+                scores[entries] += self._idf(self._df[term], self._live) * tfs * (self.k1 + 1.0) / (tfs + norm)
+            return {d: scores[start:start + count] for d, (start, count, _) in wanted.items()}
+
+    def score_texts(self, query, texts):
+        index = LexicalIndex(self.k1, self.b)
+        index.add("", texts)
+        return index.score(query, [""]).get("", np.zeros(len(texts), dtype=np.float32))
+
+    def sync(self, doc_ids, load_texts):
+        """Index any of doc_ids not yet indexed; load_texts(doc_id) -> section texts or None."""
+        added = 0
+        for doc_id in doc_ids:
+            if doc_id in self:
+                continue
+            texts = load_texts(doc_id)
+            if texts is not None:
+                self.add(doc_id, texts)
+                added += 1
+        return added
+
+    def stats(self):
+        with self._lock:
+            return {
+                "documents": sum(1 for e in self._docs.values() if e[2]),
+                "live_entries": self._live,
+                "tombstones": self._dead,
+                "terms": len(self._postings),
+                "postings": sum(len(p[0]) for p in self._postings.values()),
+            }
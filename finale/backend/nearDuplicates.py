@@ -0,0 +1,183 @@
+# nearDuplicates.py
+# Near-duplicate section detection (MinHash over word shingles, LSH banding), so
+# boilerplate repeated across versions of a document is scored once per query.
+import re
+import threading
+import zlib
+
+import numpy as np
+
+WORD_RE = re.compile(r"\w+")
+SHINGLE_WORDS = 3
+NUM_PERM = 64
+BANDS = 16                      # 16 bands x 4 rows: pairs at Jaccard 0.85 collide with p > 0.99
+_PRIME = (1 << 61) - 1
+_rng = np.random.default_rng(20240607)   # fixed: signatures must agree across processes
+_A = _rng.integers(1, 1 << 32, NUM_PERM, dtype=np.uint64)
+_B = _rng.integers(0, 1 << 32, NUM_PERM, dtype=np.uint64)
+
+
+def shingles(text):
+    """crc32 of each SHINGLE_WORDS-word window of the lower-cased words (the whole text
+    if shorter), as uint64."""
+    words = WORD_RE.findall((text or "").lower())
+    if not words:
+        return np.zeros(0, dtype=np.uint64)
+    n = min(SHINGLE_WORDS, len(words))
+    grams = {" ".join(words[i:i + n]) for i in range(len(words) - n + 1)}
+    return np.fromiter((zlib.crc32(g.encode('utf-8')) for g in grams), dtype=np.uint64, count=len(grams))
+
+
+def minhash(text):
+    """NUM_PERM-value MinHash signature (uint32), or None for a text without words."""
+    x = shingles(text)
+    if not len(x):
+        return None
+    # a, x < 2**32, so a * x fits in uint64 before the reduction
+    hashed = ((x[:, None] * _A[None, :]) % _PRIME + _B[None, :]) % _PRIME
+    return hashed.min(axis=0).astype(np.uint32)
+
+
+class DuplicateIndex:
+    """
+    Groups near-duplicate sections under one canonical section.
+    - Entries are (doc_id, section number). add(doc_id, texts) signs each section and
+      looks it up in the LSH buckets of the canonical sections (BANDS bands of the
+      signature); a candidate whose estimated Jaccard similarity (share of equal MinHash
+      values) reaches threshold becomes the section's canonical, otherwise the section
+      is canonical itself. Sections are added in order, so copies inside one document
+      are found too.
+    - canonical(doc_id, section) -> the group's canonical entry.
+    - remove(doc_id) drops its sections; a removed canonical hands its group to its
+      first remaining copy.
+    - In memory only: the app rebuilds it from the document store on startup.
+    """
+
+    def __init__(self, threshold=0.85, bands=BANDS):
+        if NUM_PERM % bands:
+            raise ValueError(f"bands must divide {NUM_PERM}")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = NUM_PERM // bands
+        self._docs = {}          # doc_id -> section count
+        self._sigs = {}          # entry -> signature
+        self._canonical = {}     # entry -> canonical entry
+        self._copies = {}        # canonical entry -> [copy entries]
+        self._buckets = {}       # (band, band values) -> [canonical entries]
+        self._lock = threading.Lock()
+
+    def __contains__(self, doc_id):
+        with self._lock:
+            return doc_id in self._docs
+
+    def _band_keys(self, sig):
+        return [(b, sig[b * self.rows:(b + 1) * self.rows].tobytes()) for b in range(self.bands)]
+
+    def _index(self, entry):
+        for key in self._band_keys(self._sigs[entry]):
+            self._buckets.setdefault(key, []).append(entry)
+
+    def _unindex(self, entry):
+        for key in self._band_keys(self._sigs[entry]):
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.remove(entry)
+                if not bucket:
+                    del self._buckets[key]
+
+    def _find(self, sig):
+        candidates = set()
+        for key in self._band_keys(sig):
+            candidates.update(self._buckets.get(key, ()))
+        best, best_score = None, self.threshold
+        for entry in sorted(candidates, key=str):
+            score = float(np.mean(self._sigs[entry] == sig))
+            if score >= best_score and (best is None or score > best_score):
+                best, best_score = entry, score
+        return best
+
+    def add(self, doc_id, texts):
+        """Canonical entry of each of the document's sections (the section itself when it
+        has no earlier near-duplicate); re-adding a doc_id replaces it."""
+        sigs = [minhash(text) for text in texts]
+        with self._lock:
+            self._remove(doc_id)
+            self._docs[doc_id] = len(sigs)
+            canonical = []
+            for i, sig in enumerate(sigs):
+                entry = (doc_id, i)
+                if sig is None:
+                    canonical.append(entry)
+                    continue
+                self._sigs[entry] = sig
+                match = self._find(sig)
+                if match is None:
+                    self._index(entry)
+                    match = entry
+                else:
+                    self._copies.setdefault(match, []).append(entry)
+                self._canonical[entry] = match
+                canonical.append(match)
+            return canonical
+
+    def canonical(self, doc_id, section):
+        with self._lock:
+            return self._canonical.get((doc_id, section), (doc_id, section))
+
+    def remove(self, doc_id):
+        with self._lock:
+            return self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        count = self._docs.pop(doc_id, None)
+        if count is None:
+            return False
+        for i in range(count):
+            entry = (doc_id, i)
+            canonical = self._canonical.pop(entry, None)
+            if canonical is None:
+                continue
+            if canonical != entry:
+                # a copy of a canonical in this same document left with its group already
+                group = self._copies.get(canonical)
+                if group is not None and entry in group:
+                    group.remove(entry)
+                    if not group:
+                        del self._copies[canonical]
+            else:
+                self._unindex(entry)
+                copies = [c for c in self._copies.pop(entry, []) if c[0] != doc_id]
+                if copies:
+                    heir = copies[0]
+                    self._index(heir)
+                    for copy in copies:
+                        self._canonical[copy] = heir
+                    if copies[1:]:
+                        self._copies[heir] = copies[1:]
+            del self._sigs[entry]
+        return True
+
+    def sync(self, doc_ids, load_texts):
+        """Add any of doc_ids not yet indexed; load_texts(doc_id) -> section texts or None."""
+        added = 0
+        for doc_id in doc_ids:
+            if doc_id in self:
+                continue
+            texts = load_texts(doc_id)
+            if texts is not None:
+                self.add(doc_id, texts)
+                added += 1
+        return added
+
+    def stats(self):
+        with self._lock:
+            sections = sum(self._docs.values())
+            copies = sum(len(c) for c in self._copies.values())
+            return {
+                "documents": len(self._docs),
+                "sections": sections,
+                "canonical_sections": sections - copies,
+                "duplicate_sections": copies,
+                "duplication_rate": round(copies / sections, 4) if sections else 0.0,
+                "threshold": self.threshold,
+            }
@@ -0,0 +1,521 @@
+# pdfParser.py
+# PDF line extraction + grouping for the heading classifier. Kept free of the heavy app
+# imports so process-pool workers stay cheap to start.
+import logging
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from threading import Lock
+
+import fitz  # PyMuPDF
+import numpy as np
+
+from featureEngine import rows_to_frame
+
+logger = logging.getLogger(__name__)
+
+# Parallel extraction: documents with at least PARALLEL_PAGE_THRESHOLD pages are split
+# into page ranges and parsed across PARSE_WORKERS processes (0 = one per CPU).
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", "0")) or (os.cpu_count() or 1)
+PARALLEL_PAGE_THRESHOLD = int(os.getenv("PARALLEL_PAGE_THRESHOLD", "64"))
+# ranges per worker: a few more tasks than workers evens out pages of uneven density
+PARSE_TASKS_PER_WORKER = 2
+# Workers are started by a fork server (spawn where there is none), never forked from the
+# app: by the time the pool starts the app runs broker/ingest/warm-up threads and has torch
+# loaded, and forking that can deadlock a worker and copies the whole heap into each.
+# Like spawned processes, they re-import the main script as __mp_main__; startupProfile
+# keeps that import light (see in_spawned_worker).
+PARSE_START_METHOD = os.getenv(
+    "PARSE_START_METHOD",
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+
+_pool = None
+_pool_lock = Lock()
+
+
+# -------------------------
+# PDF text utilities
+# -------------------------
+# compiled once: these run for every physical line of every page
+BULLET_PATTERNS = [re.compile(p) for p in (
+    r'^[•·▪▫▬►‣⁃]\s*', r'^\*\s+', r'^-\s+', r'^—\s+', r'^–\s+',
+    r'^\+\s+', r'^>\s+', r'^»\s+', r'^○\s+', r'^□\s+', r'^▪\s+', r'^▫\s+'
+)]
+LIST_MARKER_RE = re.compile(r'^\d+[\.\)]\s*$|^[a-zA-Z][\.\)]\s*$')
+SYMBOLS_ONLY_RE = re.compile(r'^[^\w\s]+$')
+NUMBER_OR_LETTER_RE = re.compile(r'^\d+$|^[a-zA-Z]$')
+
+def is_bullet_point(text):
+    text = text.strip()
+    for pattern in BULLET_PATTERNS:
+        if pattern.match(text):
+            return True
+    if LIST_MARKER_RE.match(text):
+        return True
+    if len(text) <= 3 and SYMBOLS_ONLY_RE.match(text):
+        return True
+    return False
+
+def should_ignore_text(text):
+    text = text.strip()
+    if len(text) < 2:
+        return True
+    if is_bullet_point(text):
+        return True
+    if NUMBER_OR_LETTER_RE.match(text):
+        return True
+    artifacts = ['©', '®', '™', '...', '…']
+    if text in artifacts:
+        return True
+    return False
+
+def clean_text(text):
+    text = text.strip()
+    for pattern in BULLET_PATTERNS:
+        text = pattern.sub('', text)
+    return text.strip()
+
+
+# -------------------------
+# analyze_pdf_sections (produces both df for classifier AND the LineStore mapping)
+# -------------------------
+def group_row(text, pdf_path, page_num, font_size, is_bold, is_italic, position_y, y_gap, start_line=None, end_line=None):
+    """
+    Raw grouped row; the text-derived features (length, capitalisation, numbering) are
+    added for all rows at once by featureEngine.rows_to_frame.
+    """
+    row = {
+        'PDF Path': str(pdf_path),
+        'Page Number': page_num,
+        'Section Text': text,
+        'Font Size': font_size,
+        'Is Bold': is_bold,
+        'Is Italic': is_italic,
+        'Position Y': position_y,
+        'Y Gap': y_gap
+    }
+    # attach start/end line indexes for later mapping to rects
+    if start_line is not None:
+        row['Start Line'] = int(start_line)
+    if end_line is not None:
+        row['End Line'] = int(end_line)
+    return row
+
+class LineStore:
+    """
+    Columnar store of the physical text lines of a document, in reading order.
+    Line i (the Start Line / End Line numbering used by grouped rows) is:
+      - pages[i]: 1-based page number (int32)
+      - bboxes[i]: [x0, y0, x1, y1] (float32; MuPDF computes rects in single precision)
+      - text(i): buffer[offsets[i]:offsets[i + 1]]
+    """
+
+    __slots__ = ('pages', 'bboxes', 'buffer', 'offsets')
+
+    def __init__(self, pages, bboxes, buffer, offsets):
+        self.pages = pages
+        self.bboxes = bboxes
+        self.buffer = buffer
+        self.offsets = offsets
+
+    @classmethod
+    def from_lists(cls, pages, bboxes, texts):
+        offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+        if texts:
+            np.cumsum([len(t) for t in texts], out=offsets[1:])
+        return cls(
+            np.asarray(pages, dtype=np.int32),
+            np.asarray(bboxes, dtype=np.float32).reshape(-1, 4),
+            "".join(texts),
+            offsets,
+        )
+
+    @classmethod
+    def concat(cls, stores):
+        stores = [st for st in stores if len(st)]
+        if not stores:
+            return cls.from_lists([], [], [])
+        if len(stores) == 1:
+            return stores[0]
+        offsets = [stores[0].offsets]
+        shift = stores[0].offsets[-1]
+        for st in stores[1:]:
+            offsets.append(st.offsets[1:] + shift)
+            shift += st.offsets[-1]
+        return cls(
+            np.concatenate([st.pages for st in stores]),
+            np.concatenate([st.bboxes for st in stores]),
+            "".join(st.buffer for st in stores),
+            np.concatenate(offsets),
+        )
+
+    def __len__(self):
+        return len(self.pages)
+
+    def page(self, i):
+        return int(self.pages[i])
+
+    def text(self, i):
+        return self.buffer[self.offsets[i]:self.offsets[i + 1]]
+
+    def rects_for_ranges(self, starts, ends):
+        """
+        Per-page union boxes over the lines in the inclusive ranges [starts[k], ends[k]].
+        Ranges must be in document order (as grouped rows are). Returns
+        [{"page": p, "bbox": [x0, y0, x1, y1]}, ...] in page order.
+        """
+        return self.section_rects(starts, ends, np.zeros(len(starts), dtype=np.int64), 1)[0]
+
+    def section_rects(self, starts, ends, groups, n_groups):
+        """
+        rects_for_ranges for many sections at once: range k belongs to section groups[k]
+        (non-decreasing). Returns one rect list per section, 0..n_groups-1.
+        """
+        out = [[] for _ in range(n_groups)]
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        groups = np.asarray(groups, dtype=np.int64)
+        lengths = ends - starts + 1
+        keep = lengths > 0
+        starts, lengths, groups = starts[keep], lengths[keep], groups[keep]
+        if not len(starts):
+            return out
+        # expand the ranges into one index array without a Python loop
+        total = int(lengths.sum())
+        range_first = np.cumsum(lengths) - lengths
+        idx = np.repeat(starts - range_first, lengths) + np.arange(total)
+        grp = np.repeat(groups, lengths)
+        valid = (idx >= 0) & (idx < len(self.pages))
+        idx, grp = idx[valid], grp[valid]
+        if not len(idx):
+            return out
+
+        # one segment per (section, page) run; reduce each bbox column over the segments
+        pages = self.pages[idx]
+        boxes = self.bboxes[idx]
+        seg = np.concatenate(([0], np.flatnonzero((np.diff(pages) != 0) | (np.diff(grp) != 0)) + 1))
+        x0 = np.minimum.reduceat(boxes[:, 0], seg)
+        y0 = np.minimum.reduceat(boxes[:, 1], seg)
+        x1 = np.maximum.reduceat(boxes[:, 2], seg)
+        y1 = np.maximum.reduceat(boxes[:, 3], seg)
+        for g, p, a, b, c, d in zip(grp[seg].tolist(), pages[seg].tolist(), x0.tolist(), y0.tolist(), x1.tolist(), y1.tolist()):
+            out[g].append({"page": p, "bbox": [a, b, c, d]})
+        return out
+
+
+def _analyze_page(doc, pdf_path, page_idx, line_counter):
+    """
+    Parse one page. Returns (grouped_rows, LineStore, next_line_counter); the rows'
+    Start Line / End Line continue from line_counter.
+    """
+    grouped_rows = []
+    line_pages = []
+    line_bboxes = []
+    line_texts = []
+    page = doc.load_page(page_idx)
+    blocks = page.get_text("dict").get('blocks', [])
+
+    # For grouping we track a current group (list of text lines' indices and texts)
+    current_group_line_indices = []
+    current_group_texts = []
+    # representative style properties for current group (first line's style)
+    current_font_size = None
+    current_bold = None
+    current_italic = None
+    prev_line_y = None
+    prev_y_gap = None
+
+    for block in blocks:
+        if block.get('type') != 0:
+            continue
+        for line in block.get('lines', []):
+            spans = [s for s in line.get('spans', []) if s.get('text','').strip()]
+            if not spans:
+                continue
+
+            line_text = " ".join(span['text'].strip() for span in spans)
+            if should_ignore_text(line_text):
+                continue
+            cleaned = clean_text(line_text)
+            if not cleaned:
+                continue
+
+            # compute bbox for the physical line (union of spans)
+            x0 = min(s['bbox'][0] for s in spans)
+            y0 = min(s['bbox'][1] for s in spans)
+            x1 = max(s['bbox'][2] for s in spans)
+            y1 = max(s['bbox'][3] for s in spans)
+            bbox = [x0, y0, x1, y1]
+
+            # style info from first span of the line
+            first_span = spans[0]
+            font_size = first_span.get('size', 0)
+            font_flags = first_span.get('flags', 0)
+            is_bold = (font_flags & 16) > 0
+            is_italic = (font_flags & 2) > 0
+            y_pos = first_span['bbox'][1]
+
+            # always append a physical line entry
+            line_pages.append(page_idx + 1)
+            line_bboxes.append(bbox)
+            line_texts.append(cleaned)
+            this_line_index = line_counter
+            line_counter += 1
+
+            # compute y gap relative to previous line (for features)
+            if prev_line_y is None:
+                y_gap = None
+            else:
+                y_gap = abs(y_pos - prev_line_y)
+            prev_line_y = y_pos
+
+            # decide whether to continue the current group or start a new group
+            if current_font_size is None:
+                # first line in group
+                current_group_line_indices = [this_line_index]
+                current_group_texts = [cleaned]
+                current_font_size = font_size
+                current_bold = is_bold
+                current_italic = is_italic
+                prev_y_gap = y_gap
+            else:
+                same_style = (abs(current_font_size - font_size) < 0.5 and is_bold == current_bold and is_italic == current_italic)
+                if same_style:
+                    # continue group
+                    current_group_line_indices.append(this_line_index)
+                    current_group_texts.append(cleaned)
+                else:
+                    # finalize previous group into one grouped row
+                    full_text = " ".join(current_group_texts)
+                    if not should_ignore_text(full_text) and len(full_text.strip()) > 2:
+                        start_line = current_group_line_indices[0]
+                        end_line = current_group_line_indices[-1]
+                        feat = group_row(full_text, pdf_path, page_idx + 1,
+                                         current_font_size, current_bold, current_italic,
+                                         prev_line_y, prev_y_gap, start_line=start_line, end_line=end_line)
+                        grouped_rows.append(feat)
+                    # start new group with this line
+                    current_group_line_indices = [this_line_index]
+                    current_group_texts = [cleaned]
+                    current_font_size = font_size
+                    current_bold = is_bold
+                    current_italic = is_italic
+                    prev_y_gap = y_gap
+
+    # finalize group's leftover at end of page
+    if current_group_texts:
+        full_text = " ".join(current_group_texts)
+        if not should_ignore_text(full_text) and len(full_text.strip()) > 2:
+            start_line = current_group_line_indices[0]
+            end_line = current_group_line_indices[-1]
+            feat = group_row(full_text, pdf_path, page_idx + 1,
+                             current_font_size, current_bold, current_italic,
+                             prev_line_y, prev_y_gap, start_line=start_line, end_line=end_line)
+            grouped_rows.append(feat)
+
+    return grouped_rows, LineStore.from_lists(line_pages, line_bboxes, line_texts), line_counter
+
+def _analyze_pages(doc, pdf_path, page_start, page_stop, line_offset=0, on_page=None):
+    """
+    Parse pages [page_start, page_stop) of an open document.
+    line_index / Start Line / End Line are numbered from line_offset.
+    on_page(page_idx) is called after each page is finished.
+    """
+    grouped_rows = []   # will become rows for df (paragraph/group-level)
+    page_stores = []    # one LineStore per page, physical text lines in order
+    line_counter = line_offset
+
+    for page_idx in range(page_start, page_stop):
+        rows, lines, line_counter = _analyze_page(doc, pdf_path, page_idx, line_counter)
+        grouped_rows.extend(rows)
+        page_stores.append(lines)
+        if on_page is not None:
+            on_page(page_idx)
+
+    return grouped_rows, LineStore.concat(page_stores)
+
+def iter_pdf_pages(pdf_path, parallel=None):
+    """
+    Page-by-page parse for streaming: yields (page_number, page_count, grouped_rows, LineStore)
+    with the same global line numbering analyze_pdf_sections produces.
+    parallel=None parses documents of at least PARALLEL_PAGE_THRESHOLD pages as page ranges
+    across the pool (pages are still yielded in order, a range at a time); a range whose
+    worker fails is parsed here instead.
+    """
+    with fitz.open(pdf_path) as doc:
+        page_count = doc.page_count
+    if parallel is None:
+        parallel = PARSE_WORKERS > 1 and page_count >= PARALLEL_PAGE_THRESHOLD
+    futures = None
+    if parallel and page_count > 1:
+        pool = _get_pool()
+        try:
+            bounds, futures = _submit_ranges(pool, _analyze_page_list, pdf_path, page_count)
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                _discard_pool(pool)
+            logger.warning(f"Parallel parse failed for {pdf_path}, falling back to serial: {e}")
+
+    if futures is None:
+        doc = fitz.open(pdf_path)
+        try:
+            line_counter = 0
+            for page_idx in range(page_count):
+                rows, lines, line_counter = _analyze_page(doc, pdf_path, page_idx, line_counter)
+                yield page_idx + 1, page_count, rows, lines
+        finally:
+            doc.close()
+        return
+
+    offset = 0
+    for i, fut in enumerate(futures):
+        try:
+            pages = fut.result()
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                _discard_pool(pool)
+            logger.warning(f"Parallel parse of pages {bounds[i] + 1}-{bounds[i + 1]} failed for {pdf_path}, parsing them here: {e}")
+            pages = _analyze_page_list(pdf_path, bounds[i], bounds[i + 1])
+        range_offset = offset
+        for k, (rows, lines) in enumerate(pages):
+            _shift_lines(rows, range_offset)
+            offset += len(lines)
+            yield bounds[i] + k + 1, page_count, rows, lines
+
+def _analyze_page_range(pdf_path, page_start, page_stop):
+    """Process-pool worker: opens its own fitz document and numbers lines from 0."""
+    doc = fitz.open(pdf_path)
+    try:
+        return _analyze_pages(doc, pdf_path, page_start, page_stop)
+    finally:
+        doc.close()
+
+def _analyze_page_list(pdf_path, page_start, page_stop):
+    """Process-pool worker for streaming: [(grouped_rows, LineStore)] per page, lines numbered from 0."""
+    doc = fitz.open(pdf_path)
+    try:
+        pages, line_counter = [], 0
+        for page_idx in range(page_start, page_stop):
+            rows, lines, line_counter = _analyze_page(doc, pdf_path, page_idx, line_counter)
+            pages.append((rows, lines))
+        return pages
+    finally:
+        doc.close()
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS,
+                                        mp_context=multiprocessing.get_context(PARSE_START_METHOD))
+            logger.info(f"Started PDF parse pool with {PARSE_WORKERS} workers ({PARSE_START_METHOD})")
+        return _pool
+
+def _discard_pool(pool):
+    """
+    Drop a pool whose worker died (BrokenProcessPool): it refuses every later submit, so
+    the next parse starts a fresh one instead of falling back to serial for good.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not pool:
+            return   # already replaced by another caller
+        _pool = None
+    logger.warning("PDF parse pool broke (a worker died); starting a new one on the next parse")
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def _submit_ranges(pool, worker, pdf_path, page_count):
+    """Split the pages into ranges and submit worker(pdf_path, start, stop) for each: (bounds, futures)."""
+    n_tasks = min(page_count, PARSE_WORKERS * PARSE_TASKS_PER_WORKER)
+    bounds = [page_count * i // n_tasks for i in range(n_tasks + 1)]
+    return bounds, [pool.submit(worker, pdf_path, bounds[i], bounds[i + 1]) for i in range(n_tasks)]
+
+def _shift_lines(rows, offset):
+    """Renumber a range's rows from its local line numbers to the document's."""
+    if offset:
+        for row in rows:
+            row['Start Line'] += offset
+            row['End Line'] += offset
+
+def _analyze_parallel(pdf_path, page_count, progress=None):
+    pool = _get_pool()
+    try:
+        bounds, futures = _submit_ranges(pool, _analyze_page_range, pdf_path, page_count)
+    except BrokenProcessPool:
+        _discard_pool(pool)
+        raise
+
+    # merge in page order, shifting each chunk's local line numbers by the lines before it
+    grouped_rows = []
+    stores = []
+    offset = 0
+    for i, fut in enumerate(futures):
+        try:
+            rows, lines = fut.result()
+        except BrokenProcessPool:
+            _discard_pool(pool)
+            raise
+        _shift_lines(rows, offset)
+        offset += len(lines)
+        grouped_rows.extend(rows)
+        stores.append(lines)
+        if progress is not None:
+            progress(bounds[i + 1], page_count)
+    return grouped_rows, LineStore.concat(stores)
+
+def analyze_pdf_sections(pdf_path, parallel=None, progress=None):
+    """
+    Parse the PDF and return:
+      - df: DataFrame of grouped rows (for classifier). Each row contains Start Line and End Line.
+      - lines: LineStore of the physical lines (page, bbox, text), indexed by line number
+    parallel=None picks the process-pool path automatically for documents with at least
+    PARALLEL_PAGE_THRESHOLD pages; True/False forces it on/off.
+    progress(pages_parsed, page_count), if given, is called as pages complete.
+    """
+    grouped_rows = []
+    lines = LineStore.from_lists([], [], [])
+    try:
+        doc = fitz.open(pdf_path)
+        page_count = doc.page_count
+        if parallel is None:
+            parallel = PARSE_WORKERS > 1 and page_count >= PARALLEL_PAGE_THRESHOLD
+        on_page = (lambda page_idx: progress(page_idx + 1, page_count)) if progress is not None else None
+
+        if parallel and page_count > 1:
+            doc.close()
+            try:
+                grouped_rows, lines = _analyze_parallel(pdf_path, page_count, progress)
+            except Exception as e:
+                logger.warning(f"Parallel parse failed for {pdf_path}, falling back to serial: {e}")
+                doc = fitz.open(pdf_path)
+                grouped_rows, lines = _analyze_pages(doc, pdf_path, 0, page_count, on_page=on_page)
+                doc.close()
+        else:
+            grouped_rows, lines = _analyze_pages(doc, pdf_path, 0, page_count, on_page=on_page)
+            doc.close()
+    except Exception as e:
+        logger.exception(f"Error processing {pdf_path}: {e}")
+
+    df = rows_to_frame(grouped_rows)
+    return df, lines
+
+def _analyze_document(pdf_path):
+    """Process-pool worker for analyze_many: a whole document, parsed serially."""
+    return analyze_pdf_sections(pdf_path, parallel=False)
+
+def analyze_many(pdf_paths):
+    """
+    Parse several PDFs, one document per pool worker. Returns [(df, lines), ...]
+    in the order of pdf_paths.
+    """
+    if PARSE_WORKERS > 1 and len(pdf_paths) > 1:
+        pool = _get_pool()
+        try:
+            return list(pool.map(_analyze_document, pdf_paths))
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                _discard_pool(pool)
+            logger.warning(f"Parallel batch parse failed, falling back to serial: {e}")
+    return [analyze_pdf_sections(path) for path in pdf_paths]
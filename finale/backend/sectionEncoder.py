@@ -0,0 +1,114 @@
+# sectionEncoder.py
+# Batched sentence-transformer encoding for whole requests. Texts are de-duplicated,
+# sorted by token length and cut into batches under a padded-token budget, so short
+# headings go through in large batches and long sections in small ones; results are
+# scattered back into request order.
+#
+# Concurrency: every thread that encodes (broker worker, uploads, ingest jobs, request-time
+# bulk sets, warm-up) shares one embedder. Forward passes are serialised through a
+# ForwardLock, one batch at a time: concurrent passes only oversubscribe torch's intra-op
+# threads, and batches bounded by ENCODE_TOKEN_BUDGET keep any one hold short. Tokenizer
+# calls outside the lock always use the same arguments (see token_lengths), which is what
+# makes sharing the fast tokenizer safe.
+import os
+import threading
+from contextlib import nullcontext
+
+import numpy as np
+
+ENCODE_MAX_BATCH = int(os.getenv("ENCODE_MAX_BATCH", "64"))
+# padded tokens per forward pass (batch size x longest text in the batch)
+ENCODE_TOKEN_BUDGET = int(os.getenv("ENCODE_TOKEN_BUDGET", "2048"))
+
+
+class ForwardLock:
+    """
+    FIFO (ticket) lock around the embedder's forward passes. A thread coming back for its
+    next batch queues behind everyone already waiting, so a query encode waits for the
+    batch in progress and those ahead of it, never for a whole bulk encode.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._next_ticket = 0
+        self._serving = 0
+
+    def __enter__(self):
+        with self._cond:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            while ticket != self._serving:
+                self._cond.wait()
+        return self
+
+    def __exit__(self, *exc):
+        with self._cond:
+            self._serving += 1
+            self._cond.notify_all()
+
+
+def token_lengths(embedder, texts):
+    """Tokens per text as the model will see them (special tokens included, truncated)."""
+    tokenizer = getattr(embedder, 'tokenizer', None)
+    if tokenizer is None:
+        return np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+    # same padding/truncation arguments as SentenceTransformer.tokenize: a fast tokenizer
+    # keeps them as state, and threads switching it between settings fail with
+    # "Already borrowed"
+    encoded = tokenizer(
+        texts, padding=True, truncation="longest_first", max_length=embedder.max_seq_length,
+        return_attention_mask=True, return_token_type_ids=False,
+    )
+    return np.fromiter(map(sum, encoded['attention_mask']), dtype=np.int64, count=len(texts))
+
+
+def plan_batches(lengths, max_batch=ENCODE_MAX_BATCH, token_budget=ENCODE_TOKEN_BUDGET):
+    """
+    Index arrays, shortest texts first. A batch grows while its padded size
+    (count x longest length) stays within token_budget and count within max_batch.
+    """
+    order = np.argsort(lengths, kind='stable')
+    batches, start = [], 0
+    for end in range(1, len(order) + 1):
+        count = end - start
+        longest = max(int(lengths[order[end - 1]]), 1)
+        if count > 1 and (count > max_batch or count * longest > token_budget):
+            batches.append(order[start:end - 1])
+            start = end - 1
+    if start < len(order):
+        batches.append(order[start:])
+    return batches
+
+
+def encode_texts(embedder, texts, normalize=True, max_batch=ENCODE_MAX_BATCH, token_budget=ENCODE_TOKEN_BUDGET,
+                 lock=None):
+    """
+    (len(texts), dim) float32 embeddings in input order; identical texts are encoded once.
+    lock (a ForwardLock) is held for each batch's forward pass.
+    """
+    texts = list(texts)
+    position = {}
+    unique = []
+    inverse = np.empty(len(texts), dtype=np.intp)
+    for i, text in enumerate(texts):
+        j = position.get(text)
+        if j is None:
+            j = position[text] = len(unique)
+            unique.append(text)
+        inverse[i] = j
+    if not unique:
+        dim = embedder.get_sentence_embedding_dimension() or 0
+        return np.zeros((0, dim), dtype=np.float32)
+
+    lengths = token_lengths(embedder, unique)
+    vectors = None
+    for batch in plan_batches(lengths, max_batch, token_budget):
+        with lock if lock is not None else nullcontext():
+            encoded = embedder.encode(
+                [unique[i] for i in batch], batch_size=len(batch), normalize_embeddings=normalize,
+                convert_to_numpy=True, show_progress_bar=False,
+            )
+        if vectors is None:
+            vectors = np.empty((len(unique), encoded.shape[1]), dtype=np.float32)
+        vectors[batch] = encoded
+    return vectors[inverse]
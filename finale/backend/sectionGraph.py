@@ -0,0 +1,556 @@
+# sectionGraph.py
+# Precomputed k-nearest-neighbour graph over every stored section, so "sections like this
+# one" is a row lookup instead of a similarity pass over the corpus.
+import copy
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+GRAPH_FORMAT_VERSION = 1
+# similarity tiles are at most BLOCK_ROWS x BLOCK_COLS float32 (16 MB at the defaults)
+BLOCK_ROWS = 1024
+BLOCK_COLS = 4096
+
+
+def _merge_topk(ids, scores, cand_ids, cand_scores, k):
+    """Row-wise best k of two (ids, scores) lists, best first; empty slots are (-1, -inf)."""
+    ids = np.concatenate([ids, cand_ids], axis=1)
+    scores = np.concatenate([scores, cand_scores], axis=1)
+    if ids.shape[1] > k:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        ids = np.take_along_axis(ids, part, axis=1)
+        scores = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-scores, axis=1, kind='stable')
+    return np.take_along_axis(ids, order, axis=1), np.take_along_axis(scores, order, axis=1)
+
+
+def _block_topk(sim, col_ids, k):
+    """Best k columns of each row of a similarity tile, as (ids, scores)."""
+    if sim.shape[1] > k:
+        part = np.argpartition(-sim, k - 1, axis=1)[:, :k]
+        return col_ids[part], np.take_along_axis(sim, part, axis=1)
+    return np.broadcast_to(col_ids, sim.shape).copy(), sim
+
+
+class SectionGraph:
+    """
+    k-nearest-neighbour lists for every section in the document store.
+    - Entries are (doc_id, section number); row e of the graph holds e's k most similar
+      live entries (inner product of unit vectors = cosine), best first, itself excluded.
+    - add(doc_id, vectors) links only the new rows. Without `candidates` they are scored
+      against the whole corpus in BLOCK_ROWS x BLOCK_COLS tiles (exact lists), and the
+      same tiles offer the new entries to the existing rows, whose lists are merged where
+      a new entry beats their k-th neighbour.
+    - With candidates(queries) (SectionIndex.candidates) a row is scored only against the
+      IVF lists its vector probes (unless the new rows outnumber the old ones): the compact scores pick k * rescore entries, which are
+      rescored exactly, and those pairs are offered back to the older rows. The lists are
+      then as good as the index's recall, and linking reads only the new rows' vectors.
+    - submit(doc_id) queues a stored document for a daemon worker, so uploads do not wait
+      for linking; similar() answers None for it until linked. The worker links into a
+      copy of the lists and swaps it in under the lock, so lookups wait only for the copy
+      and the swap; if the graph changed meanwhile, the batch is linked again under the lock.
+    - remove(doc_id) tombstones its entries and recomputes just the rows that listed
+      them. Tombstoned rows are dropped once they exceed compact_fraction of the entries.
+    - <root>/graph.json + graph.npz hold the document order and the lists. Vectors are
+      not kept: load_vectors(doc_id) (the document store's memory-mapped vectors; it must
+      not embed, since it is called under the graph lock) supplies them when needed.
+    """
+
+    def __init__(self, root, load_vectors, k=10, compact_fraction=0.25, candidates=None, rescore=4):
+        self.root = root
+        self.load_vectors = load_vectors
+        self.k = max(1, int(k))
+        self.compact_fraction = compact_fraction
+        self.candidates = candidates
+        self.rescore = max(1, int(rescore))
+        self.meta_path = os.path.join(root, "graph.json")
+        self.arrays_path = os.path.join(root, "graph.npz")
+        self._lock = threading.RLock()
+        self._pending = OrderedDict()      # doc_id -> None, waiting for the worker
+        self._pending_cond = threading.Condition()
+        self._linking = set()              # doc_ids taken off _pending, not yet swapped in
+        self._cancelled = set()            # of those, removed before the swap
+        self._version = 0                  # bumped by every change to the lists
+        self._thread = None
+        self._stats = {"linked_documents": 0, "link_seconds": 0.0, "failed_links": 0}
+        self._reset()
+        os.makedirs(root, exist_ok=True)
+        self._open()
+
+    def _reset(self):
+        self._docs = {}            # doc_id -> [start, count, alive]
+        self._doc_of = []          # entry -> doc_id
+        self._size = 0
+        self._dead = 0
+        self._neighbors = np.full((0, self.k), -1, dtype=np.int32)
+        self._scores = np.full((0, self.k), -np.inf, dtype=np.float32)
+        self._alive = np.zeros(0, dtype=bool)
+
+    # ------------------------------------------------------------------ storage
+    def _grow(self, extra):
+        need = self._size + extra
+        if need <= len(self._alive):
+            return
+        capacity = max(need, 2 * len(self._alive), 1024)
+        neighbors = np.full((capacity, self.k), -1, dtype=np.int32)
+        neighbors[:self._size] = self._neighbors[:self._size]
+        scores = np.full((capacity, self.k), -np.inf, dtype=np.float32)
+        scores[:self._size] = self._scores[:self._size]
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:self._size] = self._alive[:self._size]
+        self._neighbors, self._scores, self._alive = neighbors, scores, alive
+
+    def _atomic_write(self, path, write):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except Exception:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def _save(self):
+        order = sorted(self._docs.items(), key=lambda kv: kv[1][0])
+        meta = {
+            "format_version": GRAPH_FORMAT_VERSION,
+            "k": self.k,
+            "size": self._size,
+            "docs": [[doc_id, start, count, alive] for doc_id, (start, count, alive) in order],
+        }
+        arrays = {"neighbors": self._neighbors[:self._size], "scores": self._scores[:self._size]}
+        # arrays first: graph.json is the commit point and must never name rows the npz lacks
+        self._atomic_write(self.arrays_path, lambda f: np.savez(f, **arrays))
+        self._atomic_write(self.meta_path, lambda f: f.write(json.dumps(meta).encode('utf-8')))
+
+    def _open(self):
+        try:
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            arrays = np.load(self.arrays_path)
+            neighbors, scores = arrays["neighbors"], arrays["scores"]
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable section graph at {self.root}: {e}")
+            return
+        if (meta.get("format_version") != GRAPH_FORMAT_VERSION or meta.get("k") != self.k
+                or len(neighbors) != meta["size"]):
+            logger.warning(f"Section graph at {self.root} is stale; rebuilding from documents")
+            return
+
+        self._grow(meta["size"])
+        self._size = meta["size"]
+        self._neighbors[:self._size] = neighbors
+        self._scores[:self._size] = scores
+        # ranges of replaced documents are not listed; they stay dead with no owner
+        self._doc_of = [None] * self._size
+        for doc_id, start, count, alive in meta["docs"]:
+            if alive:
+                vectors = self.load_vectors(doc_id)
+                if vectors is None or len(vectors) != count:
+                    # left unowned like a replaced range, so sync() links the document again
+                    logger.warning(f"Section graph: vectors for {doc_id} missing or changed; dropping it")
+                    continue
+            self._docs[doc_id] = [start, count, alive]
+            self._doc_of[start:start + count] = [doc_id] * count
+            self._alive[start:start + count] = alive
+        self._dead = self._size - int(self._alive[:self._size].sum())
+        logger.info(f"Section graph opened: {self._size - self._dead} live entries, k={self.k}")
+
+    # ------------------------------------------------------------------ vectors
+    def _live_blocks(self):
+        """(entry ids, vectors) of every live entry, a few documents at a time."""
+        ids, vectors, n = [], [], 0
+        for doc_id, (start, count, alive) in sorted(self._docs.items(), key=lambda kv: kv[1][0]):
+            if not alive or not count:
+                continue
+            doc_vectors = self.load_vectors(doc_id)
+            if doc_vectors is None or len(doc_vectors) != count:
+                continue
+            ids.append(np.arange(start, start + count, dtype=np.int32))
+            vectors.append(doc_vectors)
+            n += count
+            if n >= BLOCK_COLS:
+                yield np.concatenate(ids), np.concatenate(vectors).astype(np.float32, copy=False)
+                ids, vectors, n = [], [], 0
+        if n:
+            yield np.concatenate(ids), np.concatenate(vectors).astype(np.float32, copy=False)
+
+    def _vectors(self, entries):
+        by_doc = {}
+        for pos, entry in enumerate(entries.tolist()):
+            by_doc.setdefault(self._doc_of[entry], []).append(pos)
+        out = None
+        for doc_id, positions in by_doc.items():
+            vectors = self.load_vectors(doc_id)
+            if vectors is None or len(vectors) != self._docs[doc_id][1]:
+                # gone from the store while linking: its rows score 0 until removed
+                continue
+            if out is None:
+                out = np.zeros((len(entries), vectors.shape[1]), dtype=np.float32)
+            out[positions] = vectors[entries[positions] - self._docs[doc_id][0]]
+        return out
+
+    def _entry_ids(self, doc_ids, sections):
+        """Graph entry ids of index hits (doc_id, section); -1 where not a live graph entry."""
+        starts = np.full(len(doc_ids), -1, dtype=np.int64)
+        counts = np.zeros(len(doc_ids), dtype=np.int64)
+        for pos, doc_id in enumerate(doc_ids):
+            entry = self._docs.get(doc_id)
+            if entry is not None and entry[2]:
+                starts[pos], counts[pos] = entry[0], entry[1]
+        ok = (starts >= 0) & (sections < counts)
+        return np.where(ok, starts + sections, -1).astype(np.int32)
+
+    def _link(self, rows, new_start=None):
+        """
+        Recompute the lists of entry ids `rows`. With new_start (rows are the entries
+        appended from there on), also offer them to the older rows.
+        """
+        # a bulk link (mostly new rows, e.g. the first sync) is cheaper as exact tiles
+        if self.candidates is not None and (new_start is None or self._size - new_start < new_start):
+            self._link_candidates(rows, new_start)
+            return
+        for r in range(0, len(rows), BLOCK_ROWS):
+            row_ids = rows[r:r + BLOCK_ROWS]
+            queries = self._vectors(row_ids)
+            if queries is None:
+                continue
+            best_ids = np.full((len(row_ids), self.k), -1, dtype=np.int32)
+            best_scores = np.full((len(row_ids), self.k), -np.inf, dtype=np.float32)
+            for col_ids, columns in self._live_blocks():
+                sim = queries @ columns.T
+                sim[row_ids[:, None] == col_ids[None, :]] = -np.inf
+                cand_ids, cand_scores = _block_topk(sim, col_ids, self.k)
+                best_ids, best_scores = _merge_topk(best_ids, best_scores, cand_ids, cand_scores, self.k)
+                if new_start is None:
+                    continue
+                old = col_ids < new_start
+                if not old.any():
+                    continue
+                # the same tile, transposed, offers the new rows to the older entries
+                back = sim[:, old].T
+                old_ids = col_ids[old]
+                improves = back.max(axis=1) > self._scores[old_ids, -1]
+                if not improves.any():
+                    continue
+                old_ids, back = old_ids[improves], back[improves]
+                cand_ids, cand_scores = _block_topk(back, row_ids, self.k)
+                self._neighbors[old_ids], self._scores[old_ids] = _merge_topk(
+                    self._neighbors[old_ids], self._scores[old_ids], cand_ids, cand_scores, self.k)
+            self._neighbors[row_ids], self._scores[row_ids] = best_ids, best_scores
+
+    def _link_candidates(self, rows, new_start=None):
+        """_link over the index's candidate lists instead of every live entry."""
+        width = self.k * self.rescore
+        for r in range(0, len(rows), BLOCK_ROWS):
+            row_ids = rows[r:r + BLOCK_ROWS]
+            queries = self._vectors(row_ids)
+            if queries is None:
+                continue
+            groups = self.candidates(queries)
+            # each row's best `width` per probed list go in its own slot, merged once below
+            probes = np.bincount(np.concatenate([g[0] for g in groups]), minlength=len(row_ids)) if groups else [1]
+            slot_ids = np.full((len(row_ids), max(probes) * width), -1, dtype=np.int32)
+            slot_scores = np.full(slot_ids.shape, -np.inf, dtype=np.float32)
+            used = np.zeros(len(row_ids), dtype=np.int64)
+            for positions, doc_ids, sections, columns in groups:
+                col_ids = self._entry_ids(doc_ids, sections)
+                if new_start is not None:
+                    col_ids[col_ids >= new_start] = -1     # scored exactly below
+                sim = queries[positions] @ columns.T
+                sim[(col_ids[None, :] < 0) | (row_ids[positions][:, None] == col_ids[None, :])] = -np.inf
+                cand_ids, cand_scores = _block_topk(sim, col_ids, width)
+                cols = used[positions][:, None] + np.arange(cand_ids.shape[1])
+                slot_ids[positions[:, None], cols] = cand_ids
+                slot_scores[positions[:, None], cols] = cand_scores
+                used[positions] += width
+            short_ids, short_scores = _merge_topk(
+                np.full((len(row_ids), 0), -1, dtype=np.int32), np.full((len(row_ids), 0), -np.inf, dtype=np.float32),
+                slot_ids, slot_scores, width)
+            if new_start is not None:
+                # the new rows against each other: the index may not hold all of them yet
+                for c in range(new_start, self._size, BLOCK_COLS):
+                    col_ids = np.arange(c, min(c + BLOCK_COLS, self._size), dtype=np.int32)
+                    sim = queries @ self._vectors(col_ids).T
+                    sim[row_ids[:, None] == col_ids[None, :]] = -np.inf
+                    cand_ids, cand_scores = _block_topk(sim, col_ids, width)
+                    short_ids, short_scores = _merge_topk(short_ids, short_scores, cand_ids, cand_scores, width)
+
+            # exact scores of the shortlist, from the stored vectors
+            valid = (short_ids >= 0) & (short_scores > -np.inf)
+            pair_rows, pair_cols = np.nonzero(valid)
+            pair_ids = short_ids[valid]
+            uniq, inverse = np.unique(pair_ids, return_inverse=True)
+            columns = self._vectors(uniq)
+            exact = np.full(short_ids.shape, -np.inf, dtype=np.float32)
+            if columns is not None:
+                for p in range(0, len(pair_ids), BLOCK_COLS):
+                    sl = slice(p, p + BLOCK_COLS)
+                    exact[pair_rows[sl], pair_cols[sl]] = np.einsum(
+                        'ij,ij->i', queries[pair_rows[sl]], columns[inverse[sl]])
+            short_ids = np.where(exact > -np.inf, short_ids, -1).astype(np.int32)
+            best_ids, best_scores = _merge_topk(
+                np.full((len(row_ids), self.k), -1, dtype=np.int32),
+                np.full((len(row_ids), self.k), -np.inf, dtype=np.float32), short_ids, exact, self.k)
+            self._neighbors[row_ids], self._scores[row_ids] = best_ids, best_scores
+            if new_start is None:
+                continue
+
+            # offer the new rows to the older entries they were scored against
+            old = (short_ids >= 0) & (short_ids < new_start)
+            old &= exact > self._scores[np.where(old, short_ids, 0), -1]
+            if not old.any():
+                continue
+            pair_rows, pair_cols = np.nonzero(old)
+            old_ids = short_ids[pair_rows, pair_cols]
+            order = np.argsort(old_ids, kind='stable')
+            old_ids, new_ids = old_ids[order], row_ids[pair_rows[order]]
+            scores = exact[pair_rows, pair_cols][order]
+            # one padded row of offers per older entry, merged into its list in one call
+            targets, group, counts = np.unique(old_ids, return_inverse=True, return_counts=True)
+            rank = np.arange(len(old_ids)) - np.concatenate(([0], np.cumsum(counts)[:-1]))[group]
+            offer_ids = np.full((len(targets), counts.max()), -1, dtype=np.int32)
+            offer_scores = np.full(offer_ids.shape, -np.inf, dtype=np.float32)
+            offer_ids[group, rank] = new_ids
+            offer_scores[group, rank] = scores
+            self._neighbors[targets], self._scores[targets] = _merge_topk(
+                self._neighbors[targets], self._scores[targets], offer_ids, offer_scores, self.k)
+
+    # ------------------------------------------------------------------ mutation
+    def __contains__(self, doc_id):
+        with self._lock:
+            entry = self._docs.get(doc_id)
+            return entry is not None and entry[2]
+
+    def add(self, doc_id, vectors, save=True):
+        """Link a stored document's sections (row i = section i); re-adding replaces it."""
+        self.add_many([(doc_id, len(vectors))], save=save)
+
+    def add_many(self, docs, save=True):
+        """Link several stored documents [(doc_id, section count)] in one blocked pass."""
+        with self._lock:
+            self._version += 1
+            for doc_id, _ in docs:
+                if doc_id in self:
+                    self.remove(doc_id, save=False)
+            new_start = self._size
+            for doc_id, count in docs:
+                self._grow(count)
+                start = self._size
+                self._neighbors[start:start + count] = -1
+                self._scores[start:start + count] = -np.inf
+                self._alive[start:start + count] = True
+                self._doc_of.extend([doc_id] * count)
+                self._docs[doc_id] = [start, count, True]
+                self._size += count
+            if self._size > new_start:
+                self._link(np.arange(new_start, self._size, dtype=np.int32), new_start=new_start)
+            if self._dead > self.compact_fraction * self._size:
+                self._compact()
+            if save:
+                self._save()
+
+    def submit(self, doc_id):
+        """Queue a stored document for the background worker to link (or relink)."""
+        with self._pending_cond:
+            self._pending[doc_id] = None
+            if self._thread is None:
+                # started lazily so importing the app spawns nothing
+                self._thread = threading.Thread(target=self._worker_loop, name="section-graph", daemon=True)
+                self._thread.start()
+            self._pending_cond.notify()
+
+    def pending(self, doc_id):
+        with self._pending_cond:
+            return doc_id in self._pending or doc_id in self._linking
+
+    def flush(self):
+        """Link everything queued so far on the calling thread."""
+        with self._pending_cond:
+            batch = list(self._pending)
+            self._pending.clear()
+            self._linking.update(batch)
+        try:
+            self._link_batch(batch)
+        finally:
+            with self._pending_cond:
+                self._linking.difference_update(batch)
+                self._cancelled.difference_update(batch)
+
+    def _scratch(self):
+        """A private copy of the lists (called with self._lock held) to link into unlocked."""
+        scratch = copy.copy(self)
+        scratch._lock = threading.RLock()
+        scratch._pending = OrderedDict()
+        scratch._pending_cond = threading.Condition()
+        scratch._linking, scratch._cancelled = set(), set()
+        scratch._docs = {doc_id: list(entry) for doc_id, entry in self._docs.items()}
+        scratch._doc_of = list(self._doc_of)
+        scratch._neighbors = self._neighbors[:self._size].copy()
+        scratch._scores = self._scores[:self._size].copy()
+        scratch._alive = self._alive[:self._size].copy()
+        return scratch
+
+    def _link_batch(self, doc_ids):
+        docs = []
+        for doc_id in doc_ids:
+            vectors = self.load_vectors(doc_id)
+            if vectors is not None and len(vectors):
+                docs.append((doc_id, len(vectors)))
+        if not docs:
+            return
+        started = time.perf_counter()
+        try:
+            with self._lock:
+                version = self._version
+                scratch = self._scratch()
+            scratch.add_many(docs, save=False)
+            with self._lock:
+                with self._pending_cond:
+                    cancelled = self._cancelled.intersection(doc_ids)
+                if self._version == version and not cancelled:
+                    self._docs, self._doc_of, self._size, self._dead = (
+                        scratch._docs, scratch._doc_of, scratch._size, scratch._dead)
+                    self._neighbors, self._scores, self._alive = scratch._neighbors, scratch._scores, scratch._alive
+                    self._version += 1
+                    self._save()
+                else:
+                    # removed or relinked meanwhile: the copy is stale, link again in place
+                    docs = [d for d in docs if d[0] not in cancelled]
+                    if docs:
+                        self.add_many(docs)
+        except Exception:
+            logger.exception(f"Linking {len(docs)} documents into the section graph failed")
+            self._stats["failed_links"] += 1
+            return
+        self._stats["linked_documents"] += len(docs)
+        self._stats["link_seconds"] += time.perf_counter() - started
+
+    def _worker_loop(self):
+        while True:
+            with self._pending_cond:
+                while not self._pending:
+                    self._pending_cond.wait()
+            self.flush()
+
+    def remove(self, doc_id, save=True):
+        """Tombstone a document's entries and relink the rows that listed them; False if it
+        was not in the graph."""
+        with self._lock:
+            with self._pending_cond:
+                queued = doc_id in self._pending or doc_id in self._linking
+                self._pending.pop(doc_id, None)
+                if doc_id in self._linking:
+                    self._cancelled.add(doc_id)
+            if not self._tombstone(doc_id):
+                return queued
+            self._version += 1
+            start, count, _ = self._docs[doc_id]
+            lists = self._neighbors[:self._size]
+            stale = np.flatnonzero(((lists >= start) & (lists < start + count)).any(axis=1)
+                                   & self._alive[:self._size])
+            if len(stale):
+                self._link(stale.astype(np.int32))
+            if self._dead > self.compact_fraction * self._size:
+                self._compact()
+            if save:
+                self._save()
+            return True
+
+    def _tombstone(self, doc_id):
+        entry = self._docs.get(doc_id)
+        if entry is None or not entry[2]:
+            return False
+        start, count, _ = entry
+        entry[2] = False
+        self._alive[start:start + count] = False
+        self._dead += count
+        return True
+
+    def _compact(self):
+        keep = np.flatnonzero(self._alive[:self._size])
+        remap = np.full(self._size + 1, -1, dtype=np.int32)   # last slot maps empty (-1) slots
+        remap[keep] = np.arange(len(keep), dtype=np.int32)
+        neighbors = remap[self._neighbors[keep]]
+        scores = self._scores[keep]
+        # rows that lost a neighbour are recomputed; the rest keep their lists
+        stale = np.flatnonzero(((neighbors < 0) & (scores > -np.inf)).any(axis=1))
+        docs = {}
+        for doc_id, (start, count, alive) in self._docs.items():
+            if alive:
+                docs[doc_id] = [int(np.searchsorted(keep, start)), count, True]
+        self._doc_of = [self._doc_of[i] for i in keep]
+        self._docs = docs
+        self._size = len(keep)
+        self._dead = 0
+        self._neighbors = neighbors
+        self._scores = scores
+        self._alive = np.ones(len(keep), dtype=bool)
+        if len(stale):
+            self._link(stale.astype(np.int32))
+        logger.info(f"Section graph compacted to {self._size} entries ({len(stale)} rows relinked)")
+
+    def sync(self, doc_ids, load_vectors=None):
+        """
+        Link any of doc_ids not yet in the graph (e.g. documents stored before it existed).
+        load_vectors overrides the graph's loader for finding them, outside the lock, e.g.
+        with one that embeds documents stored under another model.
+        """
+        load_vectors = load_vectors or self.load_vectors
+        missing = []
+        for doc_id in doc_ids:
+            if doc_id in self._docs:
+                continue
+            vectors = load_vectors(doc_id)
+            if vectors is not None and len(vectors):
+                missing.append((doc_id, len(vectors)))
+        if missing:
+            self.add_many(missing)
+        return len(missing)
+
+    # ------------------------------------------------------------------ lookup
+    def similar(self, doc_id, section, k=None):
+        """Up to k [(doc_id, section, score)] most similar to a section, best first; None if
+        the section is not in the graph."""
+        with self._lock:
+            entry = self._docs.get(doc_id)
+            if entry is None or not entry[2] or not 0 <= section < entry[1]:
+                return None
+            row = entry[0] + section
+            out = []
+            for neighbor, score in zip(self._neighbors[row].tolist(), self._scores[row].tolist()):
+                if k is not None and len(out) >= k:
+                    break
+                if neighbor < 0 or not self._alive[neighbor]:
+                    continue
+                other = self._doc_of[neighbor]
+                out.append((other, neighbor - self._docs[other][0], score))
+            return out
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": self._size,
+                "live_entries": self._size - self._dead,
+                "tombstones": self._dead,
+                "documents": sum(1 for e in self._docs.values() if e[2]),
+                "k": self.k,
+                "linking": "ivf candidates" if self.candidates is not None else "exact",
+                "linked_documents": self._stats["linked_documents"],
+                "link_seconds": round(self._stats["link_seconds"], 4),
+                "failed_links": self._stats["failed_links"],
+                "pending_documents": len(self._pending) + len(self._linking),
+                "resident_bytes": int(self._neighbors[:self._size].nbytes + self._scores[:self._size].nbytes),
+            }
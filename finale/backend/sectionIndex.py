@@ -0,0 +1,563 @@
+# sectionIndex.py
+# Corpus-wide approximate nearest-neighbour search over section embeddings (IVF, NumPy only).
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INDEX_FORMAT_VERSION = 1
+ASSIGN_BLOCK_ROWS = 8192
+CODECS = ("int8", "float16", "float32")
+
+
+def _normalize(x):
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return x / norms
+
+
+def _nearest_centroid(vectors, centroids):
+    out = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), ASSIGN_BLOCK_ROWS):
+        block = vectors[start:start + ASSIGN_BLOCK_ROWS]
+        out[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return out
+
+
+def quantize(vectors, codec):
+    """
+    (codes, scales) for float32 rows. int8 scales each row to +-127 (scale = max|v| / 127,
+    ~4x smaller than float32); float16 and float32 keep the values with unit scales.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if codec == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127.0 if len(vectors) else np.zeros(0, np.float32)
+        scales[scales == 0] = 1.0
+        codes = np.rint(vectors / scales[:, None]).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    return vectors.astype(codec), np.ones(len(vectors), dtype=np.float32)
+
+
+def dequantize(codes, scales):
+    return codes.astype(np.float32) * scales[:, None]
+
+
+def spherical_kmeans(vectors, nlist, iterations=10, seed=0):
+    """Centroids (nlist, dim), unit length, for inner-product search over unit vectors."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assign = _nearest_centroid(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        counts = np.bincount(assign, minlength=nlist)
+        empty = counts == 0
+        if empty.any():
+            # re-seed empty lists from random points so every list stays in use
+            sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+        centroids = _normalize(sums)
+    return centroids.astype(np.float32)
+
+
+class SectionIndex:
+    """
+    Inverted-file (IVF) index over every registered document's section vectors.
+    - Entries are (doc_id, section number), scored by inner product (= cosine on unit
+      vectors). Only a compact copy of each vector stays in memory: codec "int8" (row-
+      scaled, ~4x smaller than float32, the default), "float16" or "float32". The first
+      pass scores that copy; the best rescore x k are then re-scored with the exact
+      float32 vectors read on demand from the document store's memory-mapped files.
+    - Below train_min live entries search is exact. From then on spherical k-means
+      centroids (about sqrt(n) lists) partition the entries and search scans only the
+      nprobe lists closest to the query. Centroids are retrained once the corpus has
+      grown retrain_factor x since the last training; add() files new entries under the
+      current centroids.
+    - remove(doc_id) tombstones the document's entries: they are skipped by search and
+      dropped when tombstones exceed compact_fraction of all entries.
+    - <root>/index.json + index.npz hold the document order, tombstones, centroids and
+      list assignments. Vectors are not duplicated on disk: load_vectors(doc_id) (the
+      document store's memory-mapped vectors; it must not embed, since it is also called
+      under the index lock) supplies them again when the index is opened.
+    """
+
+    def __init__(self, root, load_vectors, nprobe=16, train_min=2048, retrain_factor=2.0,
+                 compact_fraction=0.25, codec="int8", rescore=4):
+        if codec not in CODECS:
+            raise ValueError(f"codec must be one of {CODECS}, got {codec!r}")
+        self.root = root
+        self.load_vectors = load_vectors
+        self.codec = codec
+        self.rescore = max(1, int(rescore))
+        self.nprobe = max(1, int(nprobe))
+        self.train_min = max(1, int(train_min))
+        self.retrain_factor = retrain_factor
+        self.compact_fraction = compact_fraction
+        self.meta_path = os.path.join(root, "index.json")
+        self.arrays_path = os.path.join(root, "index.npz")
+        self._lock = threading.RLock()
+        self._reset()
+        os.makedirs(root, exist_ok=True)
+        self._open()
+
+    def _reset(self, dim=0):
+        self.dim = dim
+        self._docs = {}            # doc_id -> [start, count, alive]
+        self._doc_of = []          # entry -> doc_id
+        self._size = 0
+        self._codes = np.zeros((0, dim), dtype=self.codec)
+        self._scales = np.zeros(0, dtype=np.float32)
+        self._assign = np.zeros(0, dtype=np.int32)
+        self._alive = np.zeros(0, dtype=bool)
+        self._section_of = np.zeros(0, dtype=np.int32)
+        self._dead = 0
+        self.centroids = None
+        self.trained_size = 0
+        self._lists = []
+
+    # ------------------------------------------------------------------ storage
+    def _grow(self, extra):
+        need = self._size + extra
+        if need <= len(self._alive):
+            return
+        capacity = max(need, 2 * len(self._alive), 1024)
+        codes = np.zeros((capacity, self.dim), dtype=self.codec)
+        codes[:self._size] = self._codes[:self._size]
+        self._codes = codes
+        for name, dtype in (("_scales", np.float32), ("_assign", np.int32), ("_alive", bool),
+                            ("_section_of", np.int32)):
+            grown = np.zeros(capacity, dtype=dtype)
+            grown[:self._size] = getattr(self, name)[:self._size]
+            setattr(self, name, grown)
+
+    def _rebuild_lists(self):
+        if self.centroids is None:
+            self._lists = []
+            return
+        ids = np.arange(self._size, dtype=np.int32)
+        order = np.argsort(self._assign[:self._size], kind='stable')
+        bounds = np.searchsorted(self._assign[:self._size][order], np.arange(len(self.centroids) + 1))
+        self._lists = [ids[order[bounds[i]:bounds[i + 1]]] for i in range(len(self.centroids))]
+
+    def _add_to_lists(self, start, assign):
+        order = np.argsort(assign, kind='stable')
+        sorted_assign = assign[order]
+        touched, first = np.unique(sorted_assign, return_index=True)
+        for j, list_id in enumerate(touched):
+            end = first[j + 1] if j + 1 < len(first) else len(order)
+            new_ids = (start + order[first[j]:end]).astype(np.int32)
+            self._lists[list_id] = np.concatenate([self._lists[list_id], new_ids])
+
+    def _atomic_write(self, path, write):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except Exception:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def _save(self):
+        order = sorted(self._docs.items(), key=lambda kv: kv[1][0])
+        meta = {
+            "format_version": INDEX_FORMAT_VERSION,
+            "dim": self.dim,
+            "size": self._size,
+            "trained_size": self.trained_size,
+            "docs": [[doc_id, start, count, alive] for doc_id, (start, count, alive) in order],
+        }
+        arrays = {"assign": self._assign[:self._size]}
+        if self.centroids is not None:
+            arrays["centroids"] = self.centroids
+        # arrays first: index.json is the commit point and must never name entries the npz lacks
+        self._atomic_write(self.arrays_path, lambda f: np.savez(f, **arrays))
+        self._atomic_write(self.meta_path, lambda f: f.write(json.dumps(meta).encode('utf-8')))
+
+    def _open(self):
+        try:
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            arrays = np.load(self.arrays_path)
+            assign = arrays["assign"]
+            centroids = arrays["centroids"] if "centroids" in arrays.files else None
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable section index at {self.root}: {e}")
+            return
+        if meta.get("format_version") != INDEX_FORMAT_VERSION or len(assign) != meta["size"]:
+            logger.warning(f"Section index at {self.root} is stale; rebuilding from documents")
+            return
+
+        self._reset(meta["dim"])
+        self._grow(meta["size"])
+        # ranges of replaced documents are not listed; they stay dead with no owner
+        self._doc_of = [None] * meta["size"]
+        for doc_id, start, count, alive in meta["docs"]:
+            vectors = self.load_vectors(doc_id) if alive else None
+            if alive and (vectors is None or vectors.shape != (count, self.dim)):
+                # left unowned like a replaced range, so sync() indexes the document again
+                logger.warning(f"Section index: vectors for {doc_id} missing or changed; dropping it")
+                continue
+            if alive:
+                self._codes[start:start + count], self._scales[start:start + count] = quantize(vectors, self.codec)
+            self._docs[doc_id] = [start, count, alive]
+            self._doc_of[start:start + count] = [doc_id] * count
+            self._alive[start:start + count] = alive
+            self._section_of[start:start + count] = np.arange(count, dtype=np.int32)
+        self._size = meta["size"]
+        self._dead = self._size - int(self._alive[:self._size].sum())
+        self._assign[:self._size] = assign
+        self.centroids = centroids
+        self.trained_size = meta["trained_size"]
+        self._rebuild_lists()
+        logger.info(f"Section index opened: {self._size - self._dead} live entries, "
+                    f"{len(self.centroids) if self.centroids is not None else 0} lists")
+
+    # ------------------------------------------------------------------ mutation
+    def __contains__(self, doc_id):
+        with self._lock:
+            entry = self._docs.get(doc_id)
+            return entry is not None and entry[2]
+
+    def add(self, doc_id, vectors, save=True):
+        """Index a document's section vectors (row i = section i); re-adding replaces it."""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._lock:
+            if doc_id in self._docs:
+                self._tombstone(doc_id)
+            if len(vectors) and not self.dim:
+                self.dim = vectors.shape[1]
+                self._codes = np.zeros((len(self._alive), self.dim), dtype=self.codec)
+            if len(vectors) and vectors.shape[1] != self.dim:
+                raise ValueError(f"vector dim {vectors.shape[1]} does not match index dim {self.dim}")
+            start, count = self._size, len(vectors)
+            self._grow(count)
+            self._codes[start:start + count], self._scales[start:start + count] = quantize(vectors, self.codec)
+            self._alive[start:start + count] = True
+            self._section_of[start:start + count] = np.arange(count, dtype=np.int32)
+            self._doc_of.extend([doc_id] * count)
+            self._docs[doc_id] = [start, count, True]
+            self._size += count
+            if self.centroids is not None and count:
+                assign = _nearest_centroid(vectors, self.centroids)
+                self._assign[start:start + count] = assign
+                self._add_to_lists(start, assign)
+            self._maybe_retrain()
+            if save:
+                self._save()
+
+    def remove(self, doc_id, save=True):
+        """Tombstone a document's entries; False if it was not indexed."""
+        with self._lock:
+            if not self._tombstone(doc_id):
+                return False
+            if self._dead > self.compact_fraction * self._size:
+                self._compact()
+            if save:
+                self._save()
+            return True
+
+    def _tombstone(self, doc_id):
+        entry = self._docs.get(doc_id)
+        if entry is None or not entry[2]:
+            return False
+        start, count, _ = entry
+        entry[2] = False
+        self._alive[start:start + count] = False
+        self._dead += count
+        return True
+
+    def _compact(self):
+        keep = np.flatnonzero(self._alive[:self._size])
+        docs = {}
+        for doc_id, (start, count, alive) in sorted(self._docs.items(), key=lambda kv: kv[1][0]):
+            if alive:
+                docs[doc_id] = [start, count, True]
+        remap = np.full(self._size, -1, dtype=np.int64)
+        remap[keep] = np.arange(len(keep))
+        for entry in docs.values():
+            entry[0] = int(remap[entry[0]])
+        self._codes = self._codes[keep]
+        self._scales = self._scales[keep]
+        self._assign = self._assign[keep]
+        self._section_of = self._section_of[keep]
+        self._alive = np.ones(len(keep), dtype=bool)
+        self._doc_of = [self._doc_of[i] for i in keep]
+        self._docs = docs
+        self._size = len(keep)
+        self._dead = 0
+        self._rebuild_lists()
+        logger.info(f"Section index compacted to {self._size} entries")
+
+    def _maybe_retrain(self):
+        live = self._size - self._dead
+        if live < self.train_min:
+            return
+        if self.centroids is not None and live < self.retrain_factor * self.trained_size:
+            return
+        self.train()
+
+    def train(self, seed=0):
+        """(Re)build the centroids from the live entries and re-file every entry."""
+        with self._lock:
+            live_ids = np.flatnonzero(self._alive[:self._size])
+            if not len(live_ids):
+                return
+            nlist = int(min(max(16, np.sqrt(len(live_ids))), len(live_ids)))
+            rng = np.random.default_rng(seed)
+            # 64 points per list is plenty to place the centroids
+            sample = live_ids if len(live_ids) <= 64 * nlist else rng.choice(live_ids, 64 * nlist, replace=False)
+            # exact vectors, so the lists do not depend on the in-memory codec
+            self.centroids = spherical_kmeans(self._full_vectors(np.sort(sample)), nlist, seed=seed)
+            for start in range(0, self._size, ASSIGN_BLOCK_ROWS):
+                rows = np.arange(start, min(start + ASSIGN_BLOCK_ROWS, self._size))
+                self._assign[rows] = _nearest_centroid(self._full_vectors(rows), self.centroids)
+            self.trained_size = len(live_ids)
+            self._rebuild_lists()
+            logger.info(f"Section index trained: {nlist} lists over {len(live_ids)} entries")
+
+    def sync(self, doc_ids, load_vectors=None):
+        """
+        Index any of doc_ids not yet in the index (e.g. documents stored before it existed).
+        load_vectors overrides the index's loader here, outside the lock, e.g. with one
+        that embeds documents stored under another model.
+        """
+        load_vectors = load_vectors or self.load_vectors
+        added = 0
+        for doc_id in doc_ids:
+            if doc_id in self._docs:
+                continue
+            vectors = load_vectors(doc_id)
+            if vectors is not None and len(vectors):
+                self.add(doc_id, vectors, save=False)
+                added += 1
+        if added:
+            with self._lock:
+                self._save()
+        return added
+
+    # ------------------------------------------------------------------ search
+    def _approx_scores(self, query, rows=None):
+        """First-pass scores from the compact copy for entry ids rows (every entry if None)."""
+        n = self._size if rows is None else len(rows)
+        scores = np.empty(n, dtype=np.float32)
+        for start in range(0, n, ASSIGN_BLOCK_ROWS):
+            stop = min(start + ASSIGN_BLOCK_ROWS, n)
+            block = slice(start, stop) if rows is None else rows[start:stop]
+            codes = self._codes[block]
+            if codes.dtype != np.float32:
+                codes = codes.astype(np.float32)
+            scores[start:stop] = (codes @ query) * self._scales[block]
+        return scores
+
+    def _snapshot(self, entries):
+        """
+        What _exact_vectors needs about entries, copied under the lock: their doc ids,
+        section numbers, the documents' index records and the compact copies.
+        """
+        doc_ids = [self._doc_of[entry] for entry in entries.tolist()]
+        records = {doc_id: self._docs[doc_id] for doc_id in set(doc_ids)}
+        return doc_ids, self._section_of[entries], records, dequantize(self._codes[entries], self._scales[entries])
+
+    def _exact_vectors(self, snapshot):
+        """
+        Exact float32 vectors of a _snapshot, read from the document store; rows whose
+        vectors are gone fall back to the compact copy.
+        """
+        doc_ids, sections, records, out = snapshot
+        by_doc = {}
+        for pos, doc_id in enumerate(doc_ids):
+            by_doc.setdefault(doc_id, []).append(pos)
+        for doc_id, positions in by_doc.items():
+            vectors = self.load_vectors(doc_id)
+            if vectors is not None and vectors.shape == (records[doc_id][1], self.dim):
+                out[positions] = vectors[sections[positions]]
+        return out
+
+    def _full_vectors(self, entries):
+        """Exact float32 vectors of the given entries (call with the lock held)."""
+        entries = np.asarray(entries, dtype=np.int64)
+        if self.codec == "float32":
+            return self._codes[entries]
+        return self._exact_vectors(self._snapshot(entries))
+
+    def candidates(self, queries, nprobe=None):
+        """
+        IVF candidates for a batch of unit query vectors, for callers that rank them
+        themselves (the section graph): [(query rows, doc_ids, sections, vectors)], one
+        group per probed list, vectors being the live members' compact copies as float32.
+        While the index is untrained every live entry is one group for all the queries.
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(len(queries), -1)
+        with self._lock:
+            if self._size == 0 or not len(queries):
+                return []
+            if self.centroids is None:
+                groups = [(np.arange(len(queries)), np.flatnonzero(self._alive[:self._size]))]
+            else:
+                nprobe = min(nprobe or self.nprobe, len(self.centroids))
+                probe = np.argpartition(-(queries @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+                groups = []
+                for lst in np.unique(probe).tolist():
+                    members = self._lists[lst]
+                    groups.append((np.flatnonzero((probe == lst).any(axis=1)), members[self._alive[members]]))
+            return [(rows, [self._doc_of[e] for e in members.tolist()], self._section_of[members],
+                     dequantize(self._codes[members], self._scales[members]))
+                    for rows, members in groups if len(members)]
+
+    def search(self, query, k=10, nprobe=None, exact=False, with_vectors=False):
+        """
+        Best k live entries for a unit query vector: [(doc_id, section, score)], best first.
+        exact=True scans every entry (the brute-force baseline) instead of nprobe lists.
+        with_vectors=True returns (hits, vectors) instead, vectors being the hits' exact
+        float32 vectors, (len(hits), dim), taken from the same snapshot as the hits.
+        The lock covers the first pass only; the exact vectors are read after it is
+        released, and rows of documents removed or re-added meanwhile keep the compact copy.
+        """
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        empty = ([], np.zeros((0, self.dim), dtype=np.float32)) if with_vectors else []
+        if k < 1:
+            return empty
+        with self._lock:
+            if self._size == 0:
+                return empty
+            if exact or self.centroids is None:
+                # one pass over the whole matrix beats gathering the live rows first
+                scores = self._approx_scores(query)
+                candidates = np.flatnonzero(self._alive[:self._size])
+                scores = scores[candidates]
+            else:
+                nprobe = min(nprobe or self.nprobe, len(self.centroids))
+                probe = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+                candidates = np.concatenate([self._lists[p] for p in probe])
+                candidates = candidates[self._alive[candidates]]
+                scores = self._approx_scores(query, candidates)
+            if not len(candidates):
+                return empty
+            # shortlist on the compact scores (float32 ones are exact: no rescoring needed)
+            short = min(len(candidates), k * self.rescore if self.codec != "float32" else k)
+            keep = np.argpartition(-scores, short - 1)[:short]
+            candidates = candidates[keep]
+            scores = scores[keep]
+            snapshot = self._snapshot(candidates)
+
+        doc_ids, sections, records, compact = snapshot
+        if self.codec != "float32":
+            vectors = self._exact_vectors(snapshot)
+            with self._lock:
+                # removed or re-added while the files were read: keep the compact copy
+                stale = [pos for pos, doc_id in enumerate(doc_ids)
+                         if self._docs.get(doc_id) is not records[doc_id] or not records[doc_id][2]]
+            if stale:
+                vectors[stale] = compact[stale]
+            scores = vectors @ query
+        else:
+            vectors = compact
+        k = min(k, len(candidates))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.lexsort((candidates[top], -scores[top]))]
+        hits = [(doc_ids[i], int(sections[i]), float(scores[i])) for i in top]
+        return (hits, vectors[top]) if with_vectors else hits
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": self._size,
+                "live_entries": self._size - self._dead,
+                "tombstones": self._dead,
+                "documents": sum(1 for e in self._docs.values() if e[2]),
+                "lists": len(self.centroids) if self.centroids is not None else 0,
+                "nprobe": self.nprobe,
+                "trained_size": self.trained_size,
+                "dim": self.dim,
+                "codec": self.codec,
+                "resident_bytes": int(self._codes[:self._size].nbytes + self._scales[:self._size].nbytes),
+            }
+
+
+def _clustered_corpus(n, dim, clusters, seed=0):
+    """Unit vectors scattered around random topic centres, a stand-in for section embeddings."""
+    rng = np.random.default_rng(seed)
+    centres = _normalize(rng.standard_normal((clusters, dim)).astype(np.float32))
+    vectors = centres[rng.integers(clusters, size=n)] + 0.06 * rng.standard_normal((n, dim)).astype(np.float32)
+    return _normalize(vectors).astype(np.float32)
+
+
+if __name__ == '__main__':
+    # recall@k + latency of search() against exact search:
+    #   python sectionIndex.py [--vectors document_store/vectors/<model_tag>] [--n 20000]
+    import argparse
+    import sys
+    import tempfile
+    import time
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="IVF search recall and latency against exact search")
+    parser.add_argument("--vectors", help="stored section vectors (<DOC_STORE_DIR>/vectors/<model_tag>); synthetic if omitted")
+    parser.add_argument("--n", type=int, default=20000, help="synthetic sections")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--codecs", default="int8,float16,float32")
+    parser.add_argument("--nprobe", default="4,8,16,32")
+    args = parser.parse_args()
+
+    docs = {}
+    if args.vectors:
+        for shard, _, names in sorted(os.walk(args.vectors)):
+            for name in sorted(names):
+                if name.endswith(".npy"):
+                    docs[name[:-len(".npy")]] = np.load(os.path.join(shard, name), mmap_mode="r")
+    else:
+        corpus = _clustered_corpus(args.n, args.dim, clusters=max(8, args.n // 50))
+        docs = {f"doc{i}": corpus[i:i + 50] for i in range(0, args.n, 50)}
+    if not docs:
+        print("no stored vectors found")
+        sys.exit(1)
+    all_vectors = np.concatenate([np.asarray(v, dtype=np.float32) for v in docs.values()])
+    rng = np.random.default_rng(1)
+    # queries: perturbed corpus vectors, so each has true neighbours nearby
+    queries = all_vectors[rng.integers(len(all_vectors), size=args.queries)]
+    queries = _normalize(queries + 0.06 * rng.standard_normal(queries.shape).astype(np.float32))
+    print(f"{len(all_vectors)} sections in {len(docs)} documents, dim {all_vectors.shape[1]}, "
+          f"{args.queries} queries, recall@{args.k}")
+
+    def timed(fn):
+        times, results = [], []
+        for q in queries:
+            t = time.perf_counter()
+            results.append(fn(q))
+            times.append(time.perf_counter() - t)
+        return results, np.array(times) * 1000
+
+    def brute_force(q):
+        return set(np.argpartition(-(all_vectors @ q), args.k - 1)[:args.k].tolist())
+
+    truth, ms = timed(brute_force)
+    print(f"{'float32 brute force':>24}: p50 {np.median(ms):6.2f} ms  mean {ms.mean():6.2f} ms  (baseline)")
+    offsets = dict(zip(docs, np.cumsum([0] + [len(v) for v in docs.values()]).tolist()))
+
+    def recall(results):
+        found = [{offsets[d] + s for d, s, _ in hits} for hits in results]
+        return np.mean([len(f & t) / len(t) for f, t in zip(found, truth)])
+
+    for codec in args.codecs.split(","):
+        with tempfile.TemporaryDirectory() as root:
+            index = SectionIndex(root, load_vectors=docs.get, codec=codec)
+            for doc_id, vectors in docs.items():
+                index.add(doc_id, vectors, save=False)
+            index.train()
+            results, ms = timed(lambda q: index.search(q, k=args.k, exact=True))
+            print(f"{codec + ' exact':>24}: p50 {np.median(ms):6.2f} ms  mean {ms.mean():6.2f} ms  "
+                  f"recall {recall(results):.3f}")
+            for nprobe in [int(p) for p in args.nprobe.split(",")]:
+                results, ms = timed(lambda q: index.search(q, k=args.k, nprobe=nprobe))
+                print(f"{f'{codec} nprobe={nprobe}':>24}: p50 {np.median(ms):6.2f} ms  mean {ms.mean():6.2f} ms  "
+                      f"recall {recall(results):.3f}  ({len(index.centroids)} lists)")
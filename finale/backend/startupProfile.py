@@ -0,0 +1,140 @@
+# startupProfile.py
+# Startup cost accounting and lazy imports for the backend process.
+# FAST_START=1 defers heavy dependencies (torch/sentence_transformers, LLM, TTS) and model
+# loads to their first use; either way every import and model load is timed so
+# /startup_report can show where a worker's startup seconds and memory go.
+import importlib
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+FAST_START = os.getenv("FAST_START", "0") == "1"
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is in KiB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+class StartupProfile:
+    """Timeline of imports and model loads: what, for which subsystem, how long, peak RSS after."""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self._entries = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def measure(self, kind, name, subsystem):
+        t = time.perf_counter()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            self.record(kind, name, subsystem, time.perf_counter() - t, started=t, error=error)
+
+    def record(self, kind, name, subsystem, seconds, started=None, error=None):
+        entry = {
+            "kind": kind,
+            "name": name,
+            "subsystem": subsystem,
+            "seconds": round(seconds, 4),
+            "at_seconds": round((started if started is not None else self._t0) - self._t0, 4),
+            "peak_rss_mb": _peak_rss_mb(),
+        }
+        if error is not None:
+            entry["error"] = error
+        with self._lock:
+            self._entries.append(entry)
+        logger.info(f"[startup] {kind} {name} ({subsystem}): {entry['seconds']:.3f}s")
+
+    def elapsed(self):
+        return time.perf_counter() - self._t0
+
+    def report(self):
+        with self._lock:
+            entries = list(self._entries)
+        by_subsystem = {}
+        for e in entries:
+            totals = by_subsystem.setdefault(e["subsystem"], {"import_seconds": 0.0, "load_seconds": 0.0})
+            key = "import_seconds" if e["kind"] == "import" else "load_seconds"
+            totals[key] = round(totals[key] + e["seconds"], 4)
+        return {
+            "fast_start": FAST_START,
+            "started_at": self.started_at,
+            "uptime_seconds": round(self.elapsed(), 3),
+            "peak_rss_mb": _peak_rss_mb(),
+            "subsystems": by_subsystem,
+            "entries": entries,
+        }
+
+
+profile = StartupProfile()
+
+
+class LazyModule:
+    """Stands in for a module and imports it (timed) on first attribute access."""
+
+    def __init__(self, module_name, subsystem):
+        self._module_name = module_name
+        self._subsystem = subsystem
+        self._module = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    with profile.measure("import", self._module_name, self._subsystem):
+                        self._module = importlib.import_module(self._module_name)
+        return self._module
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self.loaded else "not loaded"
+        return f"<LazyModule {self._module_name} ({state})>"
+
+
+def in_spawned_worker():
+    """
+    True in a spawn/forkserver child (the PDF parse pool), which re-imports the main
+    script as __mp_main__ before running its task: heavy imports and start-up side
+    effects are skipped there.
+    """
+    # the re-run script is registered as __mp_main__ while it executes; in the parent,
+    # multiprocessing aliases __mp_main__ to the real __main__
+    return getattr(sys.modules.get('__mp_main__'), '__name__', None) == '__mp_main__'
+
+
+def lazy_import(module_name, subsystem):
+    """
+    The module for subsystem: a LazyModule under FAST_START (or in a spawned worker),
+    otherwise imported now. Both are used the same way (module.attr), so call sites do
+    not care which they got.
+    """
+    module = LazyModule(module_name, subsystem)
+    if not FAST_START and not in_spawned_worker():
+        module.load()
+    return module
@@ -0,0 +1,75 @@
+# warmup.py
+import logging
+import threading
+import time
+
+from startupProfile import profile
+
+logger = logging.getLogger(__name__)
+
+
+class Warmup:
+    """
+    Readiness gate for /readyz.
+    - steps is a list of (name, subsystem, fn); each fn loads and exercises one model
+      and may return a dict of extra timings for the status report.
+    - run() executes the steps once, in order, in the calling thread; start() does the
+      same on a daemon thread so an imported app (WSGI worker) can answer /healthz while
+      it warms up. Concurrent callers wait for the single run.
+    - Any failing step leaves the process not ready, with the error reported.
+    """
+
+    def __init__(self, steps):
+        self.steps = steps
+        self.state = "pending"
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self.results = {}
+        self._run_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None and self.state == "pending":
+                self._thread = threading.Thread(target=self.run, name="warmup", daemon=True)
+                self._thread.start()
+
+    def run(self):
+        with self._run_lock:
+            if self.state in ("ready", "failed"):
+                return self.ready()
+            self.state = "running"
+            self.started_at = time.time()
+            logger.info("Warm-up started")
+            for name, subsystem, fn in self.steps:
+                t = time.perf_counter()
+                try:
+                    with profile.measure("warmup", name, subsystem):
+                        details = fn() or {}
+                except Exception as e:
+                    logger.exception(f"Warm-up step {name} failed")
+                    self.results[name] = {"ok": False, "seconds": round(time.perf_counter() - t, 4), "error": str(e)}
+                    self.error = f"{name}: {e}"
+                    self.state = "failed"
+                    break
+                self.results[name] = {"ok": True, "seconds": round(time.perf_counter() - t, 4), **details}
+            else:
+                self.state = "ready"
+            self.finished_at = time.time()
+            logger.info(f"Warm-up {self.state} in {self.finished_at - self.started_at:.2f}s")
+            return self.ready()
+
+    def ready(self):
+        return self.state == "ready"
+
+    def status(self):
+        return {
+            "state": self.state,
+            "ready": self.ready(),
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "steps": dict(self.results),
+        }